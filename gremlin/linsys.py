@@ -8,8 +8,46 @@ class NoSolutionsExist(Exception):
     pass
 
 def eliminate(mat):
+    """Gauss-Jordan elimination of the augmented matrix `mat`, in place.
+    
+    Same pivoting and back-substitution order as `eliminate_loops` (so the
+    reduced matrix is identical), but every row operation is done as a
+    whole-array numpy operation"""
+    m, n = mat.shape
+    if m > n:
+        raise ValueError("more rows than columns")
+    
+    for y in range(0, m):
+        # Find max pivot (argmax keeps the first maximum, like the loop version)
+        maxrow = y + int(numpy.argmax(numpy.abs(mat[y:, y])))
+        if maxrow != y:
+            mat[[y, maxrow],:] = mat[[maxrow, y],:]
+        if abs(mat[y, y]) <= EPSILON:
+            # Singular
+            continue
+        # Eliminate column y
+        c = mat[y+1:, y] / mat[y, y]
+        mat[y+1:, y:] -= numpy.outer(c, mat[y, y:])
+    
+    # Backsubstitute
+    for y in range(m-1, -1, -1):
+        nonzero = numpy.flatnonzero(numpy.abs(mat[y]) > EPSILON)
+        if not len(nonzero):
+            continue
+        i = nonzero[0]
+        c = mat[y, i]
+        # round-off left below the diagonal can put i before y; the loop
+        # version never touches the columns before y in that case
+        x = max(i, y)
+        mat[:y, x:] -= numpy.outer(mat[:y, i], mat[y, x:]) / c
+        # Normalize row y
+        mat[y, i:] /= c
+
+def eliminate_loops(mat):
     """Original code by Jarno Elonen, Public Domain
-    http://elonen.iki.fi/code/misc-notes/python-gaussj/index.html"""
+    http://elonen.iki.fi/code/misc-notes/python-gaussj/index.html
+    
+    Scalar reference implementation of `eliminate`, kept for comparison"""
     m, n = mat.shape
     if m > n:
         raise ValueError("more rows than columns")
@@ -0,0 +1,303 @@
+"""
+Benchmarks of the linear algebra. ``python bench.py [size ...]`` compares the
+vectorized ``gremlin.linsys.eliminate`` against the scalar
+``gremlin.linsys.eliminate_loops`` it replaced (take2 reduces with
+``linsys.rref`` instead); ``python bench.py layouts [options] [size ...]``
+times every phase of solving generated layout systems, with both
+``gremlin.linsys`` and this ``linsys``, and prints one JSON record per run
+(see bench_layouts);
+``python bench.py passes [size ...]`` compares LinSys.solve with and
+without its presolve and definitions passes (see bench_passes)
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import itertools
+import numpy
+from collections import OrderedDict
+import linsys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from gremlin import linsys as gremlin_linsys
+
+BACKENDS = OrderedDict([("gremlin", gremlin_linsys), ("take2", linsys)])
+# the elimination each backend's solve_matrix runs, timed as the "eliminate" phase
+ELIMINATE = {"gremlin" : gremlin_linsys.eliminate, "take2" : linsys.rref}
+SCENARIOS = ["wide", "tall", "nested", "grid", "form"]
+# the order ConstraintSolver sorts the variables by, least free first
+FREENESS = ["offset", "cons", "user", None, "padding", "input"]
+
+
+def random_system(size, terms = 3, seed = 0):
+    """a layout-like augmented matrix: `size` equations over `size` variables,
+    each touching a handful of variables with +-1 coefficients"""
+    rnd = numpy.random.RandomState(seed)
+    mat = numpy.zeros((size, size + 1), float)
+    for i in range(size):
+        cols = rnd.choice(size, terms, replace = False)
+        mat[i, cols] = rnd.choice([-1.0, 1.0], terms)
+        mat[i, i] = 1.0
+        mat[i, -1] = rnd.randint(0, 500)
+    return mat
+
+def best_time(func, mat, repeat):
+    best = None
+    for _ in range(repeat):
+        work = mat.copy()
+        t0 = time.time()
+        func(work)
+        t = time.time() - t0
+        if best is None or t < best:
+            best = t
+    return best, work
+
+def bench_eliminate(sizes, repeat = 3):
+    print "%8s %12s %12s %9s %6s" % ("size", "loops (s)", "numpy (s)", "speedup", "same")
+    for size in sizes:
+        mat = random_system(size)
+        t_loops, res_loops = best_time(gremlin_linsys.eliminate_loops, mat, repeat)
+        t_numpy, res_numpy = best_time(gremlin_linsys.eliminate, mat, repeat)
+        print "%8d %12.4f %12.4f %8.1fx %6s" % (size, t_loops, t_numpy, t_loops / max(t_numpy, 1e-9),
+            numpy.array_equal(res_loops, res_numpy))
+
+#===================================================================================================
+# generated layouts
+#===================================================================================================
+class LayoutGenerator(object):
+    """Emits the equations dsl's layout nodes would, but with the LinVar, LinEq
+    and LinSum of the given linsys `module`, so the very same system can be
+    built for either implementation. Nodes are ``(w, h)`` pairs of LinVars;
+    atoms get a random fixed width and height, or are left to the layout"""
+    def __init__(self, module, seed = 0):
+        self.module = module
+        self.rnd = random.Random(seed)
+        self.equations = []
+        self._counter = itertools.count()
+
+    def var(self, prefix, kind):
+        return self.module.LinVar("_%s%d" % (prefix, self._counter.next()), kind)
+    def equal(self, lhs, rhs):
+        self.equations.append(self.module.LinEq(lhs, rhs))
+    def sum(self, *terms):
+        """the sum of `terms`, accumulated in a LinSumBuilder where `module`
+        has one (gremlin's linsys does not)"""
+        builder = getattr(self.module, "LinSumBuilder", None)
+        if builder is None:
+            return self.module.LinSum(*terms)
+        return builder(*terms).build()
+
+    def atom(self, width = None, height = None):
+        w = self.var("w", "cons")
+        h = self.var("h", "cons")
+        if width is None:
+            width = self.rnd.choice([None, 20, 30, 40])
+        if height is None:
+            height = self.rnd.choice([None, 10, 20])
+        if width is not None:
+            self.equal(w, width)
+        if height is not None:
+            self.equal(h, height)
+        return w, h
+
+    def box(self, children, horizontal):
+        """an HLayoutNode (or VLayoutNode) of `children`"""
+        w = self.var("w", "cons")
+        h = self.var("h", "cons")
+        total = self.var("t", "cons")
+        scroll = self.var("s", "padding")
+        main, cross = (0, 1) if horizontal else (1, 0)
+        prev = None
+        for child in children:
+            offset = self.var("o", "offset")
+            if prev is None:
+                self.equal(offset, 0)
+            else:
+                self.equal(offset, self.sum(prev[0], prev[1][main]))
+            prev = offset, child
+        self.equal(total, self.sum(*[child[main] for child in children]))
+        self.equal((w, h)[main], self.sum(total, scroll))
+        for child in children:
+            self.equal((w, h)[cross], self.sum(child[cross], self.var("p", "padding")))
+        return w, h
+
+    def window(self, root):
+        """binds `root` to the window size; returns the LinSys"""
+        self.equal(root[0], self.module.LinVar("window_width", "input"))
+        self.equal(root[1], self.module.LinVar("window_height", "input"))
+        return self.module.LinSys(self.equations)
+
+    #
+    # scenarios of about `size` variables: every atom in a box costs four
+    # (its size, its offset and its padding)
+    #
+    def wide(self, size):
+        return self.window(self.box([self.atom() for _ in range(max(2, size // 4))], True))
+    def tall(self, size):
+        return self.window(self.box([self.atom() for _ in range(max(2, size // 4))], False))
+    def nested(self, size):
+        """alternating horizontal and vertical boxes of two; with the boxes
+        themselves, that is about ten variables per atom"""
+        def build(depth, horizontal):
+            if depth == 0:
+                return self.atom()
+            return self.box([build(depth - 1, not horizontal) for _ in range(2)], horizontal)
+        return self.window(build(max(1, int(round(math.log(max(2, size // 10), 2)))), True))
+    def grid(self, size):
+        """rows of cells, the cells of each column sharing a width LinVar"""
+        atoms = max(2, size // 4)
+        ncols = max(1, int(math.sqrt(atoms)))
+        widths = [self.var("cw", "user") for _ in range(ncols)]
+        for w in widths[::2]:
+            self.equal(w, self.rnd.choice([20, 30, 40]))
+        rows = []
+        for _ in range(max(1, atoms // ncols)):
+            rows.append(self.box([self.atom(w, 20) for w in widths], True))
+        return self.window(self.box(rows, False))
+    def form(self, size):
+        """stacked rows of a label and two fields of a fixed height: about
+        eighteen variables per row"""
+        rows = [self.box([self.atom(), self.atom(height = 20), self.atom(height = 20)], True)
+            for _ in range(max(1, size // 18))]
+        return self.window(self.box(rows, False))
+
+def generate(module, scenario, size, seed = 0):
+    """the `scenario` system of about `size` variables, built with `module`"""
+    return getattr(LayoutGenerator(module, seed), scenario)(size)
+
+def _timed(times, phase, repeat, func):
+    best = None
+    for _ in range(repeat):
+        t0 = time.time()
+        result = func()
+        t = time.time() - t0
+        if best is None or t < best:
+            best = t
+    times[phase] = best
+    return result
+
+class _Values(dict):
+    """variable -> value, resolving the assignments on demand the way
+    ConstraintSolver.update does (gremlin's back-substitution can leave a
+    dependent variable referring to another one), with every free variable
+    set to 10"""
+    def __init__(self, assignments):
+        dict.__init__(self)
+        self.assignments = assignments
+    def __missing__(self, var):
+        value = self.assignments[var]
+        if isinstance(value, (linsys.FreeVar, gremlin_linsys.FreeVar)):
+            value = 10.0
+        elif hasattr(value, "eval"):
+            value = value.eval(self)
+        self[var] = value
+        return value
+
+def _evaluate(assignments):
+    values = _Values(assignments)
+    return [values[var] for var in assignments]
+
+def bench_layout(backend, scenario, size, repeat = 1, dense_limit = 2000, seed = 0):
+    """times the phases of solving one generated system with `backend` (a
+    BACKENDS key); returns the record. The dense phases (to_matrix,
+    eliminate, solve_matrix and the plain LinSys.solve) are skipped above
+    `dense_limit` variables, where the matrix alone takes n^2 memory; the
+    sparse solve only exists in take2"""
+    module = BACKENDS[backend]
+    times = OrderedDict()
+    skipped = []
+    ls = generate(module, scenario, size, seed)
+    variables = _timed(times, "get_vars", repeat, ls.get_vars)
+    order = sorted(variables, key = lambda v: FREENESS.index(v.kind))
+    record = OrderedDict([("backend", backend), ("scenario", scenario), ("size", size),
+        ("variables", len(variables)), ("equations", len(ls.equations))])
+
+    assignments = None
+    if len(variables) <= dense_limit:
+        vars_indexes = dict((v, i) for i, v in enumerate(order))
+        mat, vars = _timed(times, "to_matrix", repeat, lambda: ls.to_matrix(vars_indexes))  # @ReservedAssignment
+        record["nonzeros"] = int(numpy.count_nonzero(mat[:, :-1]))
+        try:
+            _timed(times, "eliminate", repeat, lambda: ELIMINATE[backend](mat.copy()))
+        except ValueError:
+            # more equations than variables; only solve_matrix copes with those
+            skipped.append("eliminate")
+        assignments = _timed(times, "solve_matrix", repeat, lambda: module.solve_matrix(mat.copy(), list(vars)))
+        _timed(times, "solve", repeat, lambda: ls.solve(order))
+    else:
+        skipped.extend(["to_matrix", "eliminate", "solve_matrix", "solve"])
+    if backend == "take2":
+        sparse = _timed(times, "solve_sparse", repeat, lambda: ls.solve(order, sparse = True))
+        if assignments is None:
+            assignments = sparse
+    else:
+        skipped.append("solve_sparse")
+    if assignments is not None:
+        record["free"] = sum(1 for v in assignments.values() if isinstance(v, (linsys.FreeVar,
+            gremlin_linsys.FreeVar)))
+        _timed(times, "evaluate", repeat, lambda: _evaluate(assignments))
+    else:
+        skipped.append("evaluate")
+
+    record["times"] = times
+    record["skipped"] = skipped
+    return record
+
+def bench_layouts(sizes, scenarios = SCENARIOS, backends = BACKENDS.keys(), repeat = 1, dense_limit = 2000,
+        out = sys.stdout):
+    """runs every scenario at every size with every backend, writing one JSON
+    object per line to `out`"""
+    for size in sizes:
+        for scenario in scenarios:
+            for backend in backends:
+                record = bench_layout(backend, scenario, size, repeat, dense_limit)
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+
+def bench_passes(sizes, scenarios = SCENARIOS, repeat = 3, out = sys.stdout):
+    """times take2's LinSys.solve on every scenario with the default passes,
+    without presolve, with the definitions pass only peeling (no
+    substitutions, see linsys.DEFINITION_FILL) and with neither pass"""
+    out.write("%8s %8s %12s %12s %12s %12s\n" % ("scenario", "size", "default (s)", "no presolve", "peel only", 
+        "no passes"))
+    for size in sizes:
+        for scenario in scenarios:
+            ls = generate(linsys, scenario, size)
+            order = sorted(ls.get_vars(), key = lambda v: FREENESS.index(v.kind))
+            times = OrderedDict()
+            _timed(times, "default", repeat, lambda: ls.solve(order))
+            _timed(times, "no presolve", repeat, lambda: ls.solve(order, presolve = False))
+            fill, linsys.DEFINITION_FILL = linsys.DEFINITION_FILL, 0
+            try:
+                _timed(times, "peel only", repeat, lambda: ls.solve(order))
+            finally:
+                linsys.DEFINITION_FILL = fill
+            _timed(times, "no passes", repeat, lambda: ls.solve(order, presolve = False, definitions = False))
+            out.write("%8s %8d %s\n" % (scenario, size, " ".join("%12.4f" % t for t in times.values())))
+            out.flush()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["layouts"]:
+        # the back-substitution chains get as deep as the layouts are large
+        sys.setrecursionlimit(100000)
+        parser = argparse.ArgumentParser(prog = "bench.py layouts")
+        parser.add_argument("sizes", nargs = "*", type = int, default = [10, 100, 1000, 5000, 20000],
+            help = "approximate number of variables")
+        parser.add_argument("--scenario", action = "append", choices = SCENARIOS)
+        parser.add_argument("--backend", action = "append", choices = BACKENDS.keys())
+        parser.add_argument("--repeat", type = int, default = 1, help = "best of this many runs")
+        parser.add_argument("--dense-limit", type = int, default = 2000,
+            help = "skip the dense phases above this many variables")
+        args = parser.parse_args(sys.argv[2:])
+        bench_layouts(args.sizes, args.scenario or SCENARIOS, args.backend or BACKENDS.keys(), args.repeat,
+            args.dense_limit)
+    elif sys.argv[1:2] == ["passes"]:
+        sys.setrecursionlimit(100000)
+        bench_passes([int(arg) for arg in sys.argv[2:]] or [1000, 4000])
+    else:
+        sizes = [int(arg) for arg in sys.argv[1:]] or [25, 50, 100, 200]
+        bench_eliminate(sizes)
@@ -0,0 +1,440 @@
+"""
+An incremental simplex solver in the style of Cassowary (following the
+design of the kiwi implementation), alongside linsys.LinSys: it handles
+inequalities and non-required constraints of different strengths, and edit
+variables whose suggested values are absorbed by a few dual simplex pivots,
+so dragging the window does not re-evaluate every variable
+"""
+import itertools
+from linsys import NoSolutionsExist, LinEq, LinVar, _equation_terms, symbols
+
+
+def create_strength(a, b, c, w = 1.0):
+    """a strength out of (strong, medium, weak) parts, each within [0, 1000]"""
+    clip = lambda v: max(0.0, min(1000.0, v))
+    return clip(a * w) * 1000000.0 + clip(b * w) * 1000.0 + clip(c * w)
+
+REQUIRED = create_strength(1000.0, 1000.0, 1000.0)
+STRONG = create_strength(1.0, 0.0, 0.0)
+MEDIUM = create_strength(0.0, 1.0, 0.0)
+WEAK = create_strength(0.0, 0.0, 1.0)
+
+EPSILON = 1e-8
+
+def _near_zero(value):
+    return abs(value) < EPSILON
+
+class UnsatisfiableConstraint(NoSolutionsExist):
+    pass
+
+class Constraint(object):
+    """``lhs op rhs``, where `op` is one of "==", "<=" and ">=", and both sides
+    are anything a LinEq side can be. Compared by identity"""
+    __slots__ = ["terms", "constant", "op", "strength", "text"]
+    OPS = ("==", "<=", ">=")
+    def __init__(self, lhs, op, rhs = 0, strength = REQUIRED):
+        if op not in self.OPS:
+            raise ValueError("unknown operator %r" % (op,))
+        eq = LinEq(lhs, rhs)
+        terms, const = _equation_terms(eq)
+        # kept as ``sum(coeff * var) + constant op 0``
+        self.terms = terms
+        self.constant = -float(const)
+        self.op = op
+        self.strength = max(0.0, min(REQUIRED, strength))
+        self.text = "%r %s %r" % (eq.lhs, op, eq.rhs)
+    def __repr__(self):
+        return "<Constraint %s, strength %r>" % (self.text, self.strength)
+
+    @classmethod
+    def from_lineq(cls, eq, strength = REQUIRED):
+        return cls(eq.lhs, "==", eq.rhs, strength)
+
+#===================================================================================================
+# tableau
+#===================================================================================================
+# symbols are ints, with their kind in the lowest two bits
+EXTERNAL = 0
+SLACK = 1
+ERROR = 2
+DUMMY = 3
+
+def _kind(sym):
+    return sym & 3
+
+def _is_pivotable(sym):
+    return sym & 3 in (SLACK, ERROR)
+
+class Row(object):
+    """``constant + sum(coeff * symbol)``; as a row of the tableau, its basic
+    symbol equals that"""
+    __slots__ = ["constant", "cells"]
+    def __init__(self, constant = 0.0, cells = None):
+        self.constant = constant
+        self.cells = dict(cells) if cells else {}
+    def copy(self):
+        return Row(self.constant, self.cells)
+
+    def add(self, value):
+        self.constant += value
+        return self.constant
+    def insert_symbol(self, sym, coeff = 1.0):
+        coeff += self.cells.get(sym, 0.0)
+        if _near_zero(coeff):
+            self.cells.pop(sym, None)
+        else:
+            self.cells[sym] = coeff
+    def insert_row(self, row, coeff = 1.0):
+        self.constant += row.constant * coeff
+        for sym, c in row.cells.iteritems():
+            self.insert_symbol(sym, c * coeff)
+    def remove(self, sym):
+        self.cells.pop(sym, None)
+    def reverse_sign(self):
+        self.constant = -self.constant
+        for sym in self.cells:
+            self.cells[sym] = -self.cells[sym]
+    def solve_for(self, sym):
+        """rewrites ``0 = self`` as ``sym = ...``"""
+        coeff = -1.0 / self.cells.pop(sym)
+        self.constant *= coeff
+        for s in self.cells:
+            self.cells[s] *= coeff
+    def solve_for_ex(self, lhs, rhs):
+        """rewrites ``lhs = self`` as ``rhs = ...``"""
+        self.insert_symbol(lhs, -1.0)
+        self.solve_for(rhs)
+    def coefficient_for(self, sym):
+        return self.cells.get(sym, 0.0)
+    def substitute(self, sym, row):
+        coeff = self.cells.pop(sym, None)
+        if coeff is not None:
+            self.insert_row(row, coeff)
+
+class _Tag(object):
+    __slots__ = ["marker", "other"]
+    def __init__(self):
+        self.marker = None
+        self.other = None
+
+class _EditInfo(object):
+    __slots__ = ["tag", "constraint", "constant"]
+    def __init__(self, tag, constraint, constant):
+        self.tag = tag
+        self.constraint = constraint
+        self.constant = constant
+
+class SimplexSolver(object):
+    """Keeps the constraints in a simplex tableau whose objective is the
+    weighted error of the non-required constraints, re-optimizing after every
+    change. Variables (LinVars, or their names, when reading values back) are
+    added as constraints mention them, and are 0 until constrained"""
+    def __init__(self):
+        self._counter = itertools.count(1)
+        self._constraints = {}      # Constraint -> _Tag
+        self._rows = {}             # basic symbol -> Row
+        self._vars = {}             # var id -> external symbol
+        self._var_objs = {}         # var id -> LinVar
+        self._edits = {}            # var id -> _EditInfo
+        self._infeasible = []
+        self._objective = Row()
+        self._artificial = None
+    def __repr__(self):
+        return "<SimplexSolver of %d constraints, %d variables, %d edit variables>" % (len(self._constraints),
+            len(self._vars), len(self._edits))
+
+    def _symbol(self, kind):
+        return (self._counter.next() << 2) | kind
+    def _var_symbol(self, var):
+        sym = self._vars.get(var.id)
+        if sym is None:
+            sym = self._vars[var.id] = self._symbol(EXTERNAL)
+            self._var_objs[var.id] = var
+        return sym
+
+    #
+    # constraints
+    #
+    def has_constraint(self, constraint):
+        return constraint in self._constraints
+    def add_constraint(self, constraint):
+        """adds a Constraint (or a LinEq, as a required one). Raises
+        UnsatisfiableConstraint when a required constraint cannot be satisfied
+        along with the others"""
+        if isinstance(constraint, LinEq):
+            constraint = Constraint.from_lineq(constraint)
+        if constraint in self._constraints:
+            raise ValueError("%r was already added" % (constraint,))
+        tag = _Tag()
+        row = self._create_row(constraint, tag)
+        subject = self._choose_subject(row, tag)
+        if subject is None and all(_kind(sym) == DUMMY for sym in row.cells):
+            if not _near_zero(row.constant):
+                raise UnsatisfiableConstraint(constraint)
+            subject = tag.marker
+        if subject is None:
+            # the artificial variable pass pivots the whole tableau, keep a copy
+            # to roll back to should the constraint turn out unsatisfiable
+            saved = dict((sym, r.copy()) for sym, r in self._rows.iteritems()), self._objective.copy()
+            if not self._add_with_artificial_variable(row):
+                self._rows, self._objective = saved
+                del self._infeasible[:]
+                raise UnsatisfiableConstraint(constraint)
+        else:
+            row.solve_for(subject)
+            self._substitute(subject, row)
+            self._rows[subject] = row
+        self._constraints[constraint] = tag
+        self._optimize(self._objective)
+        return constraint
+    def add_constraints(self, constraints):
+        return [self.add_constraint(cons) for cons in constraints]
+
+    def remove_constraint(self, constraint):
+        tag = self._constraints.pop(constraint, None)
+        if tag is None:
+            raise KeyError(constraint)
+        # remove the error effects from the objective
+        for sym in (tag.marker, tag.other):
+            if sym is not None and _kind(sym) == ERROR:
+                row = self._rows.get(sym)
+                if row is not None:
+                    self._objective.insert_row(row, -constraint.strength)
+                else:
+                    self._objective.insert_symbol(sym, -constraint.strength)
+        # make the marker basic, then drop its row
+        if self._rows.pop(tag.marker, None) is None:
+            leaving = self._marker_leaving_row(tag.marker)
+            if leaving is None:
+                raise RuntimeError("failed to find the leaving row of %r" % (constraint,))
+            row = self._rows.pop(leaving)
+            row.solve_for_ex(leaving, tag.marker)
+            self._substitute(tag.marker, row)
+        self._optimize(self._objective)
+
+    def _create_row(self, constraint, tag):
+        row = Row(constraint.constant)
+        for var, coeff in constraint.terms:
+            if _near_zero(coeff):
+                continue
+            sym = self._var_symbol(var)
+            basic = self._rows.get(sym)
+            if basic is not None:
+                row.insert_row(basic, coeff)
+            else:
+                row.insert_symbol(sym, coeff)
+
+        strong = constraint.strength < REQUIRED
+        if constraint.op in ("<=", ">="):
+            coeff = 1.0 if constraint.op == "<=" else -1.0
+            slack = tag.marker = self._symbol(SLACK)
+            row.insert_symbol(slack, coeff)
+            if strong:
+                error = tag.other = self._symbol(ERROR)
+                row.insert_symbol(error, -coeff)
+                self._objective.insert_symbol(error, constraint.strength)
+        elif strong:
+            plus = tag.marker = self._symbol(ERROR)
+            minus = tag.other = self._symbol(ERROR)
+            row.insert_symbol(plus, -1.0)
+            row.insert_symbol(minus, 1.0)
+            self._objective.insert_symbol(plus, constraint.strength)
+            self._objective.insert_symbol(minus, constraint.strength)
+        else:
+            dummy = tag.marker = self._symbol(DUMMY)
+            row.insert_symbol(dummy)
+
+        if row.constant < 0.0:
+            row.reverse_sign()
+        return row
+
+    def _choose_subject(self, row, tag):
+        for sym in row.cells:
+            if _kind(sym) == EXTERNAL:
+                return sym
+        for sym in (tag.marker, tag.other):
+            if sym is not None and _is_pivotable(sym) and row.coefficient_for(sym) < 0.0:
+                return sym
+        return None
+
+    def _add_with_artificial_variable(self, row):
+        art = self._symbol(SLACK)
+        self._rows[art] = row.copy()
+        self._artificial = row.copy()
+        self._optimize(self._artificial)
+        success = _near_zero(self._artificial.constant)
+        self._artificial = None
+
+        basic = self._rows.pop(art, None)
+        if basic is not None:
+            if not basic.cells:
+                return success
+            entering = next((sym for sym in basic.cells if _is_pivotable(sym)), None)
+            if entering is None:
+                return False
+            basic.solve_for_ex(art, entering)
+            self._substitute(entering, basic)
+            self._rows[entering] = basic
+        for r in self._rows.itervalues():
+            r.remove(art)
+        self._objective.remove(art)
+        return success
+
+    def _substitute(self, sym, row):
+        for basic, r in self._rows.iteritems():
+            r.substitute(sym, row)
+            if _kind(basic) != EXTERNAL and r.constant < 0.0:
+                self._infeasible.append(basic)
+        self._objective.substitute(sym, row)
+        if self._artificial is not None:
+            self._artificial.substitute(sym, row)
+
+    def _optimize(self, objective):
+        while True:
+            # Bland's rule, lowest symbol first, keeps degenerate pivots from cycling
+            candidates = [sym for sym, c in objective.cells.iteritems() if _kind(sym) != DUMMY and c < 0.0]
+            if not candidates:
+                return
+            entering = min(candidates)
+            leaving = None
+            ratio = None
+            for sym, row in self._rows.iteritems():
+                if _kind(sym) == EXTERNAL:
+                    continue
+                c = row.coefficient_for(entering)
+                if c < 0.0:
+                    r = -row.constant / c
+                    if ratio is None or r < ratio or (r == ratio and sym < leaving):
+                        ratio = r
+                        leaving = sym
+            if leaving is None:
+                raise RuntimeError("the objective is unbounded")
+            row = self._rows.pop(leaving)
+            row.solve_for_ex(leaving, entering)
+            self._substitute(entering, row)
+            self._rows[entering] = row
+
+    def _dual_optimize(self):
+        while self._infeasible:
+            leaving = self._infeasible.pop()
+            row = self._rows.get(leaving)
+            if row is None or _near_zero(row.constant) or row.constant >= 0.0:
+                continue
+            entering = None
+            ratio = None
+            for sym, c in row.cells.iteritems():
+                if c > 0.0 and _kind(sym) != DUMMY:
+                    r = self._objective.coefficient_for(sym) / c
+                    if ratio is None or r < ratio:
+                        ratio = r
+                        entering = sym
+            if entering is None:
+                raise RuntimeError("dual optimization failed")
+            del self._rows[leaving]
+            row.solve_for_ex(leaving, entering)
+            self._substitute(entering, row)
+            self._rows[entering] = row
+
+    def _marker_leaving_row(self, marker):
+        r1 = r2 = None
+        first = second = third = None
+        for sym, row in self._rows.iteritems():
+            c = row.coefficient_for(marker)
+            if c == 0.0:
+                continue
+            if _kind(sym) == EXTERNAL:
+                third = sym
+            elif c < 0.0:
+                r = -row.constant / c
+                if r1 is None or r < r1:
+                    r1 = r
+                    first = sym
+            else:
+                r = row.constant / c
+                if r2 is None or r < r2:
+                    r2 = r
+                    second = sym
+        for sym in (first, second, third):
+            if sym is not None:
+                return sym
+        return None
+
+    #
+    # edit variables
+    #
+    def has_edit_variable(self, var):
+        return symbols.get(var) in self._edits
+    def add_edit_variable(self, var, strength = STRONG):
+        """makes `var` (a LinVar) an edit variable: suggest_value() then pulls it
+        towards the given values, with the given (non-required) strength"""
+        if var.id in self._edits:
+            raise ValueError("%r is already an edit variable" % (var,))
+        strength = max(0.0, min(REQUIRED, strength))
+        if strength == REQUIRED:
+            raise ValueError("edit variables cannot be required")
+        cons = self.add_constraint(Constraint(var, "==", 0, strength))
+        self._edits[var.id] = _EditInfo(self._constraints[cons], cons, 0.0)
+    def remove_edit_variable(self, var):
+        info = self._edits.pop(symbols.id_of(var), None)
+        if info is None:
+            raise KeyError(var)
+        self.remove_constraint(info.constraint)
+
+    def suggest_value(self, var, value):
+        """moves edit variable `var` (a LinVar or name) towards `value`; costs a
+        dual simplex pivot or so per constraint pushed around"""
+        info = self._edits.get(symbols.id_of(var))
+        if info is None:
+            raise KeyError(var)
+        delta = value - info.constant
+        info.constant = value
+        row = self._rows.get(info.tag.marker)
+        if row is not None:
+            if row.add(-delta) < 0.0:
+                self._infeasible.append(info.tag.marker)
+            self._dual_optimize()
+            return
+        row = self._rows.get(info.tag.other)
+        if row is not None:
+            if row.add(delta) < 0.0:
+                self._infeasible.append(info.tag.other)
+            self._dual_optimize()
+            return
+        for sym, row in self._rows.iteritems():
+            c = row.coefficient_for(info.tag.marker)
+            if c != 0.0 and row.add(delta * c) < 0.0 and _kind(sym) != EXTERNAL:
+                self._infeasible.append(sym)
+        self._dual_optimize()
+
+    #
+    # values
+    #
+    def __getitem__(self, var):
+        """the current value of `var` (a LinVar or name)"""
+        sym = self._vars[symbols.id_of(var)]
+        row = self._rows.get(sym)
+        return row.constant if row is not None else 0.0
+    def __contains__(self, var):
+        return symbols.get(var) in self._vars
+    def values(self):
+        """LinVar -> current value, for every variable"""
+        return dict((self._var_objs[id], self[id]) for id in self._vars)
+
+
+if __name__ == "__main__":
+    left = LinVar("left")
+    width = LinVar("width")
+    right = LinVar("right")
+    window_width = LinVar("window_width", "input")
+    s = SimplexSolver()
+    s.add_constraint(LinEq(right, left + width))
+    s.add_constraint(LinEq(left, 10))
+    s.add_constraint(Constraint(right, "<=", window_width - 10))
+    s.add_constraint(Constraint(width, ">=", 100))
+    s.add_constraint(Constraint(width, "<=", 400))
+    s.add_constraint(Constraint(width, "==", 300, WEAK))
+    s.add_edit_variable(window_width)
+    for w in (800, 200, 100, 500):
+        s.suggest_value(window_width, w)
+        print "window_width = %r: left = %r, width = %r, right = %r" % (s[window_width], s[left], s[width],
+            s[right])
@@ -0,0 +1,113 @@
+"""
+A persistent cache of solved systems: a LinSys is keyed by a hash of its
+canonical content (the equations, independent of their order, and the
+freeness order) and its affine solution is stored in a ``.npz`` file, so a
+later process solving the same layout just loads it
+"""
+import os
+import zipfile
+import hashlib
+import tempfile
+import numpy
+from linsys import AffineExpr, FreeVar, symbols, _pivot_assignments
+
+# bump whenever the file layout or the key derivation changes
+FORMAT_VERSION = 1
+
+
+class DiskCache(object):
+    """solutions stored as ``<key>.npz`` files under `directory`"""
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    def __repr__(self):
+        return "<DiskCache %r, %d hits, %d misses>" % (self.directory, self.hits, self.misses)
+
+    def key(self, linsys, freevars = ()):
+        """the hex digest identifying `linsys` solved with `freevars`: variables
+        are identified by name, equations by their sorted terms and constant"""
+        names = symbols.names
+        rows = sorted((tuple(sorted((names[id], float(coeff)) for id, coeff in varbins.iteritems())),
+            float(scalar)) for varbins, scalar in linsys._iter_rows())
+        digest = hashlib.sha1()
+        digest.update(repr((FORMAT_VERSION, [names[symbols.id_of(v)] for v in freevars])))
+        for row in rows:
+            digest.update(repr(row))
+        return digest.hexdigest()
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def solve(self, linsys, freevars = (), affine = False, **options):
+        """LinSys.solve, through the cache; `options` only matter on a miss"""
+        key = self.key(linsys, freevars)
+        path = self.path(key)
+        if os.path.exists(path):
+            try:
+                assignments = self.load(path, linsys, affine)
+            except (IOError, ValueError, KeyError, EOFError, zipfile.BadZipfile):
+                # truncated or stale file; solve again and replace it
+                pass
+            else:
+                self.hits += 1
+                return assignments
+        self.misses += 1
+        assignments = linsys.solve(freevars, affine = True, **options)
+        self.save(path, assignments)
+        if affine:
+            return assignments
+        return self.load(path, linsys, affine)
+
+    @staticmethod
+    def save(path, assignments):
+        """writes affine `assignments` (as LinSys.solve(affine = True) returns
+        them) as compressed arrays: the variable names, and every dependent
+        variable's constant and (free variable, coeff) terms in CSR form"""
+        variables = sorted(assignments, key = lambda v: v.name)
+        index = dict((v.id, j) for j, v in enumerate(variables))
+        pivots, consts, indptr, indices, data = [], [], [0], [], []
+        for j, v in enumerate(variables):
+            value = assignments[v]
+            if isinstance(value, FreeVar):
+                continue
+            if not isinstance(value, AffineExpr):
+                value = AffineExpr((), (), value)
+            pivots.append(j)
+            consts.append(value.const)
+            # stored the way _pivot_assignments takes them, ``x = c - sum(a * free)``
+            for name, coeff in zip(value.vars, value.coeffs):
+                indices.append(index[symbols.id_of(name)])
+                data.append(-coeff)
+            indptr.append(len(indices))
+
+        fd, tmp = tempfile.mkstemp(suffix = ".npz", dir = os.path.dirname(path) or ".")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                numpy.savez_compressed(f, names = numpy.array([v.name for v in variables], str),
+                    pivots = numpy.array(pivots, int), consts = numpy.array(consts, float),
+                    indptr = numpy.array(indptr, int), indices = numpy.array(indices, int),
+                    data = numpy.array(data, float))
+            # other processes only ever see complete files
+            os.rename(tmp, path)
+        except Exception:
+            os.remove(tmp)
+            raise
+
+    @staticmethod
+    def load(path, linsys, affine = False):
+        """reads the assignments saved at `path` back, over the variables of
+        `linsys`, as BinExprs or (with `affine`) AffineExprs"""
+        table = linsys._var_table()
+        with numpy.load(path) as arrays:
+            variables = [table[symbols.ids[name]] for name in arrays["names"].tolist()]
+            pivots = arrays["pivots"].tolist()
+            consts = arrays["consts"].tolist()
+            indptr = arrays["indptr"].tolist()
+            indices = arrays["indices"].tolist()
+            data = arrays["data"].tolist()
+        if len(variables) != len(table):
+            raise ValueError("%s does not match the system" % (path,))
+        return _pivot_assignments(variables, ((j, consts[k], zip(indices[indptr[k]:indptr[k + 1]],
+            data[indptr[k]:indptr[k + 1]])) for k, j in enumerate(pivots)), affine)
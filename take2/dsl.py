@@ -1,7 +1,17 @@
-from linsys import LinEq, LinVar
+from linsys import LinVar, LinSumBuilder, EquationList, scalar_types
 import itertools
 
 
+def _equal(sink, var, value):
+    """writes ``var = value``, `value` being a number or a linear expression,
+    into `sink` as a row"""
+    if isinstance(value, scalar_types):
+        sink.append_row([(var, 1)], value)
+        return
+    # repeated variables (``x + x + y``) come out as a single term
+    value = LinSumBuilder(value)
+    sink.append_row([(var, 1)] + [(v, -value.coeffs[v.id]) for v in value.vars], value.const)
+
 class BaseNode(object):
     _counter = itertools.count()
     
@@ -12,11 +22,20 @@ class BaseNode(object):
         self.w = LinVar("_w%d" % (self.id,), "cons")
         self.h = LinVar("_h%d" % (self.id,), "cons")
 
-    def get_constraints(self):
+    def get_constraints(self, sink = None):
+        """the equations of this node and its children, written as rows into
+        `sink` (anything with an ``append_row(terms, const)``, e.g. a
+        linsys.ConstraintStore), which is returned; no LinEq is built unless
+        `sink` is None, which gets them as a list of LinEqs"""
+        if sink is None:
+            sink = EquationList()
+        self._add_constraints(sink)
+        return sink
+    def _add_constraints(self, sink):
         if self.width_constraint is not None:
-            yield LinEq(self.w, self.width_constraint)
+            _equal(sink, self.w, self.width_constraint)
         if self.height_constraint is not None:
-            yield LinEq(self.h, self.height_constraint)
+            _equal(sink, self.h, self.height_constraint)
 
     def X(self, width = None, height = None):
         if width is not None:
@@ -77,12 +96,10 @@ class LayoutNode(BaseNode):
     def _get_offset(cls, child):
         return LinVar("_o%d" % (child.id,), "offset")
 
-    def get_constraints(self):
-        for cons in BaseNode.get_constraints(self):
-            yield cons
+    def _add_constraints(self, sink):
+        BaseNode._add_constraints(self, sink)
         for child in self.children:
-            for cons in child.get_constraints():
-                yield cons
+            child._add_constraints(sink)
     
     def init_watchers(self):
         for child in self.children:
@@ -91,30 +108,40 @@ class LayoutNode(BaseNode):
 class HLayoutNode(LayoutNode):
     SYMBOL = " | "
     
-    def get_constraints(self):
-        for cons in LayoutNode.get_constraints(self):
-            yield cons
-        for i, child in enumerate(self.children):
-            yield LinEq(self._get_offset(child), sum(child.w for child in self.children[:i]))
-        total = sum(child.w for child in self.children)
-        yield LinEq(self.total, total)
-        yield LinEq(self.w, self.total + self.scroll)
+    def _add_constraints(self, sink):
+        LayoutNode._add_constraints(self, sink)
+        # each offset follows from the previous one, keeping this linear in
+        # the number of children
+        prev = None
+        for child in self.children:
+            if prev is None:
+                sink.append_row([(self._get_offset(child), 1)], 0)
+            else:
+                sink.append_row([(self._get_offset(child), 1), (self._get_offset(prev), -1), (prev.w, -1)], 0)
+            prev = child
+        sink.append_row([(self.total, 1)] + [(child.w, -1) for child in self.children], 0)
+        sink.append_row([(self.w, 1), (self.total, -1), (self.scroll, -1)], 0)
         for child in self.children:
-            yield LinEq(self.h, child.h + self._get_padder(child))
+            sink.append_row([(self.h, 1), (child.h, -1), (self._get_padder(child), -1)], 0)
 
 class VLayoutNode(LayoutNode):
     SYMBOL = "\n---\n"
 
-    def get_constraints(self):
-        for cons in LayoutNode.get_constraints(self):
-            yield cons
-        for i, child in enumerate(self.children):
-            yield LinEq(self._get_offset(child), sum(child.h for child in self.children[:i]))
-        total = sum(child.h for child in self.children)
-        yield LinEq(self.total, total)
-        yield LinEq(self.h, self.total + self.scroll)
+    def _add_constraints(self, sink):
+        LayoutNode._add_constraints(self, sink)
+        # each offset follows from the previous one, keeping this linear in
+        # the number of children
+        prev = None
+        for child in self.children:
+            if prev is None:
+                sink.append_row([(self._get_offset(child), 1)], 0)
+            else:
+                sink.append_row([(self._get_offset(child), 1), (self._get_offset(prev), -1), (prev.h, -1)], 0)
+            prev = child
+        sink.append_row([(self.total, 1)] + [(child.h, -1) for child in self.children], 0)
+        sink.append_row([(self.h, 1), (self.total, -1), (self.scroll, -1)], 0)
         for child in self.children:
-            yield LinEq(self.w, child.w + self._get_padder(child))
+            sink.append_row([(self.w, 1), (child.w, -1), (self._get_padder(child), -1)], 0)
 
 #=======================================================================================================================
 # Atoms
@@ -127,15 +154,14 @@ class AtomNode(BaseNode):
     def __repr__(self):
         return self._repr_dims("%s(%s)" % (self.__class__.__name__[:-4], ", ".join("%s = %r" % (k, v) 
             for k, v in self.attrs.items() if v is not None)))
-    def get_constraints(self):
-        for cons in BaseNode.get_constraints(self):
-            yield cons
+    def _add_constraints(self, sink):
+        BaseNode._add_constraints(self, sink)
         for k, v in self.attrs.items():
             if v is None:
                 continue
             obj = getattr(self, k, None)
             if isinstance(obj, LinVar):
-                yield LinEq(obj, v)
+                _equal(sink, obj, v)
     
     def set(self, attr, value):
         if self.attrs.get(value, NotImplemented) != value:
@@ -198,7 +224,7 @@ if __name__ == "__main__":
     w = LinVar("w")
     x = (LabelNode("Hello").X(w, 30) | LabelNode("foo").X(w)) --- ButtonNode("bar").X(w*3)
     print x
-    print list(x.get_constraints())
+    print x.get_constraints()
 
 
 
@@ -0,0 +1,328 @@
+"""
+Incremental solving: keeps a system in reduced row echelon form, along with
+how each reduced row combines the original equations, so adding or removing
+a single equation costs a few sparse row operations rather than a new
+elimination of the whole system
+"""
+import itertools
+from collections import defaultdict
+from linsys import NoSolutionsExist, TOLERANCE, LinSys, ConstraintStore, FreeVar, AffineExpr, _equation_terms
+
+
+def _subtract(row, src, factor):
+    """``row -= factor * src`` for ``[terms, const, transform]`` rows,
+    dropping the entries that cancel out"""
+    terms, transform = row[0], row[2]
+    for j, v in src[0].iteritems():
+        newv = terms.get(j, 0.0) - factor * v
+        if abs(newv) <= TOLERANCE:
+            terms.pop(j, None)
+        else:
+            terms[j] = newv
+    row[1] -= factor * src[1]
+    for k, v in src[2].iteritems():
+        newv = transform.get(k, 0.0) - factor * v
+        if abs(newv) <= TOLERANCE:
+            transform.pop(k, None)
+        else:
+            transform[k] = newv
+
+def _scale(row, factor):
+    for d in (row[0], row[2]):
+        for j in d:
+            d[j] *= factor
+    row[1] *= factor
+
+class IncrementalSolver(object):
+    """A system of equations that can be edited one equation at a time.
+
+    Columns are ordered by ``(rank(var), var.id)``, lower ones being the less
+    free; without `rank` every variable has the same rank, so the ones created
+    last are the free ones. Note LinSys.solve orders the columns it is not
+    given as `freevars` by first appearance instead, so where those leave
+    some choice, it may pick other free variables than the ones here (see
+    from_linsys). Every reduced row is stored with its pivot, its free columns and its
+    transform (the combination of original equations it stands for), so:
+
+    * adding an equation reduces it against the pivot rows, and if anything
+      is left, pivots on its lowest column and clears that column from the
+      rows holding it;
+    * removing an equation that some dependent (all-zero) row involves just
+      cancels it out of the other transforms through that row; otherwise the
+      row with the highest pivot among those involving it is dropped, after
+      being used to cancel it out of the rest, and its pivot becomes free.
+
+    Either way the result is the reduced form a full elimination over the
+    same column order would compute, so the same variables end up free.
+
+    The assignments of the pivots are kept from one solve to the next, only
+    those whose rows an edit touched are built again; `value` reads a single
+    variable's"""
+    def __init__(self, equations = (), rank = None):
+        self.rank = rank
+        self._counter = itertools.count()
+        self._equations = {}                # key -> ({var id : coeff}, const)
+        self._vars = {}                     # var id -> LinVar
+        self._sortkeys = {}                 # var id -> column order
+        self._refs = defaultdict(int)       # var id -> equations using it
+        self._rowcounter = itertools.count()
+        self._rows = {}                     # row handle -> [terms, const, transform]
+        self._row_pivot = {}                # row handle -> pivot var id, None for dependent rows
+        self._pivots = {}                   # pivot var id -> row handle
+        self._colrows = defaultdict(set)    # free var id -> pivot rows holding it
+        self._eqrows = defaultdict(set)     # equation key -> rows whose transform uses it
+        self._values = {False : {}, True : {}}  # affine -> var id -> assignment, see solve
+        self._stale = {False : set(), True : set()}  # affine -> var ids to assign again
+        for eq in equations:
+            self.add(eq)
+
+    @classmethod
+    def from_linsys(cls, linsys, freevars = ()):
+        """an incremental solver over the equations of `linsys`, preferring
+        the variables towards the end of `freevars` as the free ones; the
+        others are ranked alike, so ordered by id"""
+        vars = linsys._index_vars(freevars)[0]             # @ReservedAssignment
+        positions = dict((v.id, i + 1) for i, v in enumerate(vars[len(vars) - len(freevars):]))
+        solver = cls(rank = lambda v: positions.get(v.id, 0))
+        rows = [(solver._counter.next(), solver._flatten(eq)) for eq in linsys.equations]
+        # added from the freest lowest column down, each new pivot is in next
+        # to none of the rows already in, so they need no clearing
+        lowest = lambda (key, (terms, const)): min(solver._sortkeys[j] for j in terms) if terms else ()
+        for key, (terms, const) in sorted(rows, key = lowest, reverse = True):
+            solver._add_row(terms, const, key)
+        return solver
+
+    def __repr__(self):
+        return "<IncrementalSolver of %d equations, %d variables, rank %d>" % (len(self._equations),
+            len(self._vars), len(self._pivots))
+    def __len__(self):
+        return len(self._equations)
+    def __contains__(self, key):
+        return key in self._equations
+    @property
+    def keys(self):
+        return sorted(self._equations)
+
+    def to_linsys(self):
+        """the current equations as a LinSys (to solve them from scratch)"""
+        store = ConstraintStore()
+        for key in self.keys:
+            terms, const = self._equations[key]
+            store.append_row([(self._vars[j], c) for j, c in terms.items()], const)
+        return LinSys(store)
+
+    #
+    # row bookkeeping
+    #
+    def _touch(self, j):
+        for stale in self._stale.itervalues():
+            stale.add(j)
+    def _register(self, h):
+        terms, _, transform = self._rows[h]
+        pivot = self._row_pivot[h]
+        if pivot is not None:
+            self._touch(pivot)
+        for j in terms:
+            if j != pivot:
+                self._colrows[j].add(h)
+        for k in transform:
+            self._eqrows[k].add(h)
+    def _unregister(self, h):
+        terms, _, transform = self._rows[h]
+        pivot = self._row_pivot[h]
+        if pivot is not None:
+            self._touch(pivot)
+        for j in terms:
+            if j != pivot:
+                self._colrows[j].discard(h)
+        for k in transform:
+            self._eqrows[k].discard(h)
+    def _new_row(self, row, pivot):
+        h = self._rowcounter.next()
+        self._rows[h] = row
+        self._row_pivot[h] = pivot
+        if pivot is not None:
+            self._pivots[pivot] = h
+        self._register(h)
+        return h
+    def _drop_row(self, h):
+        self._unregister(h)
+        pivot = self._row_pivot.pop(h)
+        if pivot is not None:
+            del self._pivots[pivot]
+        del self._rows[h]
+    def _update_row(self, h, src, factor, column = None, key = None):
+        """row h -= factor * `src`, which is meant to cancel the `column` or
+        equation `key` entry out of it"""
+        self._unregister(h)
+        row = self._rows[h]
+        _subtract(row, src, factor)
+        row[0].pop(column, None)
+        row[2].pop(key, None)
+        self._register(h)
+
+    #
+    # editing
+    #
+    def add(self, equation):
+        """adds a LinEq; returns the key to remove or replace it by. Raises
+        NoSolutionsExist (leaving the system as it was) if it contradicts the
+        current equations"""
+        terms, const = self._flatten(equation)
+        return self._add_row(terms, const)
+    
+    def _flatten(self, equation):
+        """``({var id : coeff}, const)`` of `equation`, registering its variables"""
+        terms, const = _equation_terms(equation)
+        merged = {}
+        for var, coeff in terms:
+            if var.id not in self._vars:
+                self._vars[var.id] = var
+                self._sortkeys[var.id] = (self.rank(var) if self.rank is not None else 0, var.id)
+                self._touch(var.id)
+            merged[var.id] = merged.get(var.id, 0.0) + coeff
+        return merged, float(const)
+
+    def _add_row(self, terms, const, key = None):
+        if key is None:
+            key = self._counter.next()
+        row = [dict((j, c) for j, c in terms.iteritems() if abs(c) > TOLERANCE), const, {key : 1.0}]
+        # pivot rows hold their pivot and free columns only, so one pass will do
+        for j in [j for j in terms if j in self._pivots]:
+            factor = row[0].get(j)
+            if factor is not None:
+                _subtract(row, self._rows[self._pivots[j]], factor)
+                row[0].pop(j, None)
+
+        if not row[0]:
+            if abs(row[1]) > TOLERANCE * (1.0 + abs(const)):
+                self._forget_unused(terms)
+                raise NoSolutionsExist()
+            self._new_row(row, None)
+        else:
+            pivot = min(row[0], key = self._sortkeys.__getitem__)
+            if row[0][pivot] != 1.0:
+                _scale(row, 1.0 / row[0][pivot])
+                row[0][pivot] = 1.0
+            for h in list(self._colrows.pop(pivot, ())):
+                self._update_row(h, row, self._rows[h][0][pivot], column = pivot)
+            self._new_row(row, pivot)
+
+        self._equations[key] = (terms, const)
+        for j in terms:
+            self._refs[j] += 1
+        return key
+
+    def remove(self, key):
+        """removes the equation added under `key`"""
+        terms, _ = self._equations.pop(key)
+        holders = self._eqrows.pop(key, set())
+        dependent = [h for h in holders if self._row_pivot[h] is None]
+        if dependent:
+            # the equation is implied by the others: cancel it out through a
+            # dependent row, the pivots stay as they are
+            drop = max(dependent, key = lambda h: abs(self._rows[h][2][key]))
+        else:
+            drop = max(holders, key = lambda h: self._sortkeys[self._row_pivot[h]])
+        src = self._rows[drop]
+        self._drop_row(drop)
+        # a dropped pivot becomes a free column of the rows updated here
+        for h in holders:
+            if h != drop:
+                self._update_row(h, src, self._rows[h][2][key] / src[2][key], key = key)
+        self._eqrows.pop(key, None)
+
+        for j in terms:
+            self._refs[j] -= 1
+        self._forget_unused(terms)
+
+    def replace(self, key, equation):
+        """replaces the equation under `key`, keeping the key. A change of
+        constant alone just shifts the constants of the rows involving it"""
+        old_terms, old_const = self._equations[key]
+        terms, const = self._flatten(equation)
+        if terms == old_terms:
+            self.set_constant(key, const)
+            return key
+        # keep the old variables around until the new equation is in, the old
+        # one may have to be put back
+        for j in old_terms:
+            self._refs[j] += 1
+        self.remove(key)
+        try:
+            return self._add_row(terms, const, key)
+        except NoSolutionsExist:
+            self._add_row(old_terms, old_const, key)
+            raise
+        finally:
+            for j in old_terms:
+                self._refs[j] -= 1
+            self._forget_unused(old_terms)
+
+    def set_constant(self, key, const):
+        """changes the constant of the equation under `key`"""
+        terms, old = self._equations[key]
+        delta = const - old
+        for h in self._eqrows.get(key, ()):
+            if self._row_pivot[h] is None:
+                row = self._rows[h]
+                if abs(row[1] + row[2][key] * delta) > TOLERANCE * (1.0 + abs(const)):
+                    raise NoSolutionsExist()
+        for h in self._eqrows.get(key, ()):
+            row = self._rows[h]
+            row[1] += row[2][key] * delta
+            if self._row_pivot[h] is not None:
+                self._touch(self._row_pivot[h])
+        self._equations[key] = (terms, const)
+
+    def _forget_unused(self, ids):
+        for j in ids:
+            if self._refs.get(j, 0) > 0:
+                continue
+            self._refs.pop(j, None)
+            # whatever is left of it is round-off
+            for h in self._colrows.pop(j, ()):
+                self._rows[h][0].pop(j, None)
+                self._touch(self._row_pivot[h])
+            if j not in self._pivots:
+                del self._vars[j]
+                del self._sortkeys[j]
+                self._touch(j)
+
+    #
+    # results
+    #
+    def solve(self, affine = False):
+        """the assignments of the current system, as LinSys.solve returns them"""
+        values = self._refresh(affine)
+        return dict((self._vars[j], value) for j, value in values.iteritems())
+
+    def value(self, var, affine = False):
+        """the assignment of `var` alone, as `solve` would give it"""
+        return self._refresh(affine)[var.id]
+
+    def _refresh(self, affine):
+        """the assignments by var id, building again those of the variables
+        touched since the last call"""
+        values = self._values[affine]
+        stale = self._stale[affine]
+        # pivot rows only hold free columns, so the FreeVars go first
+        for j in stale:
+            if j not in self._vars:
+                values.pop(j, None)
+            elif j not in self._pivots:
+                values[j] = FreeVar(self._vars[j])
+        for j in stale:
+            if j in self._pivots:
+                terms, const, _ = self._rows[self._pivots[j]]
+                free = sorted((j2 for j2 in terms if j2 != j), key = self._sortkeys.__getitem__)
+                if affine:
+                    values[j] = AffineExpr([self._vars[j2] for j2 in free], [-terms[j2] for j2 in free], 
+                        const) if free else float(const)
+                    continue
+                value = const
+                for j2 in free:
+                    value -= terms[j2] * values[j2]
+                values[j] = value
+        stale.clear()
+        return values
@@ -0,0 +1,75 @@
+"""
+Iterative least squares on coordinate-format (row, column, value) matrices:
+each step costs two sparse matrix-vector products (numpy.bincount), so very
+large layouts can be solved in time proportional to their nonzeros, and a
+previous solution is a good starting point when the constants barely moved
+"""
+import numpy
+
+
+class IterativeSolution(dict):
+    """variable -> value, along with the number of iterations it took, the
+    residual ``||A x - b||`` it was left with and whether it converged (rather
+    than running out of iterations)"""
+    def __init__(self, items, iterations, residual, converged = True):
+        dict.__init__(self, items)
+        self.iterations = iterations
+        self.residual = residual
+        self.converged = converged
+    def __repr__(self):
+        return "<IterativeSolution of %d variables, %d iterations, residual %g%s>" % (len(self),
+            self.iterations, self.residual, "" if self.converged else ", not converged")
+
+def _matvec(rows, cols, data, x, m):
+    return numpy.bincount(rows, data * x[cols], minlength = m)
+
+def max_iterations(ncols):
+    """the number of iterations cgls() gives up after by default"""
+    return 2 * ncols + 100
+
+def cgls(rows, cols, data, b, ncols, x0 = None, tol = 1e-10, maxiter = None):
+    """Conjugate gradients on the normal equations ``A'A x = A'b`` of the m x n
+    matrix given by the triples `rows`, `cols`, `data` (with m = len(b) and n =
+    `ncols`), without forming A'A. The columns are scaled to unit norm first,
+    which saves some iterations on layout systems.
+
+    Starts from `x0` (zeros if None) and stops once ``||A'r||`` drops below
+    `tol` times ``||A'b||`` (or the residual itself below `tol` times
+    ``||b||``), or after `maxiter` steps (default: 2n + 100). The result only
+    differs from `x0` by a combination of (column scaled) rows of A, so in
+    underdetermined systems the free directions stay close to the start.
+    Returns ``(x, iterations, residual)``"""
+    b = numpy.asarray(b, float)
+    m = len(b)
+    n = ncols
+    if maxiter is None:
+        maxiter = max_iterations(n)
+    norms = numpy.sqrt(numpy.bincount(cols, data * data, minlength = n))
+    scale = numpy.where(norms > 0, 1.0 / numpy.where(norms > 0, norms, 1.0), 0.0)
+    data = data * scale[cols]
+
+    z = numpy.zeros(n) if x0 is None else numpy.asarray(x0, float) * numpy.where(norms > 0, norms, 0.0)
+    r = b - _matvec(rows, cols, data, z, m)
+    s = _matvec(cols, rows, data, r, n)
+    p = s.copy()
+    gamma = numpy.dot(s, s)
+    stop_s = tol * numpy.linalg.norm(_matvec(cols, rows, data, b, n))
+    stop_r = tol * numpy.linalg.norm(b)
+    iterations = 0
+    while iterations < maxiter and numpy.sqrt(gamma) > stop_s and numpy.linalg.norm(r) > stop_r:
+        q = _matvec(rows, cols, data, p, m)
+        alpha = gamma / numpy.dot(q, q)
+        z += alpha * p
+        r -= alpha * q
+        s = _matvec(cols, rows, data, r, n)
+        gamma_new = numpy.dot(s, s)
+        p = s + (gamma_new / gamma) * p
+        gamma = gamma_new
+        iterations += 1
+
+    x = z * scale
+    if x0 is not None:
+        # columns with no nonzeros keep their starting value
+        x = numpy.where(norms > 0, x, numpy.asarray(x0, float))
+    residual = numpy.linalg.norm(b - _matvec(rows, cols, data, z, m))
+    return x, iterations, residual
@@ -1,50 +1,64 @@
+import os
+import array
+import tempfile
 import itertools
 import numpy
+from collections import OrderedDict
+from sparse import SparseMatrix, eliminate_sparse
+from presolve import peel_definitions, simplify
+from iterative import IterativeSolution, cgls, max_iterations
+from profiling import phase
 
 EPSILON = 1e-50
+# rank decisions of rref() and consistency checks on reduced constants; layout
+# coefficients are small integers, so round-off stays far below this
+TOLERANCE = 1e-9
+# the same for float32 matrices, whose entries carry about 7 significant digits:
+# enough for pixel positions, as long as they stay well below 1e5
+FLOAT32_TOLERANCE = 1e-4
+# working memory, in bytes, rref_blocked() reduces a memory-mapped (or
+# float32) matrix within; see block_rows
+BLOCK_BYTES = 64 * 2 ** 20
+# independent subsystems with at least this many variables are sent to the
+# process pool by LinSys.solve(decompose = True, pool = ...)
+PARALLEL_THRESHOLD = 100
+# the most terms one substitution of the definitions pass may create (see
+# presolve.peel_definitions); the rows that would cost more are eliminated
+DEFINITION_FILL = 16
 scalar_types = (int, long, float)
 
 class NoSolutionsExist(Exception):
     pass
 
-def eliminate(mat):
-    """Original code by Jarno Elonen, Public Domain
-    http://elonen.iki.fi/code/misc-notes/python-gaussj/index.html"""
+def rref(mat, ncols = None, tol = TOLERANCE):
+    """Reduces `mat` in place to reduced row echelon form, pivoting only on its
+    first `ncols` columns (default: all but the last) in column order, using the
+    largest remaining entry of each column. Pivot rows are moved to the top;
+    returns the list of pivot columns (pivot k lives in row k)"""
     m, n = mat.shape
-    if m > n:
-        raise ValueError("more rows than columns")
-    
-    for y in range(0, m):
-        maxrow = y
-        # Find max pivot
-        for y2 in range(y+1, m):
-            if abs(mat[y2][y]) > abs(mat[maxrow][y]):
-                maxrow = y2
-        mat[[y, maxrow],:] = mat[[maxrow, y],:]
-        assert y < n
-        if abs(mat[y][y]) <= EPSILON:
-            # Singular
+    if ncols is None:
+        ncols = n - 1
+    pivots = []
+    r = 0
+    for col in range(ncols):
+        if r == m:
+            break
+        maxrow = r + int(numpy.argmax(numpy.abs(mat[r:, col])))
+        if abs(mat[maxrow, col]) <= tol:
+            # free column; drop the round-off left in the rows below
+            mat[r:, col] = 0.0
             continue
-        # Eliminate column y
-        for y2 in range(y+1, m):
-            c = mat[y2][y] / mat[y][y]
-            for x in range(y, n):
-                mat[y2][x] -= mat[y][x] * c
-    
-    # Backsubstitute
-    for y in range(m-1, -1, -1):
-        for i in range(0, n):
-            if abs(mat[y][i]) > EPSILON:
-                break
-        else:
-            continue
-        c = mat[y][i]
-        for y2 in range(0, y):
-            for x in range(n-1, y-1, -1):
-                mat[y2][x] -= mat[y][x] * mat[y2][i] / c
-        # Normalize row y
-        for x in range(i, n):
-            mat[y][x] /= c
+        if maxrow != r:
+            mat[[r, maxrow],:] = mat[[maxrow, r],:]
+        mat[r, col:] /= mat[r, col]
+        # only touch the rows that actually have this column
+        others = numpy.flatnonzero(mat[:, col])
+        others = others[others != r]
+        if len(others):
+            mat[others, col:] -= numpy.outer(mat[others, col], mat[r, col:])
+        pivots.append(col)
+        r += 1
+    return pivots
 
 def sub(a,b):
     return a-b
@@ -97,40 +111,631 @@ class FreeVar(ExprMixin):
     def __str__(self):
         return str(self.name)
 
-def solve_matrix(mat, variables):
-    m, n = mat.shape
-    if len(variables) != n - 1:
-        raise ValueError("Expected %d variables" % (n - 1,))
+class AffineExpr(ExprMixin):
+    """``const + sum(coeffs[i] * vars[i])`` over free variables (keyed like
+    FreeVar.name): evaluating is one dot product, and the depth no longer
+    grows with the number of free variables as BinExpr chains do"""
+    __slots__ = ["vars", "coeffs", "const"]
+    def __init__(self, vars, coeffs, const):                # @ReservedAssignment
+        self.vars = tuple(vars)
+        self.coeffs = numpy.asarray(coeffs, float)
+        self.const = float(const)
+    def eval(self, freevars):
+        if not self.vars:
+            return self.const
+        return self.const + float(numpy.dot(self.coeffs, [freevars[v] for v in self.vars]))
+    def __repr__(self):
+        terms = "".join(" %s %r*%s" % ("-" if c < 0 else "+", abs(c), v) for v, c in zip(self.vars, self.coeffs))
+        return "(%r%s)" % (self.const, terms)
+    
+    @classmethod
+    def combine(cls, const, terms):
+        """``const + sum(coeff * value)`` for (coeff, value) pairs whose values
+        are scalars, FreeVars or AffineExprs"""
+        merged = {}
+        order = []
+        for coeff, value in terms:
+            if isinstance(value, AffineExpr):
+                const += coeff * value.const
+                pairs = zip(value.vars, value.coeffs * coeff)
+            elif isinstance(value, FreeVar):
+                pairs = [(value.name, coeff)]
+            else:
+                const += coeff * value
+                continue
+            for v, c in pairs:
+                if v not in merged:
+                    order.append(v)
+                    merged[v] = c
+                else:
+                    merged[v] += c
+        return cls(order, [merged[v] for v in order], const)
+    @classmethod
+    def from_expr(cls, expr, resolve = None):
+        """the AffineExpr equal to `expr`: a scalar, FreeVar, BinExpr or
+        AffineExpr. `resolve`, if given, maps the name of every FreeVar met to
+        the value replacing it, or to None to keep it as a free variable"""
+        def leaf(node):
+            if isinstance(node, AffineExpr):
+                if resolve is None:
+                    return node
+                return cls.combine(node.const, [(c, leaf(FreeVar(v))) for v, c in zip(node.vars, node.coeffs)])
+            if isinstance(node, FreeVar):
+                value = resolve(node.name) if resolve is not None else None
+                if value is None:
+                    return cls((node.name,), (1.0,), 0.0)
+                return cls.from_expr(value, resolve)
+            return cls((), (), node)
+        
+        # iterative post-order walk, BinExpr chains can be arbitrarily deep
+        stack = [(expr, False)]
+        out = []
+        while stack:
+            node, visited = stack.pop()
+            if not isinstance(node, BinExpr):
+                out.append(leaf(node))
+            elif not visited:
+                stack.append((node, True))
+                stack.append((node.rhs, False))
+                stack.append((node.lhs, False))
+            else:
+                rhs = out.pop()
+                lhs = out.pop()
+                if node.op is sub:
+                    out.append(cls.combine(0.0, [(1, lhs), (-1, rhs)]))
+                elif node.op is mul and not lhs.vars:
+                    out.append(cls.combine(0.0, [(lhs.const, rhs)]))
+                elif node.op is mul and not rhs.vars:
+                    out.append(cls.combine(0.0, [(rhs.const, lhs)]))
+                else:
+                    raise ValueError("%r is not affine" % (node,))
+        return out[0]
+    def __mul__(self, other):
+        if isinstance(other, scalar_types):
+            return AffineExpr.combine(0.0, [(other, self)])
+        return ExprMixin.__mul__(self, other)
+    __rmul__ = __mul__
+    def __add__(self, other):
+        return AffineExpr.combine(0.0, [(1, self), (1, other)])
+    __radd__ = __add__
+    def __sub__(self, other):
+        return AffineExpr.combine(0.0, [(1, self), (-1, other)])
+    def __rsub__(self, other):
+        return AffineExpr.combine(0.0, [(1, other), (-1, self)])
+    def __neg__(self):
+        return AffineExpr.combine(0.0, [(-1, self)])
 
-    if m >= n:
-        # add fake columns at the front
-        mat = numpy.hstack((numpy.zeros((m, m-n)), mat))
-        variables[0:0] = ["_fake%d" % (i,) for i in range(m-n)]
-        m, n = mat.shape
+def evaluate_batch(assignments, freevars, values, fixed = None):
+    """Evaluates the dependent variables of `assignments` (as returned by
+    LinSys.solve) for many free-variable vectors in one go. `values` is an
+    N x k array whose columns follow `freevars` (LinVars or names); any other
+    free variable takes its value from the `fixed` dict. Returns ``(variables, results)``, with
+    `results` an N x m array holding a column per dependent variable"""
+    values = numpy.atleast_2d(numpy.asarray(values, float))
+    if values.shape[1] != len(freevars):
+        raise ValueError("Expected %d columns" % (len(freevars),))
+    columns = dict((symbols.id_of(v), i) for i, v in enumerate(freevars))
+    fixed = dict((symbols.id_of(k), v) for k, v in (fixed or {}).items())
+    def resolve(name):
+        id = symbols.id_of(name)                            # @ReservedAssignment
+        if id in columns:
+            return None
+        if id in fixed:
+            return fixed[id]
+        value = assignments.get(name)
+        if value is None or isinstance(value, FreeVar):
+            raise ValueError("No value specified for %r" % (name,))
+        return value
+    
+    variables = [k for k, v in assignments.items() if not isinstance(v, FreeVar)]
+    coeffs = numpy.zeros((len(variables), len(freevars)), float)
+    consts = numpy.zeros(len(variables), float)
+    for i, var in enumerate(variables):
+        aff = AffineExpr.from_expr(assignments[var], resolve)
+        consts[i] = aff.const
+        for v, c in zip(aff.vars, aff.coeffs):
+            coeffs[i, columns[symbols.id_of(v)]] += c
+    return variables, numpy.dot(values, coeffs.T) + consts
+
+def _linear_value(const, terms, affine = False):
+    """``const + sum(coeff * value)`` over (coeff, value) pairs of assignment
+    values, as an AffineExpr (or float) with `affine`, a BinExpr otherwise"""
+    if affine:
+        value = AffineExpr.combine(const, terms)
+        return value if value.vars else value.const
+    terms = list(terms)
+    if abs(const) <= EPSILON and terms and not isinstance(terms[0][1], scalar_types):
+        coeff, v = terms.pop(0)
+        value = coeff * v
+    else:
+        value = const
+    for coeff, v in terms:
+        value -= -coeff * v
+    return value
 
-    eliminate(mat)
+def _pivot_assignments(variables, pivot_rows, affine = False):
+    """builds the assignments dict out of ``(pivot column, constant, [(free
+    column, coeff), ...])`` triples; every column that is not a pivot becomes
+    a FreeVar. With `affine`, the pivots become AffineExprs (or plain floats)
+    rather than BinExpr chains"""
+    pivot_rows = list(pivot_rows)
+    pivot_cols = set(j for j, _, _ in pivot_rows)
     assignments = {}
+    for j, v in enumerate(variables):
+        if j not in pivot_cols:
+            assignments[v] = FreeVar(v)
+    for j, const, terms in pivot_rows:
+        if affine:
+            assignments[variables[j]] = AffineExpr([variables[j2] for j2, _ in terms], 
+                [-coeff for _, coeff in terms], const) if terms else float(const)
+            continue
+        value = const
+        for j2, coeff in terms:
+            value -= coeff * assignments[variables[j2]]
+        assignments[variables[j]] = value
+    return assignments
+
+def _record_matrix(stats, shape, nonzeros, assignments, fill_in = None):
+    if stats is not None:
+        stats.matrix(shape, nonzeros, sum(1 for v in assignments.itervalues() if isinstance(v, FreeVar)), 
+            fill_in)
+    return assignments
+
+def solve_matrix(mat, variables, affine = False, nrhs = None, stats = None):
+    """Solves the augmented matrix `mat` (over `variables`), preferring the
+    variables towards the end as the free ones. Returns a dict mapping each
+    variable to a constant, a FreeVar, or an expression of the FreeVars:
+    BinExpr chains by default, AffineExprs with `affine`.
+    
+    Given `nrhs`, `mat` ends with that many constant columns instead of one
+    (e.g. the constants of several variants of a layout): the coefficients
+    are eliminated once, and a list with the assignments of each constant
+    column is returned; a column the system contradicts gets its
+    NoSolutionsExist in the list instead, the others still solve.
+    
+    A numpy.memmap, or a float32 matrix, is eliminated in blocks of rows by
+    solve_blocked.
     
-    for row in mat[::-1]:
-        nonzero = list(itertools.dropwhile(lambda v: abs(v) <= EPSILON, row))
-        if not nonzero:
+    Given a profiling.SolveStats as `stats`, the time spent eliminating and
+    building the assignments is added to it, along with the size of `mat`"""
+    if isinstance(mat, SparseMatrix):
+        if nrhs is not None:
+            raise ValueError("SparseMatrix holds a single constant column")
+        return solve_sparse(mat, variables, affine = affine, stats = stats)
+    if isinstance(mat, numpy.memmap) or mat.dtype == numpy.float32:
+        if nrhs is not None:
+            raise ValueError("blocked elimination takes a single constant column")
+        return solve_blocked(mat, variables, affine, stats = stats)
+    n = mat.shape[1]
+    nonzeros = numpy.count_nonzero(mat[:, :len(variables)]) if stats is not None else None
+    if nrhs is not None:
+        if len(variables) != n - nrhs:
+            raise ValueError("Expected %d variables" % (n - nrhs,))
+        with phase(stats, "eliminate"):
+            pivots = rref(mat, len(variables))
+        with phase(stats, "assign"):
+            terms = _rref_terms(mat, pivots, len(variables))
+            results = []
+            for col in range(len(variables), n):
+                try:
+                    results.append(_rref_assignments(mat, pivots, variables, affine, col, terms))
+                except NoSolutionsExist as ex:
+                    results.append(ex)
+        if stats is not None:
+            stats.matrix(mat.shape, nonzeros, len(variables) - len(pivots))
+        return results
+    if len(variables) != n - 1:
+        raise ValueError("Expected %d variables" % (n - 1,))
+    # whatever its shape, the system may be rank deficient anywhere; rref()
+    # pivots in column order, in place, leaving the trailing (freest) columns
+    # free, every pivot variable in terms of free ones only, and the redundant
+    # rows at the bottom
+    with phase(stats, "eliminate"):
+        pivots = rref(mat)
+    with phase(stats, "assign"):
+        assignments = _rref_assignments(mat, pivots, variables, affine)
+    return _record_matrix(stats, mat.shape, nonzeros, assignments)
+
+def _trailing_independent(rows, tol = TOLERANCE):
+    """the indexes (in increasing order) of the rows of `rows` picked from the
+    end backwards, taking each one independent of those taken after it: the
+    pivots of a column-pivoted QR (modified Gram-Schmidt) of ``rows.T`` that
+    pivots on the last column left rather than the largest.
+
+    The residuals are kept for a window of the trailing rows only, loaded up
+    to 32 at a time and projected against the picks so far in one matrix
+    product; each step takes the last row of the window whose residual is
+    above `tol` (the dependent ones after it are dropped without a step of
+    their own) and projects the rest of the window against it. So there is a
+    step per row picked plus one per window, and no copy of the basis"""
+    k = rows.shape[1]
+    basis = numpy.empty((k, k))
+    picked = []
+    start = len(rows)
+    window = rows[start:]
+    while len(picked) < k:
+        norms = numpy.sqrt(numpy.einsum("ij,ij->i", window, window))
+        candidates = numpy.flatnonzero(norms > tol)
+        if not len(candidates):
+            if not start:
+                break
+            # every row of the window depends on the picks: load the next rows
+            end, start = start, max(0, start - min(k - len(picked), 32))
+            taken = basis[:len(picked)]
+            window = rows[start:end] - numpy.dot(numpy.dot(rows[start:end], taken.T), taken)
             continue
-        const = nonzero.pop(-1)
-        if not nonzero:
+        i = int(candidates[-1])
+        q = window[i] / norms[i]
+        basis[len(picked)] = q
+        picked.append(start + i)
+        window = window[:i]
+        window -= numpy.outer(numpy.dot(window, q), q)
+    picked.reverse()
+    return picked
+
+def solve_svd(mat, variables, affine = False, stats = None):
+    """solve_matrix through numpy.linalg: a single SVD of the coefficients
+    gives the rank, a particular solution and a basis N of the null space.
+    The free variables are then picked from the end of `variables` backwards,
+    taking each one whose row of N is independent of the rows already taken
+    (which is exactly the choice solve_matrix makes; see
+    _trailing_independent), and every other variable is expressed in terms of
+    them by solving against those rows of N"""
+    m, n = mat.shape
+    if len(variables) != n - 1:
+        raise ValueError("Expected %d variables" % (n - 1,))
+    coeffs, consts = mat[:, :-1], mat[:, -1]
+    nonzeros = numpy.count_nonzero(coeffs) if stats is not None else None
+    if n == 1 and m and numpy.abs(consts).max() > TOLERANCE:
+        # a row of the form (0 0 ... 0 x) means a contradiction
+        raise NoSolutionsExist()
+    if m == 0 or n == 1:
+        return _record_matrix(stats, mat.shape, nonzeros, _pivot_assignments(variables, (), affine))
+    with phase(stats, "eliminate"):
+        u, sv, vt = numpy.linalg.svd(coeffs)
+        rank = int((sv > TOLERANCE * max(sv[0], 1.0)).sum())
+        # minimum norm solution, and a check that it actually solves the system
+        x = numpy.dot(vt[:rank].T, numpy.dot(u[:, :rank].T, consts) / sv[:rank])
+        scale = 1.0 + numpy.abs(consts).max()
+        if numpy.abs(numpy.dot(coeffs, x) - consts).max() > TOLERANCE * scale * max(m, n):
             # a row of the form (0 0 ... 0 x) means a contradiction
             raise NoSolutionsExist()
-        vars = variables[-len(nonzero):]
-        assignee = vars.pop(0)
-        assert abs(nonzero.pop(0) - 1) <= EPSILON
-        assignments[assignee] = const
-        
-        for i, v in enumerate(vars):
-            if v not in assignments:
-                assignments[v] = FreeVar(v)
-            assignments[assignee] -= nonzero[i] * assignments[v]
+        null = vt[rank:].T
+        free = _trailing_independent(null)
+
+        # x = x + N c, with c fixed by the free variables: x = x0 + M x_free
+        if free:
+            trans = numpy.linalg.solve(null[free].T, null.T).T
+        else:
+            trans = numpy.zeros((n - 1, 0))
+        const = x - numpy.dot(trans, x[free])
+    freeset = set(free)
+    free = numpy.array(free, int)
+    def pivot_rows():
+        for j in range(n - 1):
+            if j in freeset:
+                continue
+            row = trans[j]
+            nz = numpy.flatnonzero(numpy.abs(row) > TOLERANCE)
+            yield j, float(const[j]), zip(free[nz].tolist(), (-row[nz]).tolist())
+    with phase(stats, "assign"):
+        assignments = _pivot_assignments(variables, pivot_rows(), affine)
+    return _record_matrix(stats, mat.shape, nonzeros, assignments)
+
+def solve_sparse(smat, variables, blocks = None, affine = False, stats = None):
+    """the sparse counterpart of solve_matrix: eliminates `smat` in place and
+    returns the same kind of assignments. See eliminate_sparse for `blocks`;
+    the fill-in it reports is recorded in `stats`, if given"""
+    if len(variables) != smat.ncols:
+        raise ValueError("Expected %d variables" % (smat.ncols,))
+    
+    nonzeros = smat.nnz if stats is not None else None
+    # round-off below TOLERANCE is dropped as it appears, so it can neither be
+    # pivoted on nor be mistaken for a contradiction
+    scale = 1.0 + max([abs(const) for const in smat.consts] or [0.0])
+    with phase(stats, "eliminate"):
+        pivots = eliminate_sparse(smat, TOLERANCE, blocks)
+    pivot_rows = set(i for i, _ in pivots)
+    for i, const in enumerate(smat.consts):
+        if i not in pivot_rows and abs(const) > TOLERANCE * scale:
+            # an emptied row with a nonzero constant means a contradiction
+            raise NoSolutionsExist()
+    
+    with phase(stats, "assign"):
+        assignments = _pivot_assignments(variables, ((j, smat.consts[i], 
+            sorted((j2, coeff) for j2, coeff in smat.rows[i].iteritems() if j2 != j)) for i, j in pivots), 
+            affine)
+    return _record_matrix(stats, smat.shape, nonzeros, assignments, smat.fill_in)
+
+def _tolerance(mat):
+    return FLOAT32_TOLERANCE if mat.dtype == numpy.float32 else TOLERANCE
+
+def block_rows(ncols, itemsize, budget = BLOCK_BYTES):
+    """how many rows of `ncols` entries of `itemsize` bytes rref_blocked()
+    loads at a time to stay within `budget` bytes: the block being reduced,
+    the chunk of pivot rows it is reduced against, and the temporaries of
+    their products (see _subtract_product) take about a quarter each"""
+    return max(1, int(budget // (4 * ncols * itemsize)))
+
+def _subtract_product(target, left, right, budget):
+    """``target -= numpy.dot(left, right)``, a slice of columns at a time so
+    that the product (and the slice of `right` it reads) takes no more than
+    an eighth of `budget` bytes. `left` must not be a view of `target`"""
+    width = max(1, int(budget // (8 * max(1, len(target)) * target.itemsize)))
+    for c in range(0, target.shape[1], width):
+        target[:, c:c + width] -= numpy.dot(left, right[:, c:c + width])
+
+def rref_blocked(mat, ncols = None, tol = None, budget = BLOCK_BYTES):
+    """rref() for matrices too large to handle whole, e.g. a numpy.memmap:
+    the rows are reduced a block at a time, each block first against the
+    pivot rows found so far (read back a block at a time), then on its own
+    with rref(), after which its new pivot columns are cleared out of the
+    earlier pivot rows. The blocks are as high as fits in `budget` bytes of
+    working memory (see block_rows), however wide the matrix.
     
+    The reduced form is unique, so the pivots are the very columns rref()
+    picks; but pivoting only happens within a block, and the rows are not
+    moved. Returns the ``(row, column)`` pivots, in column order. Raises
+    NoSolutionsExist if some row reduces to ``0 = c``"""
+    m, n = mat.shape
+    if ncols is None:
+        ncols = n - 1
+    if tol is None:
+        tol = _tolerance(mat)
+    block = block_rows(n, mat.itemsize, budget)
+    pivot_rows = []
+    pivot_cols = []
+    scale = 1.0
+    for start in range(0, m, block):
+        rows = numpy.array(mat[start:start + block])
+        scale = max(scale, 1.0 + numpy.abs(rows[:, ncols:]).max())
+        for k in range(0, len(pivot_rows), block):
+            # pivot rows are zero in each other's pivot columns, so the chunks
+            # can be applied one after the other
+            prows = mat[pivot_rows[k:k + block]]
+            _subtract_product(rows, rows[:, pivot_cols[k:k + block]], prows, budget)
+        rows[:, pivot_cols] = 0.0
+        local = rref(rows, ncols, tol)
+        rank = len(local)
+        if rank < len(rows) and numpy.abs(rows[rank:, ncols:]).max() > tol * scale:
+            # a row of the form (0 0 ... 0 x) means a contradiction
+            raise NoSolutionsExist()
+        if local:
+            for k in range(0, len(pivot_rows), block):
+                index = pivot_rows[k:k + block]
+                prows = mat[index]
+                _subtract_product(prows, prows[:, local], rows[:rank], budget)
+                prows[:, local] = 0.0
+                mat[index] = prows
+        mat[start:start + block] = rows
+        pivot_rows.extend(range(start, start + rank))
+        pivot_cols.extend(local)
+    return sorted(zip(pivot_rows, pivot_cols), key = lambda p: p[1])
+
+def solve_blocked(mat, variables, affine = False, budget = BLOCK_BYTES, stats = None):
+    """solve_matrix through rref_blocked(), within `budget` bytes of working
+    memory, reading the reduced pivot rows back a block at a time; `mat` is
+    typically a numpy.memmap, or a float32 matrix (whose round-off is dropped
+    at FLOAT32_TOLERANCE)"""
+    m, n = mat.shape
+    if len(variables) != n - 1:
+        raise ValueError("Expected %d variables" % (n - 1,))
+    tol = _tolerance(mat)
+    block = block_rows(n, mat.itemsize, budget)
+    if stats is not None:
+        nonzeros = sum(int(numpy.count_nonzero(mat[i:i + block, :-1])) for i in range(0, m, block))
+    with phase(stats, "eliminate"):
+        pivots = rref_blocked(mat, n - 1, tol, budget)
+    pivot_cols = set(j for _, j in pivots)
+    free = numpy.array([j for j in range(n - 1) if j not in pivot_cols], int)
+    # float64 keeps rref()'s exact zeros; float32 leaves round-off behind
+    drop = tol if mat.dtype == numpy.float32 else 0.0
+    def pivot_rows():
+        for k in range(0, len(pivots), block):
+            chunk = pivots[k:k + block]
+            rows = mat[[i for i, _ in chunk]]
+            for row, (_, j) in zip(rows, chunk):
+                coeffs = row[free]
+                nz = numpy.flatnonzero(numpy.abs(coeffs) > drop)
+                yield j, float(row[-1]), zip(free[nz].tolist(), coeffs[nz].astype(float).tolist())
+    with phase(stats, "assign"):
+        assignments = _pivot_assignments(variables, pivot_rows(), affine)
+    if stats is not None:
+        stats.matrix(mat.shape, nonzeros, len(free))
     return assignments
 
+def _reduce_block(mat):
+    """process pool worker: rref() of one augmented matrix"""
+    pivots = rref(mat)
+    return mat, pivots
+
+def _rref_terms(mat, pivots, nvars):
+    """the ``[(free column, coeff), ...]`` of each pivot row of a matrix
+    reduced by rref()"""
+    pivot_cols = set(pivots)
+    free = numpy.array([j for j in range(nvars) if j not in pivot_cols], int)
+    terms = []
+    for k in range(len(pivots)):
+        row = mat[k, free]
+        nz = numpy.flatnonzero(row)
+        terms.append(zip(free[nz].tolist(), row[nz].tolist()))
+    return terms
+
+def _rref_assignments(mat, pivots, variables, affine = False, column = -1, terms = None):
+    """the assignments of an augmented matrix already reduced by rref(), for
+    its constant `column`"""
+    rank = len(pivots)
+    consts = mat[:, column]
+    # a row of the form (0 0 ... 0 x) means a contradiction, but the round-off
+    # left in x grows with the constants
+    if rank < len(consts) and numpy.abs(consts[rank:]).max() > TOLERANCE * (1.0 + numpy.abs(consts).max()):
+        raise NoSolutionsExist()
+    if terms is None:
+        terms = _rref_terms(mat, pivots, len(variables))
+    return _pivot_assignments(variables, ((j, float(consts[k]), terms[k]) for k, j in enumerate(pivots)), 
+        affine)
+
+#
+# systems indexed as ``({column : coeff}, constant)`` rows, as LinSys.solve
+# hands them from one pass to the next
+#
+def _rows_to_coo(rows):
+    """`rows` as the (row, column, coeff) arrays and the constant vector
+    LinSys._to_coo gives, all the terms at once"""
+    lengths = [len(terms) for terms, _ in rows]
+    total = sum(lengths)
+    index = numpy.repeat(numpy.arange(len(rows)), lengths)
+    columns = numpy.fromiter(itertools.chain.from_iterable(terms.iterkeys() for terms, _ in rows), int, total)
+    data = numpy.fromiter(itertools.chain.from_iterable(terms.itervalues() for terms, _ in rows), float, 
+        total)
+    return index, columns, data, numpy.array([const for _, const in rows], float)
+
+def _coo_rows(index, columns, data, consts):
+    """yields the COO arrays (`index` in increasing order) back as rows,
+    leaving the zero coeffs out"""
+    bounds = numpy.searchsorted(index, numpy.arange(len(consts) + 1)).tolist()
+    columns = columns.tolist()
+    data = data.tolist()
+    for i, const in enumerate(consts.tolist()):
+        start, end = bounds[i], bounds[i + 1]
+        yield dict((j, c) for j, c in itertools.izip(columns[start:end], data[start:end]) if c != 0), const
+
+def _coo_to_dense(coo, ncols, dtype = float, out = None):
+    """the augmented matrix of the COO arrays, written into `out` (of the
+    right shape, and zeroed) if given, e.g. a numpy.memmap"""
+    index, columns, data, consts = coo
+    if out is None:
+        out = numpy.zeros((len(consts), ncols + 1), dtype)
+    out[index, columns] = data
+    out[:, -1] = consts
+    return out
+
+def _coo_to_sparse(coo, ncols):
+    matrix = SparseMatrix(ncols)
+    for row, const in _coo_rows(*coo):
+        matrix.append(row, const)
+    return matrix
+
+def _compact(coo, vars, nfree):                             # @ReservedAssignment
+    """renumbers the COO arrays (over `vars`, the last `nfree` of them
+    preferred free) to the columns they actually use, which the passes may
+    have left fewer of. Returns the COO arrays, the variables of their
+    columns and how many of those are preferred free"""
+    index, columns, data, consts = coo
+    used, local = numpy.unique(columns, return_inverse = True)
+    if len(used) == len(vars):
+        return coo, vars, nfree
+    used = used.tolist()
+    first_free = len(vars) - nfree
+    return ((index, local, data, consts), [vars[j] for j in used], 
+        sum(1 for j in used if j >= first_free))
+
+def _group_components(keys):
+    """the connected components of the incidence graph of rows, given as the
+    keys (variable ids or columns) of each row in turn: a list of lists of row
+    indexes. Rows without keys form their own"""
+    index = {}
+    parent = []
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    roots = []
+    for row in keys:
+        root = None
+        for v in row:
+            if v not in index:
+                index[v] = len(parent)
+                parent.append(len(parent))
+            i = find(index[v])
+            if root is None:
+                root = i
+            elif i != root:
+                parent[i] = root
+        roots.append(root)
+
+    groups = OrderedDict()
+    for i, root in enumerate(roots):
+        key = ("novars", i) if root is None else find(root)
+        groups.setdefault(key, []).append(i)
+    return groups.values()
+
+class Factorization(object):
+    """the reduced form of a system's coefficient matrix, together with the row
+    operations that produced it, so the system can be re-solved for new
+    constants without eliminating again"""
+    __slots__ = ["variables", "pivots", "terms", "transform"]
+    def __init__(self, coeffs, variables):
+        m, n = coeffs.shape
+        if len(variables) != n:
+            raise ValueError("Expected %d variables" % (n,))
+        # eliminating [A | I] leaves [R | T] with T * A = R
+        mat = numpy.hstack((coeffs, numpy.eye(m)))
+        self.pivots = rref(mat, n)
+        self.variables = list(variables)
+        pivot_cols = set(self.pivots)
+        free = numpy.array([j for j in range(n) if j not in pivot_cols], int)
+        self.terms = []
+        for k in range(len(self.pivots)):
+            row = mat[k, free] if len(free) else numpy.zeros(0)
+            nz = numpy.flatnonzero(row)
+            self.terms.append(zip(free[nz].tolist(), row[nz].tolist()))
+        self.transform = mat[:, n:].copy()
+    def __repr__(self):
+        return "<Factorization of %d equations, %d variables, rank %d>" % (self.transform.shape[0], 
+            len(self.variables), len(self.pivots))
+
+    def solve(self, consts, affine = False, variables = None):
+        """back-substitutes a new constant column; returns the assignments, of
+        `variables` in place of the ones it was built for if given (e.g. those
+        of a rebuilt layout of the same structure)"""
+        if variables is None:
+            variables = self.variables
+        elif len(variables) != len(self.variables):
+            raise ValueError("Expected %d variables" % (len(self.variables),))
+        consts = numpy.asarray(consts, float)
+        reduced = numpy.dot(self.transform, consts)
+        rank = len(self.pivots)
+        scale = 1.0 + (numpy.abs(consts).max() if len(consts) else 0.0)
+        if rank < len(reduced) and numpy.abs(reduced[rank:]).max() > TOLERANCE * scale:
+            # a row of the form (0 0 ... 0 x) means a contradiction
+            raise NoSolutionsExist()
+        return _pivot_assignments(variables, ((j, float(reduced[k]), self.terms[k]) 
+            for k, j in enumerate(self.pivots)), affine)
+
+class FactorizationCache(object):
+    """Factorizations keyed by the structure of a system: the number of
+    columns and the (column, coefficient) terms of every equation, i.e.
+    everything but the constants and the variables themselves. A layout
+    rebuilt with new nodes (hence new variable names) but the same shape hits
+    the entry of the previous one. Keeps the `maxsize` most recently used
+    ones"""
+    def __init__(self, maxsize = 32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+    def __len__(self):
+        return len(self._entries)
+    def clear(self):
+        self._entries.clear()
+    
+    def get(self, key, coeffs_factory, variables):
+        """returns the factorization stored under `key`, building it from
+        ``coeffs_factory()`` on a miss"""
+        fact = self._entries.pop(key, None)
+        if fact is None:
+            self.misses += 1
+            fact = Factorization(coeffs_factory(), variables)
+        else:
+            self.hits += 1
+        self._entries[key] = fact
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last = False)
+        return fact
+
 #===================================================================================================
 # linear systems
 #===================================================================================================
@@ -171,23 +776,74 @@ class LinEq(object):
     def __repr__(self):
         return "%r = %r" % (self.lhs, self.rhs)
 
+class SymbolTable(object):
+    """interns variable names to dense integer ids, handed out in creation
+    order; every LinVar of a given name gets the same id.
+
+    Names are kept until released: a process that keeps building new layouts
+    (whose names come from ever-growing counters) should release the
+    variables of a layout once it is done with it, e.g.
+    ``symbols.release(linsys.get_vars())``, and their ids are handed out
+    again. Nothing (no LinVar, store or solver) may use them after that"""
+    __slots__ = ["ids", "names", "free"]
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+        self.free = []
+    def __len__(self):
+        return len(self.names) - len(self.free)
+    def intern(self, name):
+        id = self.ids.get(name)                             # @ReservedAssignment
+        if id is None:
+            if self.free:
+                id = self.free.pop()                        # @ReservedAssignment
+                self.names[id] = name
+            else:
+                id = len(self.names)                        # @ReservedAssignment
+                self.names.append(name)
+            self.ids[name] = id
+        return id
+    def release(self, keys):
+        """forgets the given LinVars, variable names or ids"""
+        for key in keys:
+            id = self.get(key)                              # @ReservedAssignment
+            if id is None or self.names[id] is None:
+                continue
+            del self.ids[self.names[id]]
+            self.names[id] = None
+            self.free.append(id)
+    def get(self, key, default = None):
+        """the id of a LinVar, a variable name or an id, or `default`"""
+        if isinstance(key, LinVar):
+            return key.id
+        if isinstance(key, (int, long)):
+            return key if 0 <= key < len(self.names) and self.names[key] is not None else default
+        return self.ids.get(key, default)
+    def id_of(self, key):
+        id = self.get(key)                                  # @ReservedAssignment
+        if id is None:
+            raise KeyError(key)
+        return id
+
+symbols = SymbolTable()
+
 class LinVar(LinearMixin):
-    __slots__ = ["name", "kind", "default"]
+    __slots__ = ["name", "kind", "default", "id"]
     def __init__(self, name, kind = None, default = None):
         self.name = name
         self.kind = kind
         self.default = default
+        self.id = symbols.intern(name)
     def __repr__(self):
         return self.name
     def __eq__(self, other):
         if isinstance(other, LinVar):
-            return self.name == other.name
-        else:
-            return self.name == other
+            return self.id == other.id
+        return False
     def __ne__(self, other):
         return not (self == other)
     def __hash__(self):
-        return hash(self.name)
+        return self.id
     def __getitem__(self, default):
         self.default = default
         return self
@@ -223,6 +879,10 @@ class Coeff(LinearMixin):
         return hash((self.var, self.coeff))
 
 class LinSum(LinearMixin):
+    """a sum of Coeffs and scalars. Like the other expressions it is never
+    changed once built: ``a + b`` copies the elements of both into a new
+    LinSum, so summing n terms one ``+`` at a time costs O(n^2). Build long
+    sums in a LinSumBuilder, which is the supported way to accumulate them"""
     __slots__ = ["elements"]
     def __init__(self, *elements):
         self.elements = []
@@ -251,6 +911,215 @@ class LinSum(LinearMixin):
     def __hash__(self):
         return hash(tuple(self.elements))
 
+class LinSumBuilder(object):
+    """a linear expression accumulated in place: the coefficient of each
+    variable is kept in a dict (by id) and merged as terms are added, so
+    adding n terms costs O(n). ``build()`` returns it as a LinSum. This is how
+    sums of more than a couple of terms should be built (see LinSum)"""
+    __slots__ = ["vars", "coeffs", "const"]
+    def __init__(self, *elements):
+        self.vars = []
+        self.coeffs = {}
+        self.const = 0
+        for elem in elements:
+            self.add(elem)
+    def __repr__(self):
+        return "<LinSumBuilder %r>" % (self.build(),)
+    def __len__(self):
+        return len(self.vars)
+    
+    def add(self, elem, scalar = 1):
+        """adds ``scalar * elem`` for a LinVar, Coeff, LinSum, builder or scalar"""
+        if isinstance(elem, LinVar):
+            self._add_var(elem, scalar)
+        elif isinstance(elem, Coeff):
+            self._add_var(elem.var, elem.coeff * scalar)
+        elif isinstance(elem, LinSum):
+            for e in elem.elements:
+                self.add(e, scalar)
+        elif isinstance(elem, LinSumBuilder):
+            for v in elem.vars:
+                self._add_var(v, elem.coeffs[v.id] * scalar)
+            self.const += elem.const * scalar
+        elif isinstance(elem, scalar_types):
+            self.const += elem * scalar
+        else:
+            raise TypeError("cannot sum %r" % (elem,))
+        return self
+    def _add_var(self, var, coeff):
+        if var.id in self.coeffs:
+            self.coeffs[var.id] += coeff
+        else:
+            self.vars.append(var)
+            self.coeffs[var.id] = coeff
+    def __iadd__(self, other):
+        return self.add(other)
+    def __isub__(self, other):
+        return self.add(other, -1)
+    
+    def build(self):
+        """the LinSum of the terms so far, in the order their variables first
+        appeared, followed by the constant (if any)"""
+        elements = [Coeff(v, self.coeffs[v.id]) for v in self.vars]
+        if self.const != 0 or not elements:
+            elements.append(self.const)
+        return LinSum(*elements)
+
+def _equation_terms(eq):
+    """``([(var, coeff), ...], const)`` of `eq` moved to the form ``sum(coeff *
+    var) = const``; a variable may appear more than once"""
+    vars = []                                               # @ReservedAssignment
+    scalars = []
+    
+    if isinstance(eq.lhs, LinSum):
+        vars.extend(e for e in eq.lhs if isinstance(e, Coeff))
+        scalars.extend(-e for e in eq.lhs if isinstance(e, scalar_types))
+    elif isinstance(eq.lhs, Coeff):
+        vars.append(eq.lhs)
+    elif isinstance(eq.lhs, scalar_types):
+        scalars.append(-eq.lhs)
+    elif isinstance(eq.lhs, LinVar):
+        vars.append(Coeff(eq.lhs, 1))
+    else:
+        raise ValueError(eq.lhs)
+    
+    if isinstance(eq.rhs, LinSum):
+        vars.extend(-e for e in eq.rhs if isinstance(e, Coeff))
+        scalars.extend(e for e in eq.rhs if isinstance(e, scalar_types))
+    elif isinstance(eq.rhs, Coeff):
+        vars.append(-eq.rhs)
+    elif isinstance(eq.rhs, scalar_types):
+        scalars.append(eq.rhs)
+    elif isinstance(eq.rhs, LinVar):
+        vars.append(Coeff(eq.rhs, -1))
+    else:
+        raise ValueError(eq.rhs)
+    return [(v.var, v.coeff) for v in vars], sum(scalars)
+
+def _merge_terms(eq, merged, table = None):
+    """adds the terms of `eq`, moved to the left hand side, to `merged` (var id
+    -> coeff), and returns its constant: `eq` becomes ``sum(coeff * var) =
+    const``. New variables are registered in `table` (var id -> LinVar) if
+    given. A single pass over the elements, building no intermediate terms"""
+    const = 0
+    for sign, side in ((1, eq.lhs), (-1, eq.rhs)):
+        for e in side.elements:
+            if isinstance(e, Coeff):
+                id = e.var.id                               # @ReservedAssignment
+                if id in merged:
+                    merged[id] += sign * e.coeff
+                else:
+                    merged[id] = sign * e.coeff
+                    if table is not None and id not in table:
+                        table[id] = e.var
+            else:
+                const -= sign * e
+    return const
+
+class ConstraintStore(object):
+    """Equations kept as flat arrays instead of LinEq/LinSum/Coeff objects: a
+    (row, var id, coeff) triple per term, every term moved to the left hand
+    side, and a constant per row, i.e. ``sum(coeff * var) = const``. Rows are
+    appended directly with append_row (dsl's get_constraints writes them so),
+    and LinEqs are flattened as they are appended. LinSys takes a store in
+    place of a list of equations"""
+    __slots__ = ["rows", "ids", "coeffs", "consts", "vars"]
+    def __init__(self, equations = ()):
+        self.rows = array.array("l")
+        self.ids = array.array("l")
+        self.coeffs = array.array("d")
+        self.consts = array.array("d")
+        self.vars = {}
+        self.extend(equations)
+    def __repr__(self):
+        return "<ConstraintStore of %d equations, %d variables, %d terms>" % (len(self), len(self.vars), 
+            len(self.coeffs))
+    def __len__(self):
+        return len(self.consts)
+    def __iter__(self):
+        """the rows as LinEqs"""
+        for terms, const in self.iter_rows():
+            yield LinEq(LinSum(*[Coeff(self.vars[id], coeff) for id, coeff in terms.items()]), const)
+    
+    def append(self, equation):
+        # keeps the terms in order, as append_row does
+        merged = OrderedDict()
+        const = _merge_terms(equation, merged, self.vars)
+        self._append_ids(merged, const)
+    def extend(self, equations):
+        for eq in equations:
+            self.append(eq)
+    def append_row(self, terms, const):
+        """appends ``sum(coeff * var) = const``, given `terms` as (LinVar, coeff)
+        pairs; repeated variables are merged, the terms keep their order"""
+        ids = []
+        merged = {}
+        for var, coeff in terms:
+            if var.id not in merged:
+                ids.append(var.id)
+                merged[var.id] = coeff
+                if var.id not in self.vars:
+                    self.vars[var.id] = var
+            else:
+                merged[var.id] += coeff
+        self._append_terms(ids, [merged[k] for k in ids], const)
+    def _append_ids(self, terms, const):
+        self._append_terms(terms.keys(), terms.values(), const)
+    def _append_terms(self, ids, coeffs, const):
+        i = len(self.consts)
+        self.rows.extend([i] * len(ids))
+        self.ids.extend(ids)
+        self.coeffs.extend(coeffs)
+        self.consts.append(const)
+    
+    def ordered_vars(self):
+        """the variables, in the order they first appear in"""
+        if not self.ids:
+            return []
+        ids = numpy.frombuffer(self.ids, numpy.int_)
+        first = numpy.unique(ids, return_index = True)[1]
+        return [self.vars[id] for id in ids[numpy.sort(first)].tolist()]
+    
+    def iter_rows(self):
+        """yields a (var id -> coeff, constant) pair per row"""
+        bounds = self._bounds()
+        for i, const in enumerate(self.consts):
+            start, end = bounds[i], bounds[i + 1]
+            yield dict(itertools.izip(self.ids[start:end], self.coeffs[start:end])), const
+    def _bounds(self):
+        """the offset of each row's first term, followed by the number of terms"""
+        if not self.rows:
+            return [0] * (len(self.consts) + 1)
+        rows = numpy.frombuffer(self.rows, numpy.int_)
+        return numpy.searchsorted(rows, numpy.arange(len(self.consts) + 1)).tolist()
+    
+    def subset(self, indexes):
+        """a new store holding the rows in `indexes`, in that order"""
+        bounds = self._bounds()
+        sub = ConstraintStore()
+        for i in indexes:
+            start, end = bounds[i], bounds[i + 1]
+            ids = self.ids[start:end]
+            for id in ids:                                  # @ReservedAssignment
+                if id not in sub.vars:
+                    sub.vars[id] = self.vars[id]
+            sub._append_ids(OrderedDict(itertools.izip(ids, self.coeffs[start:end])), self.consts[i])
+        return sub
+    def __delitem__(self, index):
+        if index < 0:
+            index += len(self)
+        rest = self.subset([i for i in range(len(self)) if i != index])
+        for name in self.__slots__:
+            setattr(self, name, getattr(rest, name))
+
+class EquationList(list):
+    """a list of LinEqs that takes rows like a ConstraintStore does, e.g. from
+    dsl's get_constraints"""
+    def append_row(self, terms, const):
+        """appends ``sum(coeff * var) = const``, given `terms` as (LinVar,
+        coeff) pairs"""
+        self.append(LinEq(LinSum(*[Coeff(var, coeff) for var, coeff in terms]), const))
+
 class LinSys(object):
     __slots__ = ["equations"]
     def __init__(self, equations):
@@ -265,86 +1134,408 @@ class LinSys(object):
         return "\n".join(repr(eq) for eq in self.equations)
     
     def get_vars(self):
-        vars = set()                                        # @ReservedAssignment
+        return set(self._var_table().values())
+    
+    def _var_table(self):
+        """id -> LinVar of every variable in the system"""
+        if isinstance(self.equations, ConstraintStore):
+            return self.equations.vars
+        table = {}
         for eq in self.equations:
-            if isinstance(eq.lhs, LinSum):
-                vars.update(e.var for e in eq.lhs if isinstance(e, Coeff))
-            elif isinstance(eq.lhs, Coeff):
-                vars.append(eq.lhs.var)
-            elif isinstance(eq.lhs, LinVar):
-                vars.append(eq.lhs)
-            
-            if isinstance(eq.rhs, LinSum):
-                vars.update(e.var for e in eq.rhs if isinstance(e, Coeff))
-            elif isinstance(eq.rhs, Coeff):
-                vars.add(eq.rhs.var)
-            elif isinstance(eq.rhs, LinVar):
-                vars.add(eq.rhs)
-        return vars
+            for side in (eq.lhs, eq.rhs):
+                if isinstance(side, LinSum):
+                    for e in side:
+                        if isinstance(e, Coeff):
+                            table[e.var.id] = e.var
+                elif isinstance(side, Coeff):
+                    table[side.var.id] = side.var
+                elif isinstance(side, LinVar):
+                    table[side.id] = side
+        return table
     
-    def to_matrix(self, vars_indexes):
-        equations = []
+    def _iter_rows(self):
+        """yields a (var id -> coeff, constant) pair per equation"""
+        if isinstance(self.equations, ConstraintStore):
+            for row in self.equations.iter_rows():
+                yield row
+            return
         for eq in self.equations:
-            vars = []                                       # @ReservedAssignment
-            scalars = []
-            
-            if isinstance(eq.lhs, LinSum):
-                vars.extend(e for e in eq.lhs if isinstance(e, Coeff))
-                scalars.extend(-e for e in eq.lhs if isinstance(e, scalar_types))
-            elif isinstance(eq.lhs, Coeff):
-                vars.append(eq.lhs)
-            elif isinstance(eq.lhs, scalar_types):
-                scalars.append(-eq.lhs)
-            elif isinstance(eq.lhs, LinVar):
-                vars.append(Coeff(eq.lhs, 1))
-            else:
-                raise ValueError(eq.lhs)
-            
-            if isinstance(eq.rhs, LinSum):
-                vars.extend(-e for e in eq.rhs if isinstance(e, Coeff))
-                scalars.extend(e for e in eq.rhs if isinstance(e, scalar_types))
-            elif isinstance(eq.rhs, Coeff):
-                vars.append(-eq.rhs)
-            elif isinstance(eq.rhs, scalar_types):
-                scalars.append(eq.rhs)
-            elif isinstance(eq.rhs, LinVar):
-                vars.append(Coeff(eq.rhs, -1))
-            else:
-                raise ValueError(eq.rhs)
-            
             varbins = {}
-            for v in vars:
-                #if v.var not in vars_indexes:
-                #    vars_indexes[v.var] = len(vars_indexes)
-                if v.var not in varbins:
-                    varbins[v.var] = v.coeff
-                else:
-                    varbins[v.var] += v.coeff
-            equations.append((varbins.items(), sum(scalars)))
+            const = _merge_terms(eq, varbins)
+            yield varbins, const
+    
+    def to_matrix(self, vars_indexes):
+        """the augmented matrix, with the columns `vars_indexes` maps each
+        LinVar to; returned along with the variables in column order"""
+        vars = sorted(vars_indexes.keys(), key = lambda v: vars_indexes[v])  # @ReservedAssignment
+        return self._to_dense(dict((v.id, j) for v, j in vars_indexes.items())), vars
+    
+    def to_sparse(self, vars_indexes):
+        vars = sorted(vars_indexes.keys(), key = lambda v: vars_indexes[v])  # @ReservedAssignment
+        return self._to_sparse(dict((v.id, j) for v, j in vars_indexes.items())), vars
+    
+    def _to_dense(self, cols):
+        out = numpy.zeros((len(self.equations), len(cols) + 1), float)
+        if isinstance(self.equations, ConstraintStore):
+            return _coo_to_dense(self._to_coo(cols), len(cols), out = out)
+        for i, (vars, scalar) in enumerate(self._iter_rows()):    # @ReservedAssignment
+            out[i, -1] = scalar
+            for id, coeff in vars.items():                  # @ReservedAssignment
+                out[i, cols[id]] = coeff
+        return out
+    
+    def _to_sparse(self, cols):
+        matrix = SparseMatrix(len(cols))
+        if isinstance(self.equations, ConstraintStore):
+            return _coo_to_sparse(self._to_coo(cols), len(cols))
+        for vars, scalar in self._iter_rows():              # @ReservedAssignment
+            matrix.append(dict((cols[id], float(coeff)) for id, coeff in vars.items() if coeff != 0), 
+                float(scalar))
+        return matrix
+    
+    def components(self):
+        """splits the system into independent subsystems (the connected
+        components of the variable/equation incidence graph), returned as a
+        list of LinSys. Equations without variables form their own"""
+        return [self._subset(indexes) for indexes in _group_components(varbins for varbins, _ in self._iter_rows())]
+    
+    def _subset(self, indexes):
+        """the system made of the equations in `indexes`"""
+        if isinstance(self.equations, ConstraintStore):
+            return LinSys(self.equations.subset(indexes))
+        return LinSys([self.equations[i] for i in indexes])
+    
+    def solve(self, freevars = (), sparse = False, ordering = None, cache = None, decompose = False, 
+            pool = None, affine = False, definitions = True, presolve = True, method = None, stats = None, 
+            dtype = None, storage = None, block_bytes = None):
+        """solves the system, preferring the variables towards the end of
+        `freevars` as the free ones.
+        
+        With ``sparse = True`` the sparse backend is used; adding
+        ``ordering = "markowitz"`` lets it reorder consecutive free variables of
+        the same kind (the freeness classes ConstraintSolver sorts by) to keep
+        fill-in low; the fill-in achieved is recorded in `stats` (see below).
+        
+        Given a FactorizationCache as `cache`, the (dense) factorization of the
+        coefficients is looked up there, so systems differing only in their
+        constants cost a back-substitution each.
+        
+        With ``decompose = True`` every independent subsystem (see components)
+        is solved on its own and the assignments merged; given a process `pool`
+        (anything with a ``map``, e.g. multiprocessing.Pool), the subsystems of
+        PARALLEL_THRESHOLD variables or more are eliminated there.
+        
+        With ``affine = True`` the dependent variables are returned as
+        AffineExprs over the free ones instead of BinExpr chains.
+        
+        Unless ``definitions = False``, equations are solved by substitution,
+        each one defining its least free variable in terms of the others, as
+        long as substituting it creates at most DEFINITION_FILL terms (see
+        presolve.peel_definitions); only the remaining, coupled, equations go
+        through elimination.
         
-        matrix = numpy.zeros((len(equations), len(vars_indexes) + 1), float)
-        for i, (vars, scalar) in enumerate(equations):      # @ReservedAssignment
-            matrix[i, -1] = scalar
-            for v, coeff in vars:
-                matrix[i, vars_indexes[v]] = coeff
+        Before that, unless ``presolve = False``, duplicate equations are
+        dropped, variables fixed to constants are propagated and ``x = y``
+        aliases collapsed (see presolve.simplify).
         
-        return matrix, sorted(vars_indexes.keys(), key = lambda v: vars_indexes[v])
-    
-    def solve(self, freevars = ()):
-        vars_indexes = {}
-        all_vars = self.get_vars()
-        counter = itertools.count()
-        for v in all_vars:
-            if v not in freevars:
-                vars_indexes[v] = counter.next()
+        ``method = "svd"`` hands the (dense) elimination over to LAPACK
+        instead, see solve_svd.
+        
+        Given a profiling.SolveStats as `stats`, the wall time of every phase
+        (collecting the variables, building the matrix, presolving,
+        eliminating, building the assignments) is added to it, along with the
+        shape, nonzeros and free variables of every matrix eliminated (and the
+        fill-in of the sparse ones).
+        
+        For systems whose dense matrix does not fit in memory, ``dtype =
+        numpy.float32`` halves it (rank decisions then use FLOAT32_TOLERANCE,
+        which is fine for pixel positions), and `storage`, a directory, puts it
+        in a memory-mapped file there (removed afterwards); either way it is
+        eliminated a block of rows at a time, within `block_bytes` of working
+        memory (BLOCK_BYTES by default; giving it alone eliminates a float64
+        matrix in memory that way), see solve_blocked"""
+        if method not in (None, "svd"):
+            raise ValueError("unknown method %r" % (method,))
+        if method == "svd" and sparse:
+            raise ValueError("method 'svd' is dense, it cannot be combined with sparse")
+        blocked = dtype is not None or storage is not None or block_bytes is not None
+        if blocked and (sparse or method or cache is not None):
+            raise ValueError("dtype, storage and block_bytes only apply to the plain dense elimination")
+        with phase(stats, "get_vars"):
+            vars, cols = self._index_vars(freevars)        # @ReservedAssignment
+        if ordering not in (None, "markowitz"):
+            raise ValueError("unknown ordering %r" % (ordering,))
+        options = dict(sparse = sparse, ordering = ordering, cache = cache, decompose = decompose, pool = pool, 
+            affine = affine, method = method, stats = stats, dtype = dtype, storage = storage, 
+            block_bytes = block_bytes)
+        rows = None
+        if presolve or definitions:
+            with phase(stats, "to_matrix"):
+                rows = self._index_rows(cols)
+        return self._solve_indexed(rows, vars, cols, len(freevars), presolve, definitions, options)
+    
+    def solve_iterative(self, values, freevars = (), x0 = None, tol = 1e-10, maxiter = None, stats = None):
+        """solves the system numerically, by conjugate gradients on the normal
+        equations (see iterative.cgls), into an IterativeSolution of plain
+        numbers, which also tells the iterations, the residual and whether it
+        converged.
+        
+        The free variables, those ``solve(freevars)`` leaves free, take their
+        value from `values` (keyed by LinVar or name): ValueError is raised if
+        one is missing, or if a key is not a variable of the system, and
+        NoSolutionsExist if the system contradicts itself. Passing the previous
+        solution as `x0` warm-starts it, e.g. when only the window size
+        changed. A solution that did not converge within `maxiter` iterations
+        (see iterative.max_iterations) has ``converged`` False"""
+        with phase(stats, "get_vars"):
+            vars, cols = self._index_vars(())              # @ReservedAssignment
+        given = numpy.zeros(len(vars), bool)
+        fixed = numpy.zeros(len(vars))
+        for k, v in values.items():
+            j = cols.get(symbols.get(k))
+            if j is None:
+                raise ValueError("%r is not a known variable in this system" % (k,))
+            given[j] = True
+            fixed[j] = v
+        # which variables are free takes the exact solve, which also finds
+        # contradictions, where least squares would just leave a residual
+        missing = [v for v, value in self.solve(freevars).iteritems() 
+            if isinstance(value, FreeVar) and not given[cols[v.id]]]
+        if missing:
+            raise ValueError("no value given for the free variables %s" % (", ".join(sorted(map(str, missing))),))
+        with phase(stats, "to_matrix"):
+            rows, columns, data, consts = self._to_coo(cols)
+        # move the given variables over to the constants
+        keep = ~given[columns]
+        moved = numpy.bincount(rows[~keep], data[~keep] * fixed[columns[~keep]], minlength = len(consts))
+        start = numpy.zeros(len(vars))
+        for k, v in (x0 or {}).items():
+            j = cols.get(symbols.get(k))
+            if j is not None:
+                start[j] = v
+        limit = maxiter if maxiter is not None else max_iterations(len(vars))
+        with phase(stats, "eliminate"):
+            x, iterations, _ = cgls(rows[keep], columns[keep], data[keep], consts - moved, len(vars), start, 
+                tol, limit)
+        if stats is not None:
+            stats.matrix((len(consts), len(vars) + 1), len(data), 0)
+        x[given] = fixed[given]
+        residual = numpy.linalg.norm(numpy.bincount(rows, data * x[columns], minlength = len(consts)) - consts)
+        return IterativeSolution(zip(vars, x.tolist()), iterations, residual, iterations < limit)
+    
+    def _index_vars(self, freevars):
+        """lays out the columns: the variables not in `freevars` (LinVars or
+        names) first, then `freevars` in order. Returns the LinVars in column
+        order and the id -> column mapping"""
+        table = self._var_table()
+        free_ids = []
         for fv in freevars:
-            if fv not in all_vars:
+            id = symbols.get(fv)                            # @ReservedAssignment
+            if id not in table:
                 raise ValueError("%r is not a known variable in this system" % (fv,))
-            vars_indexes[fv] = counter.next()
+            free_ids.append(id)
+        freeset = set(free_ids)
+        order = [id for id in table if id not in freeset] + free_ids
+        return [table[id] for id in order], dict((id, j) for j, id in enumerate(order))
+    
+    def _to_coo(self, cols):
+        """the equations as (row, column, coeff) triples and a constant vector"""
+        if isinstance(self.equations, ConstraintStore) and len(self.equations.ids):
+            store = self.equations
+            # renumbered among the store's own ids, however large the symbol table
+            ids, local = numpy.unique(numpy.frombuffer(store.ids, numpy.int_), return_inverse = True)
+            lookup = numpy.array([cols[id] for id in ids.tolist()], int)
+            return (numpy.frombuffer(store.rows, numpy.int_), lookup[local], 
+                numpy.frombuffer(store.coeffs, float), numpy.array(store.consts, float))
+        rows, columns, data, consts = [], [], [], []
+        for i, (varbins, scalar) in enumerate(self._iter_rows()):
+            for id, coeff in varbins.iteritems():            # @ReservedAssignment
+                rows.append(i)
+                columns.append(cols[id])
+                data.append(coeff)
+            consts.append(scalar)
+        return numpy.array(rows, int), numpy.array(columns, int), numpy.array(data, float), \
+            numpy.array(consts, float)
+    
+    def _index_rows(self, cols):
+        """the equations as ``({column : coeff}, constant)`` rows"""
+        if isinstance(self.equations, ConstraintStore):
+            return list(_coo_rows(*self._to_coo(cols)))
+        return [(dict((cols[id], coeff) for id, coeff in varbins.items() if coeff != 0), scalar)
+            for varbins, scalar in self._iter_rows()]
+    
+    def _solve_indexed(self, rows, vars, cols, nfree, presolve, definitions, options):  # @ReservedAssignment
+        """solves the indexed `rows` over `vars` (the last `nfree` of which are
+        preferred free): the presolve and definitions passes, each working on
+        the rows the previous one left, then the elimination of what remains.
+        Without either pass, `rows` is None and the elimination reads the
+        equations straight into its matrix"""
+        stats = options["stats"]
+        steps = ()
+        if presolve:
+            with phase(stats, "presolve"):
+                rows, steps = simplify(rows, len(vars), EPSILON)
+        peeled = ()
+        if definitions:
+            with phase(stats, "definitions"):
+                peeled, rows = peel_definitions(rows, len(vars), TOLERANCE, DEFINITION_FILL)
         
-        #print "@@", sorted(vars_indexes, key=lambda k: vars_indexes[k])
-        matrix, vars = self.to_matrix(vars_indexes)         # @ReservedAssignment
-        return solve_matrix(matrix, vars)
+        assignments = {}
+        if rows is None:
+            # straight from the equations, not rebuilt through rows
+            assignments = self._eliminate(lambda: (self._to_coo(cols), vars, nfree), options)
+        elif rows:
+            assignments = self._eliminate(lambda: _compact(_rows_to_coo(rows), vars, nfree), options)
+        if steps or peeled:
+            with phase(stats, "assign"):
+                self._expand_definitions(vars, peeled, assignments, options["affine"])
+                self._expand_steps(vars, steps, assignments, options["affine"])
+        for v in vars:
+            if v not in assignments:
+                # in no equation left, e.g. cancelled out
+                assignments[v] = FreeVar(v)
+        return assignments
+    
+    def _eliminate(self, build, options):
+        """the elimination stage: solves the system `build` gives as the COO
+        arrays, the variables of their columns and how many of those are
+        preferred free (see _compact), by the backend `options` pick. `build`
+        is called once, within the backend's to_matrix phase. Only the
+        variables of the columns get assigned"""
+        stats = options["stats"]
+        affine = options["affine"]
+        if options["decompose"]:
+            return self._solve_components(build, options)
+        if options["cache"] is not None:
+            return self._solve_cached(build, options["cache"], affine, stats)
+        if options["sparse"]:
+            with phase(stats, "to_matrix"):
+                coo, vars, nfree = build()                  # @ReservedAssignment
+                smat = _coo_to_sparse(coo, len(vars))
+            blocks = None
+            if options["ordering"] == "markowitz":
+                blocks = self._freeness_blocks(vars, nfree)
+            return solve_sparse(smat, vars, blocks, affine, stats)
+        if options["dtype"] is not None or options["storage"] is not None or options["block_bytes"] is not None:
+            return self._solve_blocked(build, affine, options["dtype"], options["storage"], 
+                options["block_bytes"] or BLOCK_BYTES, stats)
+        with phase(stats, "to_matrix"):
+            coo, vars, _ = build()                          # @ReservedAssignment
+            mat = _coo_to_dense(coo, len(vars))
+        if options["method"] == "svd":
+            return solve_svd(mat, vars, affine, stats)
+        return solve_matrix(mat, vars, affine, stats = stats)
+    
+    def _solve_blocked(self, build, affine, dtype, storage, budget, stats):
+        path = None
+        try:
+            with phase(stats, "to_matrix"):
+                coo, vars, _ = build()                      # @ReservedAssignment
+                nrows = len(coo[3])
+                out = None
+                if storage is not None and nrows:
+                    fd, path = tempfile.mkstemp(suffix = ".mat", dir = storage)
+                    os.close(fd)
+                    out = numpy.memmap(path, dtype or float, "w+", shape = (nrows, len(vars) + 1))
+                mat = _coo_to_dense(coo, len(vars), dtype or float, out)
+            return solve_blocked(mat, vars, affine, budget, stats)
+        finally:
+            if path is not None:
+                mat = out = None
+                os.remove(path)
+    
+    @staticmethod
+    def _expand_steps(vars, steps, assignments, affine):   # @ReservedAssignment
+        """replays the presolve `steps` in reverse, into `assignments`"""
+        for step, j, arg in reversed(steps):
+            if step == "const":
+                assignments[vars[j]] = float(arg)
+                continue
+            rep = vars[arg]
+            if rep not in assignments:
+                assignments[rep] = FreeVar(rep)
+            value = assignments[rep]
+            if isinstance(value, FreeVar):
+                # the alias itself must not look free
+                value = _linear_value(0.0, [(1.0, value)], affine)
+            assignments[vars[j]] = value
+    
+    @staticmethod
+    def _expand_definitions(vars, peeled, assignments, affine):   # @ReservedAssignment
+        """solves the `peeled` rows (see presolve.peel_definitions) by
+        substitution, in reverse, into `assignments`: each definition only
+        refers to variables assigned by now, or free ones"""
+        for terms, const in reversed(peeled):
+            j = min(terms)
+            a = terms[j]
+            for j2 in terms:
+                if j2 != j and vars[j2] not in assignments:
+                    assignments[vars[j2]] = FreeVar(vars[j2])
+            assignments[vars[j]] = _linear_value(const / float(a), [(-coeff / float(a), assignments[vars[j2]]) 
+                for j2, coeff in sorted(terms.items()) if j2 != j], affine)
+    
+    def _solve_components(self, build, options):
+        stats = options["stats"]
+        pool = options["pool"]
+        options = dict(options, decompose = False)
+        assignments = {}
+        parallel = []
+        with phase(stats, "get_vars"):
+            coo, vars, nfree = build()                      # @ReservedAssignment
+            rows = list(_coo_rows(*coo))
+            groups = _group_components(terms for terms, _ in rows)
+        for indexes in groups:
+            part = [rows[i] for i in indexes]
+            if pool is not None and options["dtype"] is None and options["storage"] is None and \
+                    options["block_bytes"] is None and \
+                    len(set(j for terms, _ in part for j in terms)) >= PARALLEL_THRESHOLD:
+                with phase(stats, "to_matrix"):
+                    coo, part_vars, _ = _compact(_rows_to_coo(part), vars, nfree)
+                    mat = _coo_to_dense(coo, len(part_vars))
+                nonzeros = numpy.count_nonzero(mat[:, :-1]) if stats is not None else None
+                parallel.append((mat, part_vars, nonzeros))
+            else:
+                assignments.update(self._eliminate(lambda part = part: _compact(_rows_to_coo(part), vars, nfree), 
+                    options))
+        if parallel:
+            with phase(stats, "eliminate"):
+                reduced = pool.map(_reduce_block, [mat for mat, _, _ in parallel])
+            for (_, part_vars, nonzeros), (mat, pivots) in zip(parallel, reduced):
+                with phase(stats, "assign"):
+                    part = _rref_assignments(mat, pivots, part_vars, options["affine"])
+                assignments.update(_record_matrix(stats, mat.shape, nonzeros, part))
+        return assignments
+    
+    def _solve_cached(self, build, cache, affine, stats):
+        with phase(stats, "to_matrix"):
+            coo, vars, _ = build()                          # @ReservedAssignment
+            rows = [(sorted(terms.iteritems()), scalar) for terms, scalar in _coo_rows(*coo)]
+        key = (len(vars), tuple(tuple(terms) for terms, _ in rows))
+        def coeffs_factory():
+            coeffs = numpy.zeros((len(rows), len(vars)), float)
+            for i, (terms, _) in enumerate(rows):
+                for j, coeff in terms:
+                    coeffs[i, j] = coeff
+            return coeffs
+        with phase(stats, "eliminate"):
+            fact = cache.get(key, coeffs_factory, vars)
+        with phase(stats, "assign"):
+            assignments = fact.solve(numpy.array([scalar for _, scalar in rows], float), affine, vars)
+        return _record_matrix(stats, (len(rows), len(vars) + 1), sum(len(terms) for terms, _ in rows), 
+            assignments)
+    
+    @staticmethod
+    def _freeness_blocks(vars, nfree):                      # @ReservedAssignment
+        """groups the columns into runs that may be reordered: the variables
+        not among the last `nfree`, then each run of consecutive ones of those
+        of the same kind"""
+        nonfree = len(vars) - nfree
+        blocks = [range(nonfree)]
+        for i in range(nonfree, len(vars)):
+            if i == nonfree or getattr(vars[i], "kind", None) != getattr(vars[i - 1], "kind", None):
+                blocks.append([])
+            blocks[-1].append(i)
+        return blocks
 
 
 if __name__ == "__main__":
@@ -353,7 +1544,7 @@ if __name__ == "__main__":
 #        [3,7,6,8],
 #    ], float)
 #    
-#    eliminate(m)
+#    rref(m)
 #    print m
 #    sol = solve_matrix(m, ["x", "y", "z"])
 #    print sol
@@ -0,0 +1,190 @@
+"""
+Passes that shrink a system before it is handed to elimination. They work on
+rows given as ``({column : coeff}, constant)`` pairs, where lower columns are
+the less free variables (the order LinSys.solve lays the columns out in)
+"""
+import heapq
+
+
+def peel_definitions(rows, ncols, epsilon, max_fill):
+    """Solves rows by substitution, as far as that stays cheap: a row defines
+    its lowest column in terms of its other, freer, columns, which is then
+    substituted away from the other rows holding it.
+
+    Pivoting every row on its lowest column, in whatever order, leaves free
+    the very columns eliminating them in increasing order does, so the rows
+    are picked Markowitz-style, cheapest first, the cost of a row being the
+    number of terms its substitution may create. A row whose lowest column
+    appears in no other row costs nothing: it is simply peeled. Substituting
+    may expose more such rows, and makes others cheaper, so the pass repeats
+    until every row left would cost more than `max_fill`, or the
+    substitutions have created as many terms as the rows held to begin with:
+    beyond that, eliminating the rest is the cheaper way, and the pass stays
+    linear in the terms. Coefficients cancelling out to within `epsilon` are
+    dropped.
+
+    Returns ``(definitions, rows)``: the rows used as definitions, as
+    ``(terms, constant)`` in the order they were made, and the rows left,
+    with the substitutions applied. Each definition only refers to columns
+    that are free, defined by the rows left, or defined after it. A row
+    reduced to ``0 = c`` is dropped unless c is beyond `epsilon` (relative to
+    the constants), so the contradiction surfaces when the rest is solved"""
+    terms = [dict(t) for t, _ in rows]
+    consts = [float(c) for _, c in rows]
+    scale = 1.0 + max([abs(c) for c in consts] or [0.0])
+    colrows = [set() for _ in range(ncols)]
+    for i, t in enumerate(terms):
+        for j in t:
+            colrows[j].add(i)
+    # a heap of the columns of each row, holding stale ones too, keeps finding
+    # the lowest one cheap even for rows with many terms
+    columns = [sorted(t) for t in terms]
+    leads = [c[0] if c else None for c in columns]
+    alive = [True] * len(rows)
+    heap = []
+    budget = sum(len(t) for t in terms)
+
+    def lead(k):
+        while columns[k][0] not in terms[k]:
+            heapq.heappop(columns[k])
+        return columns[k][0]
+    def cost(i):
+        return (len(terms[i]) - 1) * (len(colrows[leads[i]]) - 1)
+    def push(i):
+        if terms[i]:
+            c = cost(i)
+            if c <= max_fill:
+                heapq.heappush(heap, (c, i))
+    def shrunk(j):
+        """column j lost a row, so the rows it leads got cheaper"""
+        if len(colrows[j]) - 1 <= max_fill:
+            for k in colrows[j]:
+                if leads[k] == j:
+                    push(k)
+
+    for i in range(len(rows)):
+        push(i)
+    definitions = []
+    while heap:
+        c, i = heapq.heappop(heap)
+        if not alive[i] or not terms[i]:
+            continue
+        if cost(i) != c:
+            # stale: the row changed since
+            push(i)
+            continue
+        if c > budget:
+            continue
+        alive[i] = False
+        t = terms[i]
+        j = leads[i]
+        a = float(t[j])
+        definitions.append((t, consts[i]))
+        for j2 in t:
+            colrows[j2].discard(i)
+        for k in list(colrows[j]):
+            row = terms[k]
+            f = row.pop(j) / a
+            colrows[j].discard(k)
+            for j2, v in t.iteritems():
+                if j2 == j:
+                    continue
+                v = row.get(j2, 0.0) - f * v
+                if abs(v) > epsilon:
+                    if j2 not in row:
+                        heapq.heappush(columns[k], j2)
+                        colrows[j2].add(k)
+                        budget -= 1
+                    row[j2] = v
+                elif j2 in row:
+                    del row[j2]
+                    colrows[j2].discard(k)
+            consts[k] -= f * consts[i]
+            leads[k] = lead(k) if row else None
+            push(k)
+        for j2 in t:
+            shrunk(j2)
+
+    remaining = [(terms[i], consts[i]) for i in range(len(rows))
+        if alive[i] and (terms[i] or abs(consts[i]) > epsilon * scale)]
+    return definitions, remaining
+
+def _row_key(terms, const):
+    """identifies rows that are scalar multiples of each other"""
+    lead = terms[min(terms)] if terms else 1.0
+    return tuple(sorted((j, c / lead) for j, c in terms.iteritems())), const / lead
+
+def simplify(rows, ncols, epsilon):
+    """Drops duplicate (or proportional) rows, propagates rows fixing a single
+    variable to a constant, and collapses ``x = y`` aliases into their freer
+    variable, repeating as substitutions expose more of them.
+
+    Returns ``(rows, steps)``: the rows left, and the list of steps to replay
+    in reverse to expand the solution of those rows back into the full one.
+    A step is either ``("const", column, value)`` or ``("alias", column,
+    representative column)``. A row reduced to ``0 = c`` with nonzero c is
+    kept, so the contradiction surfaces when the rest is solved"""
+    # in floats: layout coefficients may well be ints
+    terms = [dict((j, float(c)) for j, c in t.iteritems()) for t, _ in rows]
+    consts = [float(c) for _, c in rows]
+    colrows = [set() for _ in range(ncols)]
+    for i, t in enumerate(terms):
+        for j in t:
+            colrows[j].add(i)
+    alive = [True] * len(rows)
+    steps = []
+
+    def eliminate(i, j, replace):
+        """substitutes column j, in every row but i, by ``replace(coeff, row)``"""
+        alive[i] = False
+        for j2 in terms[i]:
+            colrows[j2].discard(i)
+        for k in list(colrows[j]):
+            colrows[j].discard(k)
+            replace(terms[k].pop(j), k)
+            pending.append(k)
+
+    def add_const(coeff, k):
+        consts[k] -= coeff * value
+
+    def add_alias(coeff, k):
+        c = terms[k].get(rep, 0.0) + coeff
+        if abs(c) <= epsilon:
+            terms[k].pop(rep, None)
+            colrows[rep].discard(k)
+        else:
+            terms[k][rep] = c
+            colrows[rep].add(k)
+
+    pending = range(len(rows) - 1, -1, -1)
+    while pending:
+        i = pending.pop()
+        if not alive[i]:
+            continue
+        t = terms[i]
+        if not t:
+            if abs(consts[i]) <= epsilon:
+                alive[i] = False
+        elif len(t) == 1:
+            (j, a), = t.items()
+            value = consts[i] / a
+            steps.append(("const", j, value))
+            eliminate(i, j, add_const)
+        elif len(t) == 2 and abs(consts[i]) <= epsilon:
+            (j, a), (rep, b) = sorted(t.items())
+            if abs(a + b) <= epsilon:
+                steps.append(("alias", j, rep))
+                eliminate(i, j, add_alias)
+
+    seen = set()
+    remaining = []
+    for i in range(len(rows)):
+        if not alive[i]:
+            continue
+        key = _row_key(terms[i], consts[i])
+        if key in seen:
+            continue
+        seen.add(key)
+        remaining.append((terms[i], consts[i]))
+    return remaining, steps
+
@@ -0,0 +1,107 @@
+"""
+Phase-level instrumentation of LinSys.solve and solve_matrix: where a solve
+spends its time (collecting the variables, building the matrix, presolving,
+eliminating, building the assignments) and how large the matrices it ended
+up eliminating were
+"""
+import sys
+import time
+from collections import OrderedDict
+
+# the phases, in the order a solve goes through them
+PHASES = ["get_vars", "to_matrix", "presolve", "definitions", "eliminate", "assign"]
+
+
+class SolveStats(object):
+    """Accumulates the wall time of every phase over one or more solves (a
+    solve that presolves or decomposes goes through some phases several
+    times), and records the shape, nonzeros and number of free variables of
+    every matrix that got eliminated.
+
+    If given, ``callback(stats, phase, seconds)`` is called as each phase
+    ends, e.g. to forward the timings to a logger"""
+    def __init__(self, callback = None):
+        self.callback = callback
+        self.times = OrderedDict()
+        self.calls = OrderedDict()
+        self.matrices = []
+    def __repr__(self):
+        return "<SolveStats %s>" % (", ".join("%s=%.3fs" % (name, t) for name, t in self.times.items()),)
+
+    def clear(self):
+        self.times.clear()
+        self.calls.clear()
+        del self.matrices[:]
+
+    def add(self, phase, seconds):
+        self.times[phase] = self.times.get(phase, 0.0) + seconds
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+        if self.callback is not None:
+            self.callback(self, phase, seconds)
+    def phase(self, name):
+        """a context manager timing the `name` phase"""
+        return _Phase(self, name)
+    def matrix(self, shape, nonzeros, free, fill_in = None):
+        """records an eliminated matrix: its (augmented) shape, its nonzero
+        coefficients and the number of variables left free; for the sparse
+        backend, also the number of nonzeros elimination created (`fill_in`)"""
+        entry = {"shape" : tuple(shape), "nonzeros" : nonzeros, "free" : free}
+        if fill_in is not None:
+            entry["fill_in"] = fill_in
+        self.matrices.append(entry)
+
+    @property
+    def total(self):
+        return sum(self.times.values())
+    def as_dict(self):
+        """everything recorded, as plain (json serializable) data"""
+        return {
+            "times" : dict(self.times),
+            "calls" : dict(self.calls),
+            "matrices" : [dict(m, shape = list(m["shape"])) for m in self.matrices],
+        }
+    def summary(self):
+        """a human readable summary of the phases and matrices, as a string"""
+        lines = ["%-12s %9.3f ms  (%d calls)" % (name, self.times[name] * 1000, self.calls[name])
+            for name in sorted(self.times, key = _phase_order)]
+        lines.append("%-12s %9.3f ms" % ("total", self.total * 1000))
+        for m in self.matrices:
+            line = "matrix %dx%d, %d nonzeros, %d free" % (m["shape"] + (m["nonzeros"], m["free"]))
+            if "fill_in" in m:
+                line += ", %d fill-in" % (m["fill_in"],)
+            lines.append(line)
+        return "\n".join(lines)
+    def report(self, out = None):
+        """prints the summary to `out` (default: sys.stdout)"""
+        if out is None:
+            out = sys.stdout
+        out.write(self.summary() + "\n")
+
+def _phase_order(name):
+    return (PHASES.index(name) if name in PHASES else len(PHASES), name)
+
+class _Phase(object):
+    __slots__ = ["stats", "name", "start"]
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+    def __enter__(self):
+        self.start = time.time()
+    def __exit__(self, t, v, tb):
+        self.stats.add(self.name, time.time() - self.start)
+
+class _NoPhase(object):
+    __slots__ = []
+    def __enter__(self):
+        pass
+    def __exit__(self, t, v, tb):
+        pass
+
+_no_phase = _NoPhase()
+
+def phase(stats, name):
+    """``stats.phase(name)``, or a context manager doing nothing if `stats`
+    is None"""
+    if stats is None:
+        return _no_phase
+    return stats.phase(name)
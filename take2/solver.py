@@ -1,4 +1,6 @@
-from linsys import LinSys, FreeVar, LinVar, LinEq, BinExpr
+from collections import Mapping
+from linsys import (LinSys, FreeVar, LinVar, LinEq, BinExpr, AffineExpr, ConstraintStore, evaluate_batch, 
+    symbols)
 
 
 class RecEvalDict(object):
@@ -6,87 +8,173 @@ class RecEvalDict(object):
     def __init__(self, rec_eval):
         self.rec_eval = rec_eval
     def __getitem__(self, key):
-        return self.rec_eval(key)
+        return self.rec_eval(symbols.id_of(key))
+
+class Results(Mapping):
+    """the results of ConstraintSolver.update, a read-only view keyed like
+    ``solver[var]`` (by LinVar, name or id) and iterating over LinVars; it
+    follows later updates"""
+    __slots__ = ["results", "variables"]
+    def __init__(self, results, variables):
+        self.results = results
+        self.variables = variables
+    def __repr__(self):
+        return "<Results of %d variables>" % (len(self.results),)
+    def __getitem__(self, var):
+        return self.results[symbols.id_of(var)]
+    def __contains__(self, var):
+        return symbols.get(var) in self.results
+    def __iter__(self):
+        return (self.variables[k] for k in self.results)
+    def __len__(self):
+        return len(self.results)
 
 class ConstraintSolver(object):
-    def __init__(self, root):
+    def __init__(self, root, disk_cache = None, **options):
+        """`options` are passed on to LinSys.solve, e.g. ``affine = True``, or
+        a ``cache`` (linsys.FactorizationCache) shared by solvers of layouts
+        that differ only in their constants. Given a `disk_cache`
+        (diskcache.DiskCache), a layout solved by an earlier process is loaded
+        from there instead.
+        
+        Internally everything is keyed by variable id (see linsys.symbols);
+        the public methods take LinVars or variable names"""
         self.root = root
         self.window_width = LinVar("window_width", "input")
         self.window_height = LinVar("window_height", "input")
-        self.linsys = LinSys(list(self.root.get_constraints()))
+        self.linsys = LinSys(self.root.get_constraints(ConstraintStore()))
         self.linsys.append(LinEq(self.root.w, self.window_width))
         self.linsys.append(LinEq(self.root.h, self.window_height))
         freeness_relation = ["offset", "cons", "user", None, "padding", "input"]
-        var_order = sorted(self.linsys.get_vars(), key = lambda v: freeness_relation.index(v.kind))
-        self.solution = self.linsys.solve(var_order)
+        # within a kind, the variables keep the order they first appear in, so
+        # a layout rebuilt with new nodes gets the very same columns (and hits
+        # a FactorizationCache or DiskCache entry of the previous one)
+        var_order = sorted(self.linsys.equations.ordered_vars(), key = lambda v: freeness_relation.index(v.kind))
+        if disk_cache is not None:
+            solution = disk_cache.solve(self.linsys, var_order, **options)
+        else:
+            solution = self.linsys.solve(var_order, **options)
+        self.variables = dict((var.id, var) for var in solution)
+        self.solution = dict((var.id, v) for var, v in solution.items())
         for var in self.get_freevars():
             if var.kind == "padding":
-                self.solution[var] = 0.0
+                self.solution[var.id] = 0.0
+        self.dependents, self.order = self._build_graph()
+        self.positions = dict((k, i) for i, k in enumerate(self.order))
         self.dependencies = self._calculate_dependencies()
         self.results = {}
         self.watchers = {}
 
     def __str__(self):
-        return "\n".join("%s = %s" % (k, v) for k, v in self.solution.items()
+        return "\n".join("%s = %s" % (self.variables[k], v) for k, v in self.solution.items()
             if not isinstance(v, FreeVar))
     def __getitem__(self, var):
-        if var in self.results:
-            return self.results[var]
-        return self.solution[var]
+        id = symbols.id_of(var)                             # @ReservedAssignment
+        if id in self.results:
+            return self.results[id]
+        return self.solution[id]
     def __contains__(self, var):
-        return var in self.results or var in self.solution
+        id = symbols.get(var)                               # @ReservedAssignment
+        return id in self.results or id in self.solution
 
     def is_free(self, var):
-        return isinstance(self.solution[var], FreeVar)
+        return isinstance(self.solution[symbols.id_of(var)], FreeVar)
     def get_freevars(self):
         for k, v in self.solution.items():
             if isinstance(v, FreeVar):
-                yield k
+                yield self.variables[k]
 
     def _get_equation_vars(self, expr):
-        if isinstance(expr, (str, LinVar, FreeVar)):
-            return {expr.name}
-        elif isinstance(expr, BinExpr):
-            return self._get_equation_vars(expr.lhs) | self._get_equation_vars(expr.rhs)
-        else:
-            return set()
-    def _transitive_closure(self, deps):
-        oldlen = -1
-        while oldlen != len(deps):
-            oldlen = len(deps)
-            for resvar, expr in self.solution.items():
-                depvars = self._get_equation_vars(expr)
-                if deps & depvars:
-                    deps.add(resvar)
+        """the ids of the variables `expr` refers to"""
+        found = set()
+        stack = [expr]
+        while stack:
+            expr = stack.pop()
+            if isinstance(expr, FreeVar):
+                found.add(symbols.id_of(expr.name))
+            elif isinstance(expr, (str, LinVar)):
+                found.add(symbols.id_of(expr))
+            elif isinstance(expr, BinExpr):
+                stack.append(expr.lhs)
+                stack.append(expr.rhs)
+            elif isinstance(expr, AffineExpr):
+                found.update(symbols.id_of(v) for v in expr.vars)
+        return found
+    def _build_graph(self):
+        """walks every expression of the solution once. Returns the reverse
+        edges (id -> ids of the variables whose expression refers to it) and
+        a topological order of all the variables, every variable coming after
+        the ones its expression refers to; variables on a cycle go last (update
+        reports them)"""
+        dependents = {}
+        pending = {}
+        for k, expr in self.solution.iteritems():
+            refs = self._get_equation_vars(expr)
+            refs.discard(k)
+            refs.intersection_update(self.solution)
+            pending[k] = len(refs)
+            for ref in refs:
+                dependents.setdefault(ref, []).append(k)
+        order = [k for k, n in pending.iteritems() if n == 0]
+        for k in order:
+            for dep in dependents.get(k, ()):
+                pending[dep] -= 1
+                if pending[dep] == 0:
+                    order.append(dep)
+        if len(order) < len(pending):
+            order.extend(k for k, n in pending.iteritems() if n > 0)
+        return dependents, order
     def _calculate_dependencies(self):
+        """free variable id -> ids of the variables depending on it (itself
+        included), by a breadth-first search of the reverse edges"""
         dependencies = {}
         for var in self.get_freevars():
-            dependencies[var] = {var}
-            self._transitive_closure(dependencies[var])
+            reached = {var.id}
+            queue = [var.id]
+            for k in queue:
+                for dep in self.dependents.get(k, ()):
+                    if dep not in reached:
+                        reached.add(dep)
+                        queue.append(dep)
+            dependencies[var.id] = reached
         return dependencies
 
     def update(self, freevars):
-        prev_results = self.results.copy()
-        for k in freevars.keys():
+        """sets the free variables in `freevars` (keyed by LinVar or name) and
+        recomputes the ones depending on those whose value changed (all of
+        them the first time), in topological order; only the recomputed
+        variables are compared with their previous value and reported to the
+        watchers. Returns the results, keyed by LinVar (see Results)"""
+        given = {}
+        for k, v in freevars.items():
             if not self.is_free(k):
                 raise ValueError("%r is not a free variable" % (k,))
-            for k2 in self.dependencies[k]:
-                self.results.pop(k2, NotImplemented)
+            given[symbols.id_of(k)] = v
+        freevars = given
+        dirty = set()
+        for k, v in freevars.items():
+            if self.results.get(k, NotImplemented) != v:
+                dirty.update(self.dependencies[k])
+        if len(self.results) < len(self.solution):
+            # the first update, or one that failed half way
+            dirty.update(k for k in self.solution if k not in self.results)
+        prev_results = dict((k, self.results.pop(k, NotImplemented)) for k in dirty)
         
         def rec_eval(key):
             if key in self.results:
                 if self.results[key] is NotImplemented:
-                    raise ValueError("Cyclic dependency found, var = %r" % (key,))
+                    raise ValueError("Cyclic dependency found, var = %r" % (self.variables[key],))
                 return self.results[key]
             # set up sentinel to detect cycles
             self.results[key] = NotImplemented
             v = self.solution[key]
             if isinstance(v, FreeVar):
                 if key not in freevars:
-                    if key.default is not None:
-                        self.results[key] = key.default
+                    var = self.variables[key]
+                    if var.default is not None:
+                        self.results[key] = var.default
                     else:
-                        raise ValueError("No value specified for %r" % (key,))
+                        raise ValueError("No value specified for %r" % (var,))
                 else:
                     self.results[key] = freevars[key]
             elif hasattr(v, "eval"):
@@ -96,17 +184,38 @@ class ConstraintSolver(object):
             return self.results[key]
 
         rec_eval_dict = RecEvalDict(rec_eval)
-        for k in self.solution:
-            rec_eval(k)
+        # in topological order, every lookup rec_eval makes is already cached
+        dirty = sorted(dirty, key = self.positions.__getitem__)
+        try:
+            for k in dirty:
+                rec_eval(k)
+        except Exception:
+            # leave no cycle sentinels behind; the next update recomputes these
+            for k in dirty:
+                self.results.pop(k, None)
+            raise
         
-        for k, v in self.results.items():
-            prev = prev_results.get(k, NotImplemented)
-            if prev != v:
-                print "solver: %s=%r" % (k, v)
+        for k in dirty:
+            v = self.results[k]
+            if prev_results[k] != v:
+                print "solver: %s=%r" % (self.variables[k], v)
                 for cb in self.watchers.get(k, ()):
                     cb(v)
         
-        return self.results
+        return Results(self.results, self.variables)
+    
+    def evaluate_batch(self, freevars, values):
+        """computes every dependent variable for each row of the N x k array
+        `values` (columns following `freevars`) in one vectorized call; the
+        other free variables take their defaults. Returns ``(variables,
+        results)``, see linsys.evaluate_batch. Does not touch the watchers"""
+        given = set(symbols.id_of(k) for k in freevars)
+        fixed = {}
+        for k in self.get_freevars():
+            if k.id not in given and k.default is not None:
+                fixed[k.id] = k.default
+        solution = dict((self.variables[k], v) for k, v in self.solution.items())
+        return evaluate_batch(solution, freevars, values, fixed)
     
     def flash(self, var):
         self.update({var : 1})
@@ -115,9 +224,10 @@ class ConstraintSolver(object):
         self.update({var : val})
     
     def watch(self, var, callback):
-        if not var in self.watchers:
-            self.watchers[var] = []
-        self.watchers[var].append(callback)
+        id = symbols.id_of(var)                             # @ReservedAssignment
+        if not id in self.watchers:
+            self.watchers[id] = []
+        self.watchers[id].append(callback)
     
 
 
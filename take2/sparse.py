@@ -0,0 +1,164 @@
+"""
+Dict-of-rows sparse matrices. Layout equations touch only a handful of
+variables each, so storing just the nonzeros keeps memory (and elimination
+time) proportional to the number of nonzeros rather than equations x vars
+"""
+import heapq
+import numpy
+from collections import defaultdict
+
+
+class SparseMatrix(object):
+    """an augmented matrix stored as one ``{column : coeff}`` dict per row, plus
+    a separate list holding the constant (last) column"""
+    __slots__ = ["rows", "consts", "ncols", "fill_in"]
+    def __init__(self, ncols):
+        self.rows = []
+        self.consts = []
+        self.ncols = ncols
+        self.fill_in = 0
+    def __repr__(self):
+        return "<SparseMatrix %dx%d, %d nonzeros>" % (self.shape + (self.nnz,))
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def shape(self):
+        # same shape as the dense augmented matrix
+        return (len(self.rows), self.ncols + 1)
+    @property
+    def nnz(self):
+        return sum(len(row) for row in self.rows)
+
+    def append(self, row, const):
+        self.rows.append(row)
+        self.consts.append(const)
+
+    @classmethod
+    def from_dense(cls, mat):
+        m, n = mat.shape
+        smat = cls(n - 1)
+        for i in range(m):
+            cols = numpy.flatnonzero(mat[i, :-1])
+            smat.append(dict(zip(cols.tolist(), mat[i, cols].tolist())), float(mat[i, -1]))
+        return smat
+    def to_dense(self):
+        mat = numpy.zeros(self.shape, float)
+        for i, row in enumerate(self.rows):
+            for j, coeff in row.iteritems():
+                mat[i, j] = coeff
+            mat[i, -1] = self.consts[i]
+        return mat
+
+
+def _subtract_row(rows, consts, i, prow, col, epsilon, colrows):
+    """row i -= (row i)[col] * pivot row `prow`, keeping `colrows` (column ->
+    rows holding it) up to date. Returns the number of newly created nonzeros"""
+    row = rows[i]
+    c = row.pop(col)
+    colrows[col].discard(i)
+    created = 0
+    for j, v in rows[prow].iteritems():
+        if j == col:
+            continue
+        if j in row:
+            newv = row[j] - v * c
+            if abs(newv) <= epsilon:
+                del row[j]
+                colrows[j].discard(i)
+            else:
+                row[j] = newv
+        else:
+            row[j] = -v * c
+            colrows[j].add(i)
+            created += 1
+    consts[i] -= consts[prow] * c
+    return created
+
+def _strict_pivots(rows, active, ncols, epsilon):
+    """columns in increasing order, largest pivot among the unused rows"""
+    for col in range(ncols):
+        if not active[col]:
+            continue
+        prow = max(active[col], key = lambda i: abs(rows[i][col]))
+        if abs(rows[prow][col]) > epsilon:
+            yield prow, col
+
+def _markowitz_pivots(rows, active, blocks, epsilon, threshold):
+    """within each block of interchangeable columns, the column with the fewest
+    unused rows first, and in it the shortest row whose pivot is within
+    `threshold` of the column's largest"""
+    for block in blocks:
+        heap = [(len(active[col]), col) for col in block]
+        heapq.heapify(heap)
+        while heap:
+            count, col = heapq.heappop(heap)
+            if count != len(active[col]):
+                # stale entry; fill-in (or cancellation) changed the count
+                heapq.heappush(heap, (len(active[col]), col))
+                continue
+            if not count:
+                continue
+            largest = max(abs(rows[i][col]) for i in active[col])
+            if largest <= epsilon:
+                continue
+            limit = largest * threshold
+            prow = min((i for i in active[col] if abs(rows[i][col]) >= limit), key = lambda i: (len(rows[i]), i))
+            yield prow, col
+
+def eliminate_sparse(smat, epsilon, blocks = None, threshold = 0.1):
+    """Gauss-Jordan elimination of `smat`, in place: forward elimination over
+    the rows not yet pivoted, then back-substitution into the pivot rows.
+    
+    Without `blocks`, columns are pivoted in increasing order, so later
+    columns end up as the free ones. `blocks` is a list of lists of columns,
+    from least to most free; columns within a block are interchangeable, so
+    they are ordered Markowitz-style to limit fill-in (see _markowitz_pivots).
+    
+    Returns the list of ``(row, column)`` pivots; every other row is left
+    empty. The number of nonzeros created along the way is stored in
+    ``smat.fill_in``"""
+    rows = smat.rows
+    consts = smat.consts
+    # column -> rows, not yet pivoted, that have a nonzero in it
+    active = [set() for _ in range(smat.ncols)]
+    for i, row in enumerate(rows):
+        for j in row:
+            active[j].add(i)
+
+    if blocks is None:
+        candidates = _strict_pivots(rows, active, smat.ncols, epsilon)
+    else:
+        candidates = _markowitz_pivots(rows, active, blocks, epsilon, threshold)
+    pivots = []
+    fill_in = 0
+    for prow, col in candidates:
+        pivots.append((prow, col))
+        prowdict = rows[prow]
+        for j in prowdict:
+            active[j].discard(prow)
+        # normalize the pivot row (layout coefficients may well be ints)
+        pivot = float(prowdict[col])
+        for j in prowdict:
+            prowdict[j] /= pivot
+        prowdict[col] = 1.0
+        consts[prow] /= pivot
+        # eliminate the column from every unused row that has it
+        for i in list(active[col]):
+            fill_in += _subtract_row(rows, consts, i, prow, col, epsilon, active)
+
+    # pivot rows only hold their own and later pivots' columns now; clear those
+    # back to front so each row ends with its pivot and free columns only
+    pivot_cols = set(col for _, col in pivots)
+    holders = defaultdict(set)
+    for prow, col in pivots:
+        for j in rows[prow]:
+            if j != col and j in pivot_cols:
+                holders[j].add(prow)
+    for prow, col in reversed(pivots):
+        for i in list(holders[col]):
+            fill_in += _subtract_row(rows, consts, i, prow, col, epsilon, holders)
+    
+    smat.fill_in = fill_in
+    return pivots
+
@@ -0,0 +1,34 @@
+"""
+Checks of the benchmark suite's records, on small sizes
+"""
+import json
+import unittest
+from StringIO import StringIO
+import bench
+
+
+class BenchTest(unittest.TestCase):
+    def test_records(self):
+        """both backends build and solve the very same systems"""
+        out = StringIO()
+        bench.bench_layouts([20], out = out)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(records), len(bench.SCENARIOS) * len(bench.BACKENDS))
+        for scenario in bench.SCENARIOS:
+            take2, gremlin = [[r for r in records if r["scenario"] == scenario and r["backend"] == backend][0]
+                for backend in ["take2", "gremlin"]]
+            for field in ["variables", "equations", "nonzeros", "free"]:
+                self.assertEqual(take2[field], gremlin[field], (scenario, field))
+            self.assertEqual(take2["skipped"], [])
+            self.assertEqual(gremlin["skipped"], ["solve_sparse"])
+            self.assertIn("solve_sparse", take2["times"])
+
+    def test_dense_limit(self):
+        record = bench.bench_layout("take2", "grid", 40, dense_limit = 10)
+        self.assertEqual(record["skipped"], ["to_matrix", "eliminate", "solve_matrix", "solve"])
+        self.assertEqual(list(record["times"]), ["get_vars", "solve_sparse", "evaluate"])
+        self.assertGreater(record["free"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
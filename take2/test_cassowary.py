@@ -0,0 +1,105 @@
+"""
+Checks of the SimplexSolver: strengths, inequalities, removals, rollbacks and
+edit variables
+"""
+import random
+import unittest
+from linsys import LinEq, LinVar
+from cassowary import SimplexSolver, Constraint, UnsatisfiableConstraint, STRONG, MEDIUM, WEAK
+
+
+def window():
+    """the module's example: a box of preferred width 300, within [100, 400],
+    10 from the left edge of the window and at least 10 from its right edge"""
+    left, width, right = LinVar("cw_left"), LinVar("cw_width"), LinVar("cw_right")
+    window_width = LinVar("cw_window_width", "input")
+    constraints = [LinEq(right, left + width), LinEq(left, 10), Constraint(right, "<=", window_width - 10),
+        Constraint(width, ">=", 100), Constraint(width, "<=", 400), Constraint(width, "==", 300, WEAK)]
+    return constraints, (left, width, right, window_width)
+
+
+class SimplexTest(unittest.TestCase):
+    def assertValues(self, solver, expected):
+        for var, value in expected.items():
+            self.assertAlmostEqual(solver[var], value, msg = var)
+
+    def test_strengths(self):
+        x = LinVar("cs_x")
+        s = SimplexSolver()
+        weak = s.add_constraint(Constraint(x, "==", 10, WEAK))
+        self.assertValues(s, {x : 10})
+        medium = s.add_constraint(Constraint(x, "==", 20, MEDIUM))
+        self.assertValues(s, {x : 20})
+        s.add_constraint(Constraint(x, "<=", 15))
+        self.assertValues(s, {x : 15})
+        s.add_constraint(Constraint(x, "==", 5, STRONG))
+        self.assertValues(s, {x : 5})
+        s.add_constraint(Constraint(2 * x, ">=", 14))
+        self.assertValues(s, {x : 7})
+        self.assertTrue(s.has_constraint(weak) and s.has_constraint(medium))
+
+    def test_remove_constraint(self):
+        x, y = LinVar("cs_x"), LinVar("cs_y")
+        s = SimplexSolver()
+        s.add_constraint(Constraint(x, "==", 10, WEAK))
+        strong = s.add_constraint(Constraint(x, "==", 30, STRONG))
+        bound = s.add_constraint(Constraint(x, "<=", 20))
+        s.add_constraint(LinEq(y, x + 1))
+        self.assertValues(s, {x : 20, y : 21})
+        s.remove_constraint(bound)
+        self.assertValues(s, {x : 30, y : 31})
+        s.remove_constraint(strong)
+        self.assertValues(s, {x : 10, y : 11})
+        self.assertFalse(s.has_constraint(strong))
+        self.assertRaises(KeyError, s.remove_constraint, strong)
+
+    def test_rollback(self):
+        """an unsatisfiable constraint leaves the solver as it was"""
+        x, y = LinVar("cs_x"), LinVar("cs_y")
+        s = SimplexSolver()
+        s.add_constraint(Constraint(x, ">=", 10))
+        s.add_constraint(Constraint(x + y, "==", 30))
+        s.add_constraint(Constraint(y, "==", 5, WEAK))
+        self.assertValues(s, {x : 25, y : 5})
+        for bad in [Constraint(x, "<=", 5), Constraint(x + y, "==", 40), LinEq(2 * x + 2 * y, 61),
+                Constraint(y, ">=", 25)]:
+            self.assertRaises(UnsatisfiableConstraint, s.add_constraint, bad)
+            self.assertFalse(s.has_constraint(bad))
+            self.assertValues(s, {x : 25, y : 5})
+        s.add_constraint(Constraint(y, ">=", 12))
+        self.assertValues(s, {x : 18, y : 12})
+
+    def test_suggest_value(self):
+        """suggested values pushed across the width bounds and back"""
+        constraints, (left, width, right, window_width) = window()
+        s = SimplexSolver()
+        s.add_constraints(constraints)
+        s.add_edit_variable(window_width)
+        self.assertTrue(s.has_edit_variable(window_width))
+        for w, expected in [(800, (300, 800)), (200, (180, 200)), (100, (100, 120)), (500, (300, 500)),
+                (0, (100, 120)), (1000, (300, 1000))]:
+            s.suggest_value(window_width, w)
+            self.assertValues(s, {left : 10, width : expected[0], right : 10 + expected[0],
+                window_width : expected[1]})
+
+    def test_suggest_like_fresh(self):
+        """suggesting values ends where a new solver holding them strongly starts"""
+        constraints, variables = window()
+        window_width = variables[-1]
+        s = SimplexSolver()
+        s.add_constraints(constraints)
+        s.add_edit_variable(window_width)
+        rnd = random.Random(0)
+        for _ in range(30):
+            w = rnd.choice([rnd.uniform(0, 600), 120, 410, 420])
+            s.suggest_value("cw_window_width", w)
+            fresh = SimplexSolver()
+            fresh.add_constraints(constraints + [Constraint(window_width, "==", w, STRONG)])
+            self.assertValues(s, dict((v, fresh[v]) for v in variables))
+        s.remove_edit_variable(window_width)
+        self.assertFalse(s.has_edit_variable(window_width))
+        self.assertRaises(KeyError, s.suggest_value, window_width, 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+"""
+Checks of the DiskCache against solving without it
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import bench
+from linsys import LinSys, LinEq, NoSolutionsExist
+from diskcache import DiskCache
+from test_linsys import SolutionTestCase, generated, dense, contradicting
+
+
+class DiskCacheTest(SolutionTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_layouts(self):
+        cache = DiskCache(self.directory)
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            for affine in [False, True]:
+                self.assertSameSolution(cache.solve(ls, order, affine = affine), dense(ls, order))
+        self.assertEqual((cache.misses, cache.hits), (len(bench.SCENARIOS), len(bench.SCENARIOS)))
+        self.assertEqual(len(os.listdir(self.directory)), len(bench.SCENARIOS))
+
+    def test_key(self):
+        """the equations' order does not matter, their constants and the free
+        variables do"""
+        cache = DiskCache(self.directory)
+        ls, order = generated("grid")
+        key = cache.key(ls, order)
+        self.assertEqual(cache.key(LinSys(ls.equations[::-1]), order), key)
+        self.assertNotEqual(cache.key(ls, order[::-1]), key)
+        shifted = LinSys([LinEq(eq.lhs, eq.rhs + 7) for eq in ls.equations])
+        self.assertNotEqual(cache.key(shifted, order), key)
+
+    def test_another_process(self):
+        """a new cache over the same directory loads what the first one saved"""
+        ls, order = generated("nested")
+        DiskCache(self.directory).solve(ls, order)
+        cache = DiskCache(self.directory)
+        self.assertSameSolution(cache.solve(LinSys(ls.equations[::-1]), order), dense(ls, order))
+        self.assertEqual((cache.misses, cache.hits), (0, 1))
+
+    def test_damaged(self):
+        """a truncated file is solved again and replaced"""
+        cache = DiskCache(self.directory)
+        ls, order = generated("wide")
+        cache.solve(ls, order)
+        path = cache.path(cache.key(ls, order))
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) // 2)
+        self.assertSameSolution(cache.solve(ls, order), dense(ls, order))
+        self.assertSameSolution(cache.solve(ls, order), dense(ls, order))
+        self.assertEqual((cache.misses, cache.hits), (2, 1))
+
+    def test_contradiction(self):
+        cache = DiskCache(self.directory)
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            self.assertRaises(NoSolutionsExist, cache.solve, contradicting(ls), order)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
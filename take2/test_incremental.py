@@ -0,0 +1,94 @@
+"""
+Checks IncrementalSolver against solving its equations from scratch
+"""
+import random
+import unittest
+import bench
+from linsys import LinSys, LinEq, LinVar, FreeVar, NoSolutionsExist
+from incremental import IncrementalSolver
+from test_linsys import SolutionTestCase, generated, dense, contradicting
+
+
+class IncrementalTest(SolutionTestCase):
+    def assertMatches(self, inc, equations):
+        """`inc` solves like the dense solve of `equations` (key -> LinEq)"""
+        ls, order = self.reference(inc, equations)
+        expected = dense(ls, order)
+        for affine in [False, True]:
+            self.assertSameSolution(inc.solve(affine), expected)
+            self.assertSameSolution(dict((v, inc.value(v, affine)) for v in expected), expected)
+
+    def reference(self, inc, equations):
+        """`equations` as a LinSys, and its variables in `inc`'s column order"""
+        ls = LinSys(list(equations.values()))
+        rank = inc.rank or (lambda v: 0)
+        return ls, sorted(ls.get_vars(), key = lambda v: (rank(v), v.id))
+
+    def attempt(self, inc, equations, key, equation):
+        """adds `equation` to `inc` (in place of `key` if not None), or checks
+        that solving from scratch fails too"""
+        candidate = dict(equations)
+        candidate[object() if key is None else key] = equation
+        try:
+            key = inc.add(equation) if key is None else inc.replace(key, equation)
+        except NoSolutionsExist:
+            self.assertRaises(NoSolutionsExist, dense, *self.reference(inc, candidate))
+        else:
+            equations[key] = equation
+
+    def test_from_linsys(self):
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            inc = IncrementalSolver.from_linsys(ls, order)
+            self.assertMatches(inc, dict(zip(inc.keys, ls.equations)))
+            self.assertSameSolution(inc.to_linsys().solve(order), dense(ls, order))
+
+    def test_edits(self):
+        for seed, scenario in enumerate(bench.SCENARIOS):
+            rnd = random.Random(seed)
+            ls, order = generated(scenario)
+            inc = IncrementalSolver.from_linsys(ls, order)
+            equations = dict(zip(inc.keys, ls.equations))
+            removed = []
+            for _ in range(40):
+                edit = rnd.choice(["remove", "restore", "shift", "pin", "replace"])
+                key = rnd.choice(sorted(equations))
+                if edit == "remove" and len(equations) > 1:
+                    inc.remove(key)
+                    removed.append(equations.pop(key))
+                elif edit == "restore" and removed:
+                    self.attempt(inc, equations, None, removed.pop(rnd.randrange(len(removed))))
+                elif edit == "shift":
+                    eq = equations[key]
+                    self.attempt(inc, equations, key, LinEq(eq.lhs, eq.rhs + rnd.choice([-5, 5])))
+                elif edit == "pin":
+                    free = sorted((v for v, x in inc.solve().items() if isinstance(x, FreeVar)), key = str)
+                    if free:
+                        self.attempt(inc, equations, None, LinEq(rnd.choice(free), rnd.randint(0, 500)))
+                elif edit == "replace":
+                    self.attempt(inc, equations, key, LinEq(rnd.choice(order), rnd.randint(0, 500)))
+                self.assertEqual(inc.keys, sorted(equations))
+                self.assertMatches(inc, equations)
+
+    def test_contradiction(self):
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            inc = IncrementalSolver.from_linsys(ls, order)
+            equations = dict(zip(inc.keys, ls.equations))
+            bad = contradicting(ls).equations[-1]
+            self.assertRaises(NoSolutionsExist, inc.add, bad)
+            self.assertMatches(inc, equations)
+            self.assertRaises(NoSolutionsExist, IncrementalSolver, contradicting(ls).equations)
+
+    def test_failed_replace(self):
+        """the replaced equation comes back, with the variables only it used"""
+        x, z = LinVar("inc_x"), LinVar("inc_z")
+        inc = IncrementalSolver()
+        equations = {inc.add(LinEq(x + z, 3)) : LinEq(x + z, 3), inc.add(LinEq(x, 1)) : LinEq(x, 1)}
+        self.assertRaises(NoSolutionsExist, inc.replace, inc.keys[0], LinEq(x, 2))
+        self.assertEqual(inc.keys, sorted(equations))
+        self.assertMatches(inc, equations)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,675 @@
+"""
+Checks of the linsys backends against each other; run with
+``python -m unittest discover -p "test_*.py"`` from this directory
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+import bench
+import linsys
+from profiling import SolveStats
+from dsl import LabelNode, InputNode, HLayoutNode, VLayoutNode
+from solver import ConstraintSolver
+from presolve import peel_definitions, simplify
+from linsys import (LinSys, LinEq, LinVar, FreeVar, AffineExpr, NoSolutionsExist, FactorizationCache, SymbolTable, 
+    LinSum, LinSumBuilder, Coeff, ConstraintStore, 
+    solve_matrix, solve_blocked, solve_svd, evaluate_batch, _trailing_independent)
+
+# about as many variables as each generated scenario gets
+SIZES = {"wide" : 60, "tall" : 60, "nested" : 120, "grid" : 120, "form" : 120}
+# presolve and definitions on (the default) and off, as LinSys.solve options
+PASSES = [{}, {"presolve" : False, "definitions" : False}]
+
+
+def generated(scenario, seed = 0):
+    """a bench.LayoutGenerator system, and its variables from the least free
+    to the freest (the order ConstraintSolver solves with)"""
+    ls = bench.generate(linsys, scenario, SIZES[scenario], seed)
+    return ls, sorted(ls.get_vars(), key = lambda v: bench.FREENESS.index(v.kind))
+
+def dense(ls, order):
+    """the reference solution: the plain dense elimination"""
+    return ls.solve(order, presolve = False, definitions = False)
+
+def contradicting(ls):
+    """`ls` plus an equation contradicting a combination of two of its own"""
+    first, second = ls.equations[-1], ls.equations[len(ls.equations) // 2]
+    return LinSys(ls.equations + [LinEq(first.lhs + second.lhs, first.rhs + second.rhs + 1)])
+
+def fractional(fixed = None):
+    """a = 0.1 b + 0.7 d and c = 0.3 b + 2.1 d, along with c = 3 a, which
+    they imply: eliminating leaves round-off in the b and d columns"""
+    a, b, c, d = [LinVar("frac_%s" % (name,)) for name in "abcd"]
+    equations = [LinEq(a, 0.1 * b + 0.7 * d), LinEq(c, 0.3 * b + 2.1 * d), LinEq(c, 3 * a)]
+    if fixed is not None:
+        equations.append(LinEq(b, fixed))
+    return LinSys(equations), [a, c, b, d]
+
+def free_names(assignments):
+    return sorted(str(k) for k, v in assignments.items() if isinstance(v, FreeVar))
+
+def evaluate(assignments, seed = 0):
+    """name -> value of every variable, the free ones (sorted by name) taking
+    random values"""
+    free = sorted((k for k, v in assignments.items() if isinstance(v, FreeVar)), key = str)
+    values = numpy.random.RandomState(seed).uniform(-100, 100, len(free))
+    variables, results = evaluate_batch(assignments, free, [values])
+    evaluated = dict((str(v), x) for v, x in zip(free, values))
+    evaluated.update((str(v), x) for v, x in zip(variables, results[0]))
+    return evaluated
+
+class _SerialPool(object):
+    """LinSys.solve's process pool, without the processes"""
+    def map(self, func, iterable):
+        return map(func, iterable)
+
+
+class SolutionTestCase(unittest.TestCase):
+    def assertSameSolution(self, actual, expected, tol = 1e-6):
+        """the same free variables, and the same value for every variable once
+        they are set"""
+        self.assertEqual(free_names(actual), free_names(expected))
+        actual = evaluate(actual)
+        expected = evaluate(expected)
+        self.assertEqual(sorted(actual), sorted(expected))
+        for name, value in expected.items():
+            self.assertAlmostEqual(actual[name], value, delta = tol * (1 + abs(value)), msg = name)
+
+    def assertSatisfies(self, ls, assignments, tol = 1e-6):
+        """every equation of `ls` holds once the free variables are set"""
+        values = evaluate(assignments)
+        mat, vars = ls.to_matrix(dict((v, j) for j, v in enumerate(ls.get_vars())))  # @ReservedAssignment
+        x = numpy.array([values[str(v)] for v in vars])
+        self.assertLess(abs(mat[:, :-1].dot(x) - mat[:, -1]).max(), tol * (1 + abs(x).max()))
+
+
+class EliminateTest(unittest.TestCase):
+    """gremlin.linsys.eliminate, which take2's rref took over from"""
+    def test_same_as_loops(self):
+        for size in [3, 10, 40]:
+            mat = bench.random_system(size)
+            expected = mat.copy()
+            bench.gremlin_linsys.eliminate_loops(expected)
+            bench.gremlin_linsys.eliminate(mat)
+            self.assertTrue(numpy.array_equal(mat, expected))
+
+    def test_rank_deficient(self):
+        mat = bench.random_system(30, seed = 1)
+        mat[10] = mat[3] + mat[7]
+        mat[20] = 0.0
+        expected = mat.copy()
+        bench.gremlin_linsys.eliminate_loops(expected)
+        bench.gremlin_linsys.eliminate(mat)
+        self.assertTrue(numpy.array_equal(mat, expected))
+
+class SparseTest(SolutionTestCase):
+    def test_layouts(self):
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            for options in PASSES:
+                self.assertSameSolution(ls.solve(order, sparse = True, **options), dense(ls, order))
+
+    def test_fractional(self):
+        """round-off is neither pivoted on nor taken for a contradiction"""
+        for fixed in [None, 123457.7]:
+            ls, order = fractional(fixed)
+            expected = dense(ls, order)
+            self.assertEqual(len(free_names(expected)), 2 if fixed is None else 1)
+            for options in PASSES:
+                self.assertSameSolution(ls.solve(order, sparse = True, **options), expected)
+
+    def test_int_coefficients(self):
+        x, y = LinVar("int_x"), LinVar("int_y")
+        for options in PASSES:
+            solution = LinSys([LinEq(y, 3 * x), LinEq(y, 6)]).solve([x, y], sparse = True, **options)
+            self.assertEqual(solution, {x : 2.0, y : 6.0})
+
+    def test_contradiction(self):
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            for options in PASSES:
+                self.assertRaises(NoSolutionsExist, contradicting(ls).solve, order, sparse = True, **options)
+        ls, order = fractional()
+        ls.append(LinEq(order[1], 3 * order[0] + 0.001))
+        for options in PASSES:
+            self.assertRaises(NoSolutionsExist, ls.solve, order, sparse = True, **options)
+
+class MarkowitzTest(SolutionTestCase):
+    def test_layouts(self):
+        """free to pick other free variables, but as many of each kind"""
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            kinds = dict((str(v), v.kind) for v in order)
+            expected = sorted(kinds[name] for name in free_names(dense(ls, order)))
+            for options in PASSES:
+                solution = ls.solve(order, sparse = True, ordering = "markowitz", **options)
+                self.assertEqual(sorted(kinds[name] for name in free_names(solution)), expected)
+                self.assertSatisfies(ls, solution)
+
+    def test_fill_in(self):
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            fill_in = []
+            for ordering in [None, "markowitz"]:
+                stats = SolveStats()
+                ls.solve(order, sparse = True, ordering = ordering, stats = stats, **PASSES[1])
+                fill_in.append(stats.matrices[-1]["fill_in"])
+            self.assertLess(fill_in[1], fill_in[0])
+            self.assertIn("%d fill-in" % (fill_in[1],), stats.summary())
+
+    def test_fractional(self):
+        for fixed in [None, 123457.7]:
+            ls, order = fractional(fixed)
+            for options in PASSES:
+                self.assertSameSolution(ls.solve(order, sparse = True, ordering = "markowitz", **options), 
+                    dense(ls, order))
+
+    def test_contradiction(self):
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            for options in PASSES:
+                self.assertRaises(NoSolutionsExist, contradicting(ls).solve, order, sparse = True, 
+                    ordering = "markowitz", **options)
+
+class CacheTest(SolutionTestCase):
+    def test_layouts(self):
+        cache = FactorizationCache()
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            for _ in range(2):
+                self.assertSameSolution(ls.solve(order, cache = cache, **PASSES[1]), dense(ls, order))
+        self.assertEqual((cache.misses, cache.hits), (len(bench.SCENARIOS), len(bench.SCENARIOS)))
+        for options in PASSES:
+            self.assertSameSolution(ls.solve(order, cache = cache, **options), dense(ls, order))
+
+    def test_constants(self):
+        """the same coefficients with other constants"""
+        cache = FactorizationCache()
+        ls, order = generated("grid")
+        ls.solve(order, cache = cache, **PASSES[1])
+        changed = LinSys([LinEq(eq.lhs, eq.rhs + 7) for eq in ls.equations])
+        self.assertSameSolution(changed.solve(order, cache = cache, **PASSES[1]), dense(changed, order))
+        self.assertEqual((cache.misses, cache.hits), (1, 1))
+
+    def test_rebuilt(self):
+        """a layout rebuilt with new nodes (so new variables) and other sizes"""
+        cache = FactorizationCache()
+        for width in [80, 90, 100]:
+            root = LabelNode("Hello").X(width, 30) | InputNode()
+            solution = ConstraintSolver(root, cache = cache, **PASSES[1]).solution
+            self.assertEqual(solution[root.children[0].w.id], width)
+        self.assertEqual((cache.misses, cache.hits), (1, 2))
+
+    def test_contradiction(self):
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            for options in PASSES:
+                self.assertRaises(NoSolutionsExist, contradicting(ls).solve, order, cache = FactorizationCache(),
+                    **options)
+
+class DecomposeTest(SolutionTestCase):
+    def test_components(self):
+        ls, order = generated("grid")
+        p, q = LinVar("comp_p"), LinVar("comp_q")
+        both = LinSys([LinEq(p + q, 4)] + ls.equations + [LinEq(LinVar("comp_r"), 3), LinEq(0, 0), 
+            LinEq(p - q, 2)])
+        parts = both.components()
+        # widths and heights make two components of the layout
+        self.assertEqual(len(ls.components()), 2)
+        self.assertEqual(sorted(len(part.equations) for part in parts), 
+            sorted([1, 1, 2] + [len(part.equations) for part in ls.components()]))
+        self.assertEqual(set.union(*[part.get_vars() for part in parts]), both.get_vars())
+
+    def test_layouts(self):
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            for options in PASSES:
+                self.assertSameSolution(ls.solve(order, decompose = True, **options), dense(ls, order))
+
+    def test_pool(self):
+        ls, order = generated("nested")
+        self.assertTrue(len(order) >= linsys.PARALLEL_THRESHOLD)
+        for options in PASSES:
+            self.assertSameSolution(ls.solve(order, decompose = True, pool = _SerialPool(), **options), 
+                dense(ls, order))
+
+    def test_contradiction(self):
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            for options in PASSES:
+                for pool in [None, _SerialPool()]:
+                    self.assertRaises(NoSolutionsExist, contradicting(ls).solve, order, decompose = True, 
+                        pool = pool, **options)
+
+class AffineTest(SolutionTestCase):
+    def test_layouts(self):
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            for options in PASSES:
+                for backend in [{}, {"sparse" : True}]:
+                    solution = ls.solve(order, affine = True, **dict(options, **backend))
+                    self.assertSameSolution(solution, dense(ls, order))
+                    for value in solution.values():
+                        self.assertIsInstance(value, (float, FreeVar, AffineExpr))
+
+    def test_from_expr(self):
+        """every BinExpr chain of a solution, flattened"""
+        ls, order = generated("nested")
+        solution = dense(ls, order)
+        free = sorted((v for v, value in solution.items() if isinstance(value, FreeVar)), key = str)
+        values = dict((v, 10.0 * i) for i, v in enumerate(free))
+        for value in solution.values():
+            if hasattr(value, "eval") and not isinstance(value, FreeVar):
+                self.assertAlmostEqual(AffineExpr.from_expr(value).eval(values), value.eval(values))
+
+    def test_contradiction(self):
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            for options in PASSES:
+                self.assertRaises(NoSolutionsExist, contradicting(ls).solve, order, affine = True, **options)
+
+class BatchTest(unittest.TestCase):
+    def test_rows(self):
+        """each row is what evaluating the solution one vector at a time gives"""
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            for affine in [False, True]:
+                solution = ls.solve(order, affine = affine)
+                free = sorted((k for k, v in solution.items() if isinstance(v, FreeVar)), key = str)
+                values = numpy.random.RandomState(1).uniform(-100, 100, (5, len(free)))
+                for freevars in [free, [str(v) for v in free]]:
+                    variables, results = evaluate_batch(solution, freevars, values)
+                    self.assertEqual(results.shape, (5, len(variables)))
+                    for row, vector in zip(results, values):
+                        env = dict(zip(free, vector))
+                        for var, x in zip(variables, row):
+                            value = solution[var]
+                            expected = value.eval(env) if hasattr(value, "eval") else value
+                            self.assertAlmostEqual(x, expected, delta = 1e-9 * (1 + abs(expected)))
+
+    def test_fixed(self):
+        x, y, z = LinVar("batch_x"), LinVar("batch_y"), LinVar("batch_z")
+        solution = LinSys([LinEq(z, 2 * x + 3 * y + 1)]).solve([z, x, y])
+        self.assertRaises(ValueError, evaluate_batch, solution, [x], [[1.0]])
+        self.assertRaises(ValueError, evaluate_batch, solution, [x, y], [[1.0]])
+        variables, results = evaluate_batch(solution, ["batch_x"], [[1.0], [2.0]], {y : 10.0})
+        self.assertEqual(variables, [z])
+        self.assertEqual(results.tolist(), [[33.0], [35.0]])
+
+class PresolveTest(SolutionTestCase):
+    def test_simplify(self):
+        """x2 = 4 and x0 = x1 are replayed as steps, the proportional row goes"""
+        rows = [({2 : 2.0}, 8.0), ({0 : 1.0, 1 : -1.0}, 0.0), ({1 : 1.0, 2 : 1.0, 3 : 1.0}, 5.0), 
+            ({1 : 2.0, 3 : 2.0}, 2.0)]
+        self.assertEqual(simplify(rows, 4, 1e-9), ([({1 : 1.0, 3 : 1.0}, 1.0)], 
+            [("const", 2, 4.0), ("alias", 0, 1)]))
+
+    def test_int_coefficients(self):
+        """3x + y = 1 and 3x + 2y = 1 are not proportional"""
+        x, y = LinVar("int_x"), LinVar("int_y")
+        solution = LinSys([LinEq(3 * x + y, 1), LinEq(3 * x + 2 * y, 1)]).solve([x, y], definitions = False)
+        self.assertAlmostEqual(solution[x], 1 / 3.0)
+        self.assertAlmostEqual(solution[y], 0.0)
+
+    def test_layouts(self):
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            for affine in [False, True]:
+                self.assertSameSolution(ls.solve(order, definitions = False, affine = affine), dense(ls, order))
+
+    def test_contradiction(self):
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            self.assertRaises(NoSolutionsExist, contradicting(ls).solve, order, definitions = False)
+        x, y = LinVar("int_x"), LinVar("int_y")
+        self.assertRaises(NoSolutionsExist, LinSys([LinEq(x, y), LinEq(x, 1), LinEq(y, 2)]).solve)
+
+class DefinitionsTest(SolutionTestCase):
+    def test_peel(self):
+        """definitions are peeled in chains; rows sharing their lowest column
+        are substituted into each other, unless that costs too much"""
+        rows = [({0 : 1.0, 1 : -2.0}, 0.0), ({1 : 1.0, 2 : -1.0}, 3.0), ({2 : 1.0, 3 : 1.0}, 5.0), 
+            ({2 : 1.0, 3 : -1.0}, 1.0)]
+        self.assertEqual(peel_definitions(rows, 4, 1e-9, 0), (rows[:2], rows[2:]))
+        self.assertEqual(peel_definitions(rows, 4, 1e-9, 1), (rows[:3] + [({3 : -2.0}, -4.0)], []))
+        # substituting x2 + x3 = 5 leaves 0 = 1
+        contradiction = rows[2:3] + [({2 : 1.0, 3 : 1.0}, 6.0)]
+        self.assertEqual(peel_definitions(contradiction, 4, 1e-9, 1), (contradiction[:1], [({}, 1.0)]))
+        self.assertEqual(peel_definitions(rows[2:3] * 2, 4, 1e-9, 1), (rows[2:3], []))
+
+    def test_layouts(self):
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            for affine in [False, True]:
+                self.assertSameSolution(ls.solve(order, presolve = False, affine = affine), dense(ls, order))
+
+    def test_contradiction(self):
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            self.assertRaises(NoSolutionsExist, contradicting(ls).solve, order, presolve = False)
+
+    def test_stacked_forms(self):
+        """a form of label and field rows is solved by substitution alone,
+        however many rows it has"""
+        for count in [100, 200]:
+            form = VLayoutNode.foreach(HLayoutNode([LabelNode("name"), InputNode().X(None, 20), 
+                InputNode().X(None, 20)]) for _ in range(count))
+            stats = SolveStats()
+            ConstraintSolver(form, stats = stats)
+            self.assertNotIn("eliminate", stats.times)
+            self.assertEqual(stats.matrices, [])
+
+class SymbolTableTest(unittest.TestCase):
+    def test_release(self):
+        table = SymbolTable()
+        self.assertEqual([table.intern(name) for name in "abca"], [0, 1, 2, 0])
+        table.release(["b", 2, "missing"])
+        self.assertEqual((len(table), table.get("b"), table.get(1), table.get("c")), (1, None, None, None))
+        self.assertRaises(KeyError, table.id_of, "b")
+        self.assertEqual(sorted([table.intern("d"), table.intern("e"), table.intern("f")]), [1, 2, 3])
+        self.assertEqual(table.intern("a"), 0)
+
+    def test_rebuilt_layouts(self):
+        """releasing each layout's variables keeps the global table from growing"""
+        sizes = []
+        for i in range(5):
+            xs = [LinVar("released%d_%d" % (i, k)) for k in range(10)]
+            ls = LinSys([LinEq(xs[k], 2 * xs[k + 1] + k) for k in range(9)])
+            solution = ls.solve(xs)
+            self.assertEqual(free_names(solution), ["released%d_9" % (i,)])
+            linsys.symbols.release(ls.get_vars())
+            sizes.append(len(linsys.symbols.names))
+        self.assertEqual(len(set(sizes)), 1)
+
+class LinSumBuilderTest(unittest.TestCase):
+    def test_merged(self):
+        x, y = LinVar("sum_x"), LinVar("sum_y")
+        builder = LinSumBuilder(x, 2 * y, 3)
+        builder += LinSum(x, 4)
+        builder -= LinSumBuilder(y)
+        self.assertEqual(len(builder), 2)
+        self.assertEqual(builder.build(), LinSum(Coeff(x, 2), Coeff(y, 1), 7))
+        self.assertEqual(LinSumBuilder().build(), LinSum(0))
+        self.assertRaises(TypeError, builder.add, "sum_x")
+
+    def test_dsl_rows(self):
+        """a repeated variable of a dsl expression is written as one term"""
+        label = LabelNode("x")
+        label.X(width = label.h + 2 * label.h + 1)
+        store = label.get_constraints(ConstraintStore())
+        self.assertEqual(list(store.iter_rows()), [({label.w.id : 1.0, label.h.id : -3.0}, 1.0)])
+
+class StoreTest(SolutionTestCase):
+    def test_rows(self):
+        """LinEqs are flattened to ``sum(coeff * var) = const``, terms merged"""
+        x, y = LinVar("store_x"), LinVar("store_y")
+        store = ConstraintStore([LinEq(x + 2 * y + 1, 3 * x + 4)])
+        store.append_row([(y, 1.0), (x, 2.0), (y, 0.5)], 6.0)
+        self.assertEqual(len(store), 2)
+        self.assertEqual(list(store.iter_rows()), [({x.id : -2.0, y.id : 2.0}, 3.0), 
+            ({x.id : 2.0, y.id : 1.5}, 6.0)])
+        self.assertEqual(store.ordered_vars(), [x, y])
+        # whatever ids they got, in the order they were written in
+        zs = [LinVar("store_z%d" % (k,)) for k in range(30)][::-1]
+        self.assertEqual(ConstraintStore([LinEq(LinSum(*zs), 1)]).ordered_vars(), zs)
+        for solution in [LinSys(list(store)).solve([x, y]), LinSys(store).solve([x, y])]:
+            self.assertAlmostEqual(solution[x], 15 / 14.0)
+            self.assertAlmostEqual(solution[y], 18 / 7.0)
+
+    def test_layouts(self):
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            store = LinSys(ConstraintStore(ls.equations))
+            for options in PASSES:
+                for backend in [{}, {"sparse" : True}]:
+                    self.assertSameSolution(store.solve(order, **dict(options, **backend)), dense(ls, order))
+
+    def test_dsl(self):
+        """get_constraints writes the same rows into a store as it builds LinEqs for"""
+        root = LabelNode("a").X(40, 20) | (LabelNode("b") - InputNode()).X(None, 60)
+        equations, store = root.get_constraints(), root.get_constraints(ConstraintStore())
+        self.assertEqual(len(equations), len(store))
+        for eq, (terms, const) in zip(equations, store.iter_rows()):
+            self.assertEqual(ConstraintStore([eq]).iter_rows().next(), (terms, const))
+
+    def test_coo(self):
+        """the store's triples are those of its equations, however high its ids"""
+        padding = ["coo_pad%d" % (k,) for k in range(50000)]
+        for name in padding:
+            linsys.symbols.intern(name)
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            mine = [LinVar("coo_%s" % (v,)) for v in order]
+            renamed = dict((v.id, w) for v, w in zip(order, mine))
+            store = ConstraintStore()
+            for terms, const in ConstraintStore(ls.equations).iter_rows():
+                store.append_row([(renamed[id], coeff) for id, coeff in terms.items()], const)
+            rows, columns, data, consts = LinSys(store)._to_coo(dict((v.id, j) for j, v in enumerate(mine)))
+            mat = numpy.zeros((len(consts), len(mine) + 1))
+            mat[rows, columns] = data
+            mat[:, -1] = consts
+            self.assertTrue(numpy.array_equal(mat, ls.to_matrix(dict((v, j) for j, v in enumerate(order)))[0]))
+            linsys.symbols.release(mine)
+        linsys.symbols.release(padding)
+
+    def test_contradiction(self):
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            store = LinSys(ConstraintStore(contradicting(ls).equations))
+            for options in PASSES:
+                self.assertRaises(NoSolutionsExist, store.solve, order, **options)
+
+class CGLSTest(unittest.TestCase):
+    def free_values(self, ls, order):
+        """the dense solution evaluated, and the values of its free variables"""
+        expected = dense(ls, order)
+        values = evaluate(expected)
+        return values, dict((name, values[name]) for name in free_names(expected))
+
+    def test_layouts(self):
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            values, given = self.free_values(ls, order)
+            solution = ls.solve_iterative(given, order)
+            self.assertTrue(solution.converged)
+            self.assertEqual(len(solution), len(values))
+            for var, value in solution.items():
+                self.assertAlmostEqual(value, values[str(var)], delta = 1e-5 * (1 + abs(values[str(var)])), 
+                    msg = var)
+
+    def test_warm_start(self):
+        """starting from the previous solution takes fewer iterations"""
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            given = self.free_values(ls, order)[1]
+            cold = ls.solve_iterative(given, order)
+            given["window_width"] += 1.0
+            warm = ls.solve_iterative(given, order, x0 = cold)
+            self.assertLess(warm.iterations, ls.solve_iterative(given, order).iterations)
+            self.assertAlmostEqual(warm.residual, 0.0, delta = 1e-5)
+
+    def test_contradiction(self):
+        ls, order = generated("nested")
+        given = dict((name, 10.0) for name in free_names(dense(ls, order)))
+        self.assertRaises(NoSolutionsExist, contradicting(ls).solve_iterative, given, order)
+        self.assertRaises(ValueError, ls.solve_iterative, {"no_such_variable" : 1.0}, order)
+
+    def test_missing_values(self):
+        """the free variables must all be given, rather than silently take
+        the least squares values"""
+        ls, order = generated("nested")
+        given = dict((name, 10.0) for name in free_names(dense(ls, order)))
+        given.pop(sorted(given)[0])
+        self.assertRaises(ValueError, ls.solve_iterative, given, order)
+
+    def test_not_converged(self):
+        ls, order = generated("nested")
+        given = dict((name, 10.0) for name in free_names(dense(ls, order)))
+        solution = ls.solve_iterative(given, order, maxiter = 2)
+        self.assertFalse(solution.converged)
+        self.assertEqual(solution.iterations, 2)
+        self.assertGreater(solution.residual, 1e-5)
+
+class SeveralConstantsTest(SolutionTestCase):
+    def test_layouts(self):
+        """each constant column solves like a matrix of its own"""
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            mat, vars = ls.to_matrix(dict((v, j) for j, v in enumerate(order)))   # @ReservedAssignment
+            consts = numpy.random.RandomState(0).uniform(0, 500, (len(mat), 2))
+            for affine in [False, True]:
+                results = solve_matrix(numpy.hstack((mat[:, :-1], consts, mat[:, -1:])), vars, affine, nrhs = 3)
+                self.assertEqual(len(results), 3)
+                for column, result in zip([consts[:, 0], consts[:, 1], mat[:, -1]], results):
+                    single = numpy.hstack((mat[:, :-1], column[:, None]))
+                    self.assertSameSolution(result, solve_matrix(single, vars))
+
+    def test_errors(self):
+        ls, order = generated("wide")
+        mat, vars = ls.to_matrix(dict((v, j) for j, v in enumerate(order)))   # @ReservedAssignment
+        self.assertRaises(ValueError, solve_matrix, numpy.hstack((mat, mat[:, -1:])), vars, nrhs = 1)
+        self.assertRaises(ValueError, solve_matrix, numpy.hstack((mat, mat[:, -1:])).astype(numpy.float32), 
+            vars, nrhs = 2)
+
+    def test_contradiction(self):
+        """a contradiction in any of the columns fails that column alone"""
+        ls, order = generated("wide")
+        mat, vars = contradicting(ls).to_matrix(dict((v, j) for j, v in enumerate(order)))  # @ReservedAssignment
+        good = ls.to_matrix(dict((v, j) for j, v in enumerate(order)))[0][:, -1:]
+        good = numpy.vstack((good, good[-1] + good[len(good) // 2]))
+        bad = mat[:, -1:]
+        for columns in [(bad, bad), (good, bad), (bad, good), (good, good)]:
+            results = solve_matrix(numpy.hstack((mat[:, :-1],) + columns), vars, nrhs = 2)
+            self.assertEqual(len(results), 2)
+            for column, result in zip(columns, results):
+                if column is bad:
+                    self.assertIsInstance(result, NoSolutionsExist)
+                else:
+                    self.assertSameSolution(result, solve_matrix(numpy.hstack((mat[:, :-1], good)), vars))
+
+def rank_deficient(rnd, n, rank, m, scale = 1e4):
+    """a consistent m x n augmented matrix of the given rank, whose constants
+    grow with `scale`"""
+    coeffs = rnd.randn(m, rank).dot(rnd.randn(rank, n))
+    return numpy.hstack((coeffs, coeffs.dot(rnd.uniform(-scale, scale, n))[:, None]))
+
+class RankDeficientTest(SolutionTestCase):
+    def test_under_determined(self):
+        """every dependent variable refers to free ones only"""
+        mat = numpy.array([[1, 1, 0, 0, 1], [1, 1, 1, 0, 2], [0, 0, 1, 1, 3]], float)
+        a, b, c, d = [LinVar("ud_%s" % (name,)) for name in "abcd"]
+        for affine in [False, True]:
+            solution = solve_matrix(mat.copy(), [a, b, c, d], affine = affine)
+            self.assertIsInstance(solution[b], FreeVar)
+            self.assertEqual((solution[c], solution[d]), (1.0, 2.0))
+            self.assertEqual(solution[a].eval({b : 10}), -9.0)
+
+    def test_big_constants(self):
+        """round-off in the redundant rows is no contradiction"""
+        rnd = numpy.random.RandomState(0)
+        for _ in range(200):
+            n = rnd.randint(5, 30)
+            rank = rnd.randint(1, n)
+            mat = rank_deficient(rnd, n, rank, rnd.randint(rank, 40))
+            vars = ["rd%d" % (j,) for j in range(n)]                # @ReservedAssignment
+            solution = solve_matrix(mat.copy(), vars)
+            self.assertEqual(len(free_names(solution)), n - rank)
+            self.assertEqual(len(solve_matrix(numpy.hstack((mat, 2 * mat[:, -1:])), vars, nrhs = 2)), 2)
+            if len(mat) > rank:
+                mat[-1, -1] += 1.0
+                self.assertRaises(NoSolutionsExist, solve_matrix, mat, vars)
+
+    def test_pool(self):
+        rnd = numpy.random.RandomState(1)
+        for _ in range(5):
+            mat = rank_deficient(rnd, linsys.PARALLEL_THRESHOLD + 10, 80, 100)
+            vars = [LinVar("rd%d" % (j,)) for j in range(mat.shape[1] - 1)]    # @ReservedAssignment
+            ls = LinSys([LinEq(LinSum(*[Coeff(v, c) for v, c in zip(vars, row)]), row[-1]) for row in mat])
+            solution = ls.solve(vars, decompose = True, pool = _SerialPool(), **PASSES[1])
+            self.assertEqual(len(free_names(solution)), len(vars) - 80)
+
+class BlockedTest(SolutionTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def blocked_options(self):
+        """the float32, memmap and small budget variants, and their tolerances"""
+        return [({"dtype" : numpy.float32}, 1e-3), ({"storage" : self.directory}, 1e-6), 
+            ({"block_bytes" : 2 ** 12}, 1e-6), 
+            ({"storage" : self.directory, "dtype" : numpy.float32, "block_bytes" : 2 ** 14}, 1e-3)]
+
+    def test_layouts(self):
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            for options, tol in self.blocked_options():
+                for passes in PASSES:
+                    self.assertSameSolution(ls.solve(order, **dict(options, **passes)), dense(ls, order), tol)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_budgets(self):
+        """however few rows a block holds, the same pivots as rref()"""
+        rnd = numpy.random.RandomState(2)
+        for _ in range(20):
+            n = rnd.randint(5, 30)
+            rank = rnd.randint(1, n)
+            mat = rank_deficient(rnd, n, rank, rnd.randint(rank, 40), 10.0)
+            vars = [LinVar("bl%d" % (j,)) for j in range(n)]       # @ReservedAssignment
+            expected = solve_matrix(mat.copy(), vars)
+            for budget in [1, 4 * 8 * (n + 1) * 3, 2 ** 20]:
+                self.assertSameSolution(solve_blocked(mat.copy(), vars, budget = budget), expected)
+
+    def test_contradiction(self):
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            for options, _ in self.blocked_options():
+                for passes in PASSES:
+                    self.assertRaises(NoSolutionsExist, contradicting(ls).solve, order, **dict(options, **passes))
+        self.assertEqual(os.listdir(self.directory), [])
+        ls, order = generated("wide")
+        self.assertRaises(ValueError, ls.solve, order, sparse = True, dtype = numpy.float32)
+        self.assertRaises(ValueError, ls.solve, order, method = "svd", storage = self.directory)
+
+class SVDTest(SolutionTestCase):
+    def test_layouts(self):
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            for options in PASSES:
+                for affine in [False, True]:
+                    self.assertSameSolution(ls.solve(order, method = "svd", affine = affine, **options), 
+                        dense(ls, order))
+
+    def test_contradiction(self):
+        x = LinVar("x")
+        y = LinVar("y")
+        for options in [{}, {"presolve" : False}, {"presolve" : False, "definitions" : False}]:
+            ls = LinSys([LinEq(x, 1), LinEq(x, 2)])
+            self.assertRaises(NoSolutionsExist, ls.solve, [x], method = "svd", **options)
+        ls = LinSys([LinEq(x + y, 2), LinEq(2 * x + 2 * y, 5)])
+        self.assertRaises(NoSolutionsExist, ls.solve, method = "svd", presolve = False)
+
+    def test_no_variables(self):
+        self.assertRaises(NoSolutionsExist, solve_svd, numpy.array([[0.0], [3.0]]), [])
+        self.assertEqual(solve_svd(numpy.array([[0.0], [1e-12]]), []), {})
+
+    def test_trailing_independent(self):
+        """the rows a greedy scan from the end keeps, as solve_matrix would"""
+        rnd = numpy.random.RandomState(0)
+        for _ in range(200):
+            k = rnd.randint(1, 8)
+            rows = rnd.randn(rnd.randint(k, 40), k)
+            for i in range(len(rows)):
+                if rnd.rand() < 0.3:
+                    rows[i] = 2 * rows[rnd.randint(i + 1, len(rows))] if i + 1 < len(rows) else 0.0
+            expected = []
+            for j in range(len(rows) - 1, -1, -1):
+                if numpy.linalg.matrix_rank(rows[expected + [j]], 1e-9) == len(expected) + 1:
+                    expected.append(j)
+            self.assertEqual(_trailing_independent(rows), sorted(expected))
+
+
+if __name__ == "__main__":
+    unittest.main()
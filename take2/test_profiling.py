@@ -0,0 +1,71 @@
+"""
+Checks of the SolveStats a solve fills in
+"""
+import json
+import unittest
+import numpy
+from StringIO import StringIO
+import bench
+from linsys import solve_matrix
+from profiling import SolveStats, PHASES
+from test_linsys import generated, dense, free_names
+
+
+class SolveStatsTest(unittest.TestCase):
+    def test_phases(self):
+        for scenario in bench.SCENARIOS:
+            ls, order = generated(scenario)
+            seen = []
+            stats = SolveStats(lambda stats, phase, seconds: seen.append(phase))
+            solution = ls.solve(order, stats = stats, presolve = False, definitions = False)
+            self.assertEqual(list(stats.times), ["get_vars", "to_matrix", "eliminate", "assign"])
+            self.assertEqual(sorted(seen), sorted(stats.times))
+            mat = ls.to_matrix(dict((v, j) for j, v in enumerate(order)))[0]
+            self.assertEqual(stats.matrices, [{"shape" : mat.shape, "nonzeros" : numpy.count_nonzero(mat[:, :-1]),
+                "free" : len(free_names(solution))}])
+
+    def test_passes(self):
+        """presolving and peeling definitions add phases of their own"""
+        # the grid couples its columns, which leaves a matrix to eliminate
+        ls, order = generated("grid")
+        stats = SolveStats()
+        solution = ls.solve(order, stats = stats)
+        self.assertTrue(set(stats.times) <= set(PHASES))
+        self.assertIn("presolve", stats.times)
+        self.assertIn("definitions", stats.times)
+        self.assertGreater(stats.calls["assign"], 1)
+        # the passes hand their rows on: the variables are collected and the
+        # rows indexed once, and one matrix is built for what is left
+        self.assertEqual(stats.calls["get_vars"], 1)
+        self.assertEqual(stats.calls["to_matrix"], 2)
+        # the substitutions leave some variables free outside of it
+        self.assertEqual(len(stats.matrices), 1)
+        self.assertLess(stats.matrices[0]["shape"][0], len(ls.equations))
+        self.assertLessEqual(stats.matrices[0]["free"], len(free_names(solution)))
+        stats.clear()
+        self.assertEqual((stats.times, stats.calls, stats.matrices), ({}, {}, []))
+
+    def test_solve_matrix(self):
+        ls, order = generated("wide")
+        mat, vars = ls.to_matrix(dict((v, j) for j, v in enumerate(order)))   # @ReservedAssignment
+        stats = SolveStats()
+        solve_matrix(mat, vars, stats = stats)
+        self.assertEqual(list(stats.times), ["eliminate", "assign"])
+        self.assertEqual(stats.matrices[0]["free"], len(free_names(dense(ls, order))))
+
+    def test_report(self):
+        ls, order = generated("grid")
+        stats = SolveStats()
+        ls.solve(order, stats = stats)
+        out = StringIO()
+        stats.report(out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(out.getvalue(), stats.summary() + "\n")
+        self.assertEqual([line.split()[0] for line in lines[:len(stats.times) + 1]],
+            sorted(stats.times, key = PHASES.index) + ["total"])
+        self.assertEqual(len(lines), len(stats.times) + 1 + len(stats.matrices))
+        self.assertEqual(json.loads(json.dumps(stats.as_dict()))["calls"], dict(stats.calls))
+
+
+if __name__ == "__main__":
+    unittest.main()
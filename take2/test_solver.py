@@ -0,0 +1,108 @@
+"""
+Checks of ConstraintSolver's dependency graph, and of update, which only
+recomputes the variables depending on the free ones that changed, against
+recomputing everything
+"""
+import sys
+import random
+import unittest
+from StringIO import StringIO
+from linsys import LinVar
+from dsl import LabelNode, HLayoutNode, VLayoutNode
+from solver import ConstraintSolver
+
+
+def layout(depth = 4, seed = 0):
+    """alternating horizontal and vertical boxes of two labels, some of fixed
+    size, some sharing a width"""
+    rnd = random.Random(seed)
+    shared = LinVar("test_shared")
+    def build(depth, horizontal):
+        if depth == 0:
+            return LabelNode("x").X(rnd.choice([None, None, shared, 20, 30]), rnd.choice([None, 10]))
+        box = HLayoutNode if horizontal else VLayoutNode
+        return box([build(depth - 1, not horizontal) for _ in range(2)])
+    return build(depth, True)
+
+
+class GraphTest(unittest.TestCase):
+    def refs(self, solver):
+        """id -> ids of the other variables its expression refers to"""
+        return dict((k, solver._get_equation_vars(expr) & set(solver.solution) - set([k]))
+            for k, expr in solver.solution.items())
+
+    def test_order(self):
+        """every variable comes after the ones its expression refers to"""
+        for options in [{}, {"affine" : True}]:
+            solver = ConstraintSolver(layout(), **options)
+            self.assertEqual(sorted(solver.order), sorted(solver.solution))
+            for k, refs in self.refs(solver).items():
+                for ref in refs:
+                    self.assertLess(solver.positions[ref], solver.positions[k])
+                    self.assertIn(k, solver.dependents[ref])
+
+    def test_dependencies(self):
+        """the variables reached from each free one, as a fixed point of the
+        expressions' references"""
+        for options in [{}, {"affine" : True}]:
+            solver = ConstraintSolver(layout(), **options)
+            refs = self.refs(solver)
+            free = [var.id for var in solver.get_freevars()]
+            self.assertEqual(sorted(solver.dependencies), sorted(free))
+            for f in free:
+                reached = set([f])
+                while True:
+                    more = set(k for k, r in refs.items() if r & reached) - reached
+                    if not more:
+                        break
+                    reached |= more
+                self.assertEqual(solver.dependencies[f], reached)
+
+class UpdateTest(unittest.TestCase):
+    def setUp(self):
+        # update prints every change
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+    def tearDown(self):
+        sys.stdout = self.stdout
+
+    def test_against_full_recompute(self):
+        root = layout()
+        for options in [{}, {"affine" : True}, {"sparse" : True}]:
+            rnd = random.Random(0)
+            solver = ConstraintSolver(root, **options)
+            reference = ConstraintSolver(root, **options)
+            free = sorted(solver.get_freevars(), key = str)
+            values = dict((var, rnd.randint(0, 500)) for var in free)
+            calls = []
+            for var in solver.variables.values():
+                solver.watch(var, lambda value, var = var: calls.append((str(var), value)))
+            changes = dict(values)
+            previous = {}
+            for _ in range(30):
+                del calls[:]
+                results = solver.update(changes)
+                reference.results.clear()
+                expected = dict(reference.update(values))
+                self.assertEqual(dict(results), expected)
+                self.assertEqual(sorted(calls), sorted((str(var), v) for var, v in expected.items()
+                    if previous.get(var) != v))
+                previous = expected
+                # a few free variables, some keeping their value, by LinVar or by name
+                changes = {}
+                for var in rnd.sample(free, rnd.randint(1, 3)):
+                    values[var] = rnd.choice([values[var], rnd.randint(0, 500)])
+                    changes[rnd.choice([var, var.name])] = values[var]
+
+    def test_failed_update(self):
+        solver = ConstraintSolver(layout())
+        free = list(solver.get_freevars())
+        values = dict((var, 100) for var in free)
+        self.assertRaises(ValueError, solver.update, dict(values.items()[1:]))
+        results = solver.update(values)
+        reference = ConstraintSolver(solver.root)
+        self.assertEqual(dict(results), dict(reference.update(values)))
+
+
+if __name__ == "__main__":
+    unittest.main()